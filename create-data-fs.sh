@@ -23,12 +23,18 @@ nInputs=7
 nNeurons=4
 
 implementations=("unprotected" "protected" "circumvented")
-analyses=("corrls" "rankings" "ges" "plots")
+analyses=("corrls" "rankings" "moments" "ges" "plots")
 
 for implementation in "${implementations[@]}"; do
   mkdir -p "./data/$implementation"
 done
 
+# Profiles of the analysis stages (see 'python-utils/profiling.py')
+mkdir -p "./data/profiles"
+
+# Cached per-sample statistics and selected points of interest (see 'python-utils/poi.py')
+mkdir -p "./data/poi"
+
 for analysis in "${analyses[@]}"; do
   for implementation in "${implementations[@]}"; do
     for n in $(seq 0 ${nNeurons}); do
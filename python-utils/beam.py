@@ -0,0 +1,189 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy      as np
+import online_cpa as oc
+import os
+import params     as p
+import profiling  as prof
+import utils      as u
+
+from corrl import CorrlMoments
+
+## This script implements the sequential recovery of the weights of a neuron,
+## without the knowledge of the true weights.
+##
+## 'compute_ranking.py' attacks each input with the hypotheses of 'build_hyps.py',
+## which compute the accumulator of the preceeding inputs from the true weights.
+## Here, instead, the inputs of a neuron are attacked in processing order, and
+## the accumulator of the preceeding inputs is computed from the recovered
+## weights (extend-and-prune):
+## - the beam holds the 'beamWidth' best partial weight vectors, with their
+##   accumulator for each trace;
+## - each partial vector is extended with each weight candidate: the
+##   hypotheses (Hamming Weight of the accumulator plus the input times the
+##   candidate) of all the extensions are scored in a single correlation pass
+##   (see 'corrl.CorrlMoments');
+## - the 'beamWidth' extensions with the highest cumulative score (the sum of
+##   the maximum absolute correlation of each step) are kept, and their
+##   accumulators are updated incrementally.
+## The skipped MACs (if 'execs' is given) do not update the accumulator.
+##
+## The script saves, for each neuron and dataset, the final beam (weights in
+## processing order and scores), the best candidate of each step and the
+## position of the true partial weight vector in the beam at each step (-1 if
+## pruned) in '../data/beam/{implementation}-beam-neuron-{n}-extract-{db}.npz'.
+
+candidates = np.arange(1, 128, dtype = np.uint32)
+
+def recoverNeuron(windowOf, inputs, execs = None, beamWidth = 8, numInputs = p.imgWidth * p.imgHeight, chunkSize = 5000, trueWeights = None):
+  """
+  Recover the weights of a neuron.
+
+  Args:
+    - windowOf: callable returning, for the input k (processing order), the
+      samples where its accumulator leaks; matrix (numTraces, numSamples).
+    - inputs: the inputs, in processing order; matrix (numTraces, numInputs).
+    - execs: the executed MACs of the neuron, in processing order; boolean
+      matrix (numTraces, numInputs). If None, all the MACs are executed.
+    - beamWidth: the number of partial weight vectors kept at each step.
+    - chunkSize: the number of traces processed at time.
+    - trueWeights: if given (processing order), track the position of the true
+      partial weight vector in the beam.
+
+  Return: a tuple (weights, scores, best, truePositions), where:
+    - weights: the final beam; matrix (beamWidth, numInputs), best first.
+    - scores: the cumulative score of each partial weight vector of the beam.
+    - best: the best candidate of each step.
+    - truePositions: the position of the true partial weight vector in the beam at each step (-1 if pruned).
+  """
+
+  inputs = np.asarray(inputs, dtype = np.uint32)
+  numTraces = inputs.shape[0]
+
+  # Beam: partial weight vectors, cumulative scores and accumulators.
+  weights = np.zeros(shape = (1, 0), dtype = np.uint32)
+  scores = np.zeros(shape = 1, dtype = np.float64)
+  accums = np.zeros(shape = (1, numTraces), dtype = np.uint32)
+
+  best = []
+  truePositions = []
+  for k in range(0, numInputs):
+    x = windowOf(k)
+    macs = inputs[:, k] if execs is None else inputs[:, k] * execs[:, k]
+
+    with prof.stage('correlation') as s:
+      moments = CorrlMoments(x.shape[1], accums.shape[0] * candidates.shape[0])
+      for first in range(0, numTraces, chunkSize):
+        last = min(first + chunkSize, numTraces)
+        hyps = u.hwArray(accums[:, first:last, None] + macs[None, first:last, None] * candidates[None, None, :])
+        # (numBeams, numTraces, numCandidates) -> (numTraces, numBeams * numCandidates)
+        moments.update(x[first:last], hyps.transpose(1, 0, 2).reshape(last - first, -1))
+      s.addTraces(numTraces)
+
+    with prof.stage('pruning'):
+      stepScores = np.max(np.absolute(moments.corrl()), axis = 0).reshape(accums.shape[0], candidates.shape[0])
+      extended = (scores[:, None] + stepScores).reshape(-1)
+      keep = np.argsort(extended)[::-1][:beamWidth]
+      beams, cands = np.divmod(keep, candidates.shape[0])
+
+      weights = np.concatenate((weights[beams], candidates[cands, None]), axis = 1)
+      scores = extended[keep]
+      accums = accums[beams] + macs[None, :] * candidates[cands, None]
+
+    best.append(weights[0, -1])
+    if trueWeights is not None:
+      match = np.flatnonzero((weights == np.asarray(trueWeights[:k + 1], dtype = np.uint32)).all(axis = 1))
+      truePositions.append(match[0] if match.size else -1)
+      print(f">> Input #{k}: best {weights[0, -1]:#04x} -- true {trueWeights[k]:#04x} -- true prefix in beam at {truePositions[-1]}")
+    else:
+      print(f">> Input #{k}: best {weights[0, -1]:#04x}")
+
+  return weights, scores, np.asarray(best, dtype = np.uint32), np.asarray(truePositions, dtype = np.int64)
+
+datapath = '../data'
+
+# MLP implementations considered.
+available_implementations = ['unprotected', 'circumvented']
+implementation = 'unprotected'
+assert implementation in available_implementations
+
+databases_unprotected = [ '01-07-2025-15:20-21'
+                        , '01-07-2025-16:32-03'
+                        , '01-07-2025-17:47-50'
+                        , '01-07-2025-19:30-01'
+                        , '01-07-2025-20:44-19']
+
+databases_circumvented = [ '01-07-2025-15:55-33'
+                         , '01-07-2025-17:06-18'
+                         , '01-07-2025-18:21-37'
+                         , '01-07-2025-20:03-54'
+                         , '02-07-2025-05:41-16']
+
+databases = { 'unprotected' : databases_unprotected
+            , 'circumvented': databases_circumvented }
+
+firstWaveform = 0
+lastWaveform  = 50000
+
+firstNeuron = 0
+lastNeuron  = 2
+
+beamWidth = 8
+
+# Set to 'True' to record the wall/CPU time, I/O and memory of each stage (see
+# 'profiling.py').
+profile = False
+profilePath = f'{datapath}/profiles/beam-{implementation}'
+
+if __name__ == '__main__':
+  if profile:
+    prof.enable()
+
+  numInputs = p.imgWidth * p.imgHeight
+  os.makedirs(f'{datapath}/beam', exist_ok = True)
+
+  for db in databases[implementation]:
+    print(f">> Analysing database {db}")
+    with prof.stage('load'):
+      inputs = u.processingOrder(prof.npLoad(f'{datapath}/{implementation}/inputs-extract-{db}.npy')[firstWaveform:lastWaveform].astype(np.uint32))
+      if implementation == 'unprotected':
+        # Raw waveforms: the window of each input (see 'online_cpa.defaultWindow').
+        w = prof.npLoad(f'{datapath}/{implementation}/waveforms-extract-{db}.npy', mmap_mode = 'r')[firstWaveform:lastWaveform]
+        execMACs = None
+      else:
+        # Per-MAC segments (see 'macs_classification.py') and executed MACs.
+        w = prof.npLoad(f'{datapath}/{implementation}/segments-extract-{db}.npy', mmap_mode = 'r')[firstWaveform:lastWaveform]
+        execMACs = np.unpackbits(prof.npLoad(f'{datapath}/{implementation}/execMACs-extract-{db}.npy')[firstWaveform:lastWaveform], axis = 1).astype(bool)
+
+    for neuron in range(firstNeuron, lastNeuron):
+      print(f">> Neuron #{neuron}")
+      if implementation == 'unprotected':
+        windowOf = lambda k : np.array(w[:, slice(*oc.defaultWindow(neuron, k))])
+        execs = None
+      else:
+        windowOf = lambda k : np.array(w[:, neuron * numInputs + k, :])
+        execs = execMACs[:, neuron * numInputs:(neuron + 1) * numInputs]
+
+      trueWeights = u.processingOrder(p.weights[neuron * numInputs:(neuron + 1) * numInputs])
+      weights, scores, best, truePositions = recoverNeuron(windowOf, inputs, execs, beamWidth, trueWeights = trueWeights)
+
+      with prof.stage('save'):
+        np.savez(f'{datapath}/beam/{implementation}-beam-neuron-{neuron}-extract-{db}.npz', weights = weights, scores = scores, best = best, truePositions = truePositions)
+
+  if profile:
+    prof.report()
+    prof.saveJSON(f'{profilePath}.json')
+    prof.saveCSV(f'{profilePath}.csv')
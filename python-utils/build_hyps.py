@@ -16,6 +16,8 @@
 import functools  as fc
 import numpy      as np
 import params     as p
+import prefetch   as pf
+import profiling  as prof
 import utils      as u
 
 from alive_progress import alive_bar
@@ -95,40 +97,68 @@ databases_protected = [ '-extract-01-07-2025-15:55-33'
 databases = { 'unprotected' : databases_unprotected
             , 'protected'   : databases_protected }
 
+# Set to 'True' to record the wall/CPU time, I/O and memory of each stage
+# (see 'profiling.py'). The records are saved, in JSON and CSV format, with the
+# 'profilePath' prefix.
+profile = False
+profilePath = f'{datapath}/profiles/build-hyps-{implementation}'
+
+# Number of databases loaded in advance, on a background thread, while the
+# hypotheses of the current one are built (see 'prefetch.py'); 0 loads them
+# synchronously.
+prefetchDepth = 1
+
+def loadDatabase(suffix):
+  """ Load the inputs and the (packed) executed MACs of the database @suffix@. """
+  with prof.stage('load'):
+    inputs = prof.npLoad(f'{datapath}/{implementation}/inputs' + suffix + '.npy').astype(np.uint32)
+    execMACs = prof.npLoad(f'{datapath}/{implementation}/execMACs' + suffix + '.npy')
+  return inputs, execMACs
+
+def buildHyps(suffix, inputs, execMACs):
+  """
+  Build and save the accumulator's hypotheses of the database @suffix@ from its
+  inputs and (packed) executed MACs (see 'loadDatabase').
+  """
+  with prof.stage('unpack'):
+    weights = p.weights.astype(np.uint32)
+
+    # For each waveform, preserve only the employed weights
+    execMACs = np.asarray([u.binarise(e) for e in execMACs])
+
+  with prof.stage('hypotheses') as s:
+    # For standard CPA analysis
+    #execMACs = np.full(shape = (inputs.shape[0], weights.shape[0]), fill_value = 0x01, dtype = inputs.dtype)
+    weights = weights.reshape((1, weights.shape[0])) * execMACs
+
+    weights = np.asarray(np.split(weights, 5, axis = 1), dtype = np.uint32)
+
+    chunks = list(map(fc.partial(split, nChunks = 4), inputs))
+    inputs = np.asarray(list(map(flatten, list(map(rev, chunks)))), dtype = np.uint32)
+
+    neuronsPerWaveform = [ createNeurons(i, weights[:, index, :]) for index, i in enumerate(inputs) ]
+    _ = [ [ n.activate() for n in neurons ] for neurons in neuronsPerWaveform ]
+
+    hypsAccum = np.asarray([ [ n.intermAccums for n in neurons ] for neurons in neuronsPerWaveform ], dtype = np.uint32)
+    s.addTraces(inputs.shape[0])
+
+  with prof.stage('save'):
+    prof.npSave(f'{datapath}/circumvented/hyps-accum-extract' + suffix + '.npy', hypsAccum)
 
 if __name__ == '__main__':
   dbNumber = 0
   assert dbNumber >= 0 and dbNumber < len(databases[implementation])
 
+  if profile:
+    prof.enable()
+
   with alive_bar(len(databases[implementation])) as bar:
-    for suffix in databases[implementation]:
+    for suffix, (inputs, execMACs) in pf.prefetch(databases[implementation], loadDatabase, prefetchDepth):
       print(f'>> Database inputs{suffix}')
-      inputs = np.load(f'{datapath}/{implementation}/inputs' + suffix + '.npy').astype(np.uint32)
-      weights = p.weights.astype(np.uint32)
-
-      # For each waveform, preserve only the employed weights
-      execMACs = np.load(f'{datapath}/{implementation}/execMACs' + suffix + '.npy')
-      execMACs = np.asarray([u.binarise(e) for e in execMACs])
-
-      # For standard CPA analysis
-      #execMACs = np.full(shape = (inputs.shape[0], weights.shape[0]), fill_value = 0x01, dtype = inputs.dtype)
-      weights = weights.reshape((1, weights.shape[0])) * execMACs
-
-      weights = np.asarray(np.split(weights, 5, axis = 1), dtype = np.uint32)
-
-      chunks = list(map(fc.partial(split, nChunks = 4), inputs))
-      inputs = np.asarray(list(map(flatten, list(map(rev, chunks)))), dtype = np.uint32)
-
-      neuronsPerWaveform = [ createNeurons(i, weights[:, index, :]) for index, i in enumerate(inputs) ]
-      _ = [ [ n.activate() for n in neurons ] for neurons in neuronsPerWaveform ]
- 
-      hypsAccum = np.asarray([ [ n.intermAccums for n in neurons ] for neurons in neuronsPerWaveform ], dtype = np.uint32)
-      leakageHypsAccum = np.asarray([ [ list(map(u.hw, n.intermAccums)) for n in neurons ] for neurons in neuronsPerWaveform ], dtype = np.uint32)
-      leakageHypsMult  = np.asarray([ [ list(map(u.hw, n.intermMults)) for n in neurons ] for neurons in neuronsPerWaveform ], dtype = np.uint32)
-      leakageHypsLastAccum = np.asarray([ [ u.hw(n.lastAccum) for n in neurons ] for neurons in neuronsPerWaveform ], dtype = np.uint32)
-
-      #np.save(f'{datapath}/{implementation}/leakage-hyps-mult-extract'  + suffix + '.npy', leakageHypsMult)
-      #np.save(f'{datapath}/{implementation}/leakage-hyps-accum-extract' + suffix + '.npy', leakageHypsAccum)
-      #np.save(f'{datapath}/{implementation}/leakage-hyps-last-accum-extract' + suffix + '.npy', leakageHypsLastAccum)
-      np.save(f'{datapath}/circumvented/hyps-accum-extract' + suffix + '.npy', hypsAccum)
+      buildHyps(suffix, inputs, execMACs)
       bar()
+
+  if profile:
+    prof.report()
+    prof.saveJSON(f'{profilePath}.json')
+    prof.saveCSV(f'{profilePath}.csv')
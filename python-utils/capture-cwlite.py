@@ -18,8 +18,12 @@
 import chipwhisperer as cw
 import json
 import numpy as np
+import online_cpa as oc
 import pathlib as pl
 import params as p
+import quality as qg
+import sim_target as st
+import stream_classification as sc
 import sys
 import test_vector as tv
 import time
@@ -52,6 +56,44 @@ from importlib import reload
 
 datapath = './data'
 fwpath = "./main-CWLITEARM.hex"
+patternspath = './artefacts/patterns'
+
+# Set to 'True' to classify the MACs of each waveform while capturing (see
+# 'stream_classification.py'); the MACs classification is saved in 'datapath'
+# along with the waveforms.
+streamClassification = False
+
+# Set to 'True' to run an online CPA on the weights listed in 'onlineTargets'
+# while capturing (see 'online_cpa.py'). Each 'onlineEvery' waveforms, the
+# monitor prints the guessing entropy of each target; the capture stops once
+# every target has been ranked first in 'onlineStableSnapshots' consecutive
+# snapshots.
+onlineCPA = False
+onlineTargets = [ (0, 1), (0, 2), (0, 3) ]
+onlineEvery = 500
+onlineStableSnapshots = 5
+
+# Number of test vectors uploaded at once in the on-target queue (see
+# 'test_vector.collect'); the firmware must implement the queue commands ('q'
+# and 'i' with sub-command 0x01), which the published one does not. Set to 0
+# to send each test vector right before its inference.
+queueDepth = 0
+
+# Number of inferences verified at once against the digest of the target (see
+# 'test_vector.collect'); the firmware must be built with VERIFY_INFERENCE=1.
+# Set to 0 to disable the verification.
+verifyEvery = 0
+
+# Set to 'True' to check the quality of each trace while capturing (see
+# 'quality.py'): a trace failing the gate is recaptured with the same test
+# vector, up to 'maxRecaptures' times; the traces still failing are marked in
+# the 'faulty' dataset.
+qualityGate = False
+maxRecaptures = 3
+
+# Set to 'True' to run the campaign on the simulated scope and target (see
+# 'sim_target.py'), without the hardware.
+simulate = False
 
 def showSplashMsg(target):
   if (not p.isFlashed):
@@ -68,6 +110,9 @@ def showSplashMsg(target):
   print(msg)
 
 def flashTarget(scope):
+  if simulate:
+    return
+
   try:
     cw.program_target(scope, cw.programmers.STM32FProgrammer, fwpath)
   except Exception as e:
@@ -79,6 +124,11 @@ def storeWaveforms(waves, suffix):
 
   print(f"> Saved waveforms in {datapath}")
 
+def storeFaulty(faulty, suffix):
+  np.save(f'{datapath}/faulty{suffix}', faulty)
+
+  print(f"> Saved faulty waveforms in {datapath} ({np.count_nonzero(faulty)} faulty)")
+
 def storeExpParams(scope, target, IaPAM, toExecTables, inputs, seedInputs, seedMACPruning, enable, suffix):
   np.save(f'{datapath}/IaPAM{suffix}', IaPAM)
   np.save(f'{datapath}/toExecTables{suffix}', toExecTables)
@@ -136,6 +186,9 @@ def closeConnection(scope, target):
   target.dis()
 
 def openConnection():
+  if simulate:
+    return st.openConnection(patternspath)
+
   scope = cw.scope()
   target = cw.target(scope, cw.targets.SimpleSerial2)
 
@@ -185,9 +238,21 @@ def main():
       if (cmd == 'h'):
         showSplashMsg(target)
       elif (cmd == 'c'):
-        waves, IaPAM, toExecTables, inputs = tv.collect(scope, target, seedInputs, seedMACPruning, enable = enable)
         suffix = f'-extract-{datetime.utcnow().strftime("%d-%m-%Y-%H:%M-%S")}'
+        consumers = []
+        gate = qg.QualityGate(patternspath) if qualityGate else None
+        if streamClassification:
+          consumers.append(sc.StreamClassifier(datapath, suffix, patternspath))
+        if onlineCPA:
+          consumers.append(oc.OnlineCPAMonitor(onlineTargets, onlineEvery, onlineStableSnapshots, savePath = f'{datapath}/online-cpa{suffix}.npz'))
+        try:
+          waves, IaPAM, toExecTables, inputs, faulty = tv.collect(scope, target, seedInputs, seedMACPruning, enable = enable, consumers = consumers, queueDepth = queueDepth, verifyEvery = verifyEvery, gate = gate, maxRecaptures = maxRecaptures)
+        finally:
+          for c in consumers:
+            c.close()
         storeWaveforms(waves, suffix)
+        if verifyEvery > 0 or qualityGate:
+          storeFaulty(faulty, suffix)
         storeExpParams(scope, target, IaPAM, toExecTables, inputs, seedInputs, seedMACPruning, enable, suffix)
       elif (cmd == 'd'):
         enable = False
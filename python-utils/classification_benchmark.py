@@ -0,0 +1,207 @@
+#! /usr/bin/env python3
+
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import macs_classification as mc
+import numpy               as np
+import os
+import params              as p
+import preprocess          as pp
+import time
+import utils               as u
+
+## This script benchmarks the accuracy and the throughput of the MAC
+## classification ('macs_classification.py') against the ground truth saved by
+## the capture ('capture-cwlite.storeExpParams'): the MACs of each waveform are
+## skipped (0), executed (1) or important (2), in processing order, as given
+## by the IaPAM and the toExecTables loaded on the target (see 'groundTruth').
+##
+## Each configuration of 'configurations' sets the variables of
+## 'macs_classification.py' it lists (e.g., 'decoder', 'threshold',
+## 'preprocessing'); with 'preprocessing', the waveforms are preprocessed
+## before the classification (see 'preprocess.py'), and the preprocessing is
+## timed along with it. The first 'numWaves' waveforms of each dataset of
+## 'databases' are classified (the faulty ones excluded, see
+## 'test_vector.collect').
+##
+## For each configuration, it reports:
+## - the throughput (classified waveforms per second);
+## - the share of waveforms that could not be classified;
+## - the error rates of the MAC types (orderExecMACs), of the executed MACs
+##   (execMACs), of the neurons (with at least a wrong MAC) and of the
+##   waveforms (with at least a wrong MAC); the waveforms that could not be
+##   classified count as wrong;
+## - the confusion matrix of the MAC types.
+## The results are saved in 'resultsPath' (CSV); the fastest configuration
+## with a waveform error rate up to 'maxTraceErrorRate' (by default, without
+## any wrong waveform) is reported last. The configurations whose patterns
+## cannot be loaded are skipped, with a warning.
+
+datapath = "../data/protected"
+
+databases = mc.databases_protected
+
+numWaves = 1000
+
+configurations = { 'threshold'      : { 'decoder': 'threshold' }
+                 , 'viterbi'        : { 'decoder': 'viterbi' }
+                 , 'fast'           : { 'decoder': 'fast' }
+                 , 'viterbi-cycles' : { 'decoder': 'viterbi', 'preprocessing': 'cycles' }
+                 , 'fast-cycles'    : { 'decoder': 'fast', 'preprocessing': 'cycles' } }
+
+excludeFaulty = True
+
+maxTraceErrorRate = 0
+
+resultsPath = "../data/profiles/classification-benchmark.csv"
+
+types = ['skipped', 'executed', 'important']
+
+def groundTruth(IaPAM, toExecTables):
+  """
+  Retrieve the type of each MAC, in processing order, as 'orderExecMACs'.
+
+  Args:
+    - IaPAM: numpy array of shape (imgWidth * imgHeight // 8,).
+    - toExecTables: numpy array of shape (numWaves, nNeurons * imgWidth * imgHeight // 8).
+
+  Return: uint8 numpy array of shape (numWaves, nNeurons * imgWidth * imgHeight).
+  """
+  important = np.tile(np.unpackbits(np.asarray(IaPAM, dtype = np.uint8)), p.nNeurons)
+  return u.execMask(IaPAM, toExecTables).astype(np.uint8) + important
+
+def classify(waves, patternIMAC, patternNIMACExec, patternNIMACSkip):
+  """
+  Classify the MACs of @waves@ with the current configuration of
+  'macs_classification.py'.
+
+  Return: the orderExecMACs of the waveforms (255 if not classified); uint8
+  numpy array of shape (numWaves, nNeurons * imgWidth * imgHeight).
+  """
+  orderExecMACs = np.full(shape = (waves.shape[0], p.imgWidth * p.imgHeight * p.nNeurons), fill_value = 255, dtype = np.uint8)
+
+  if mc.decoder == 'threshold':
+    results = ( (index, mc.classifyWave(w, patternIMAC, patternNIMACExec, patternNIMACSkip)) for index, w in enumerate(waves) )
+  else:
+    results = mc.decodeWaves(waves, patternIMAC, patternNIMACExec, patternNIMACSkip)
+
+  for index, macs in results:
+    if macs is not None:
+      orderExecMACs[index] = macs[2]
+
+  return orderExecMACs
+
+def errorRates(orderExecMACs, truth):
+  """ Return the error rates (see above) of @orderExecMACs@ against @truth@; numpy arrays of the same shape. """
+  classified = orderExecMACs != 255
+  wrong = orderExecMACs != truth
+  wrongExec = ((orderExecMACs > 0) != (truth > 0)) | ~classified
+  wrongNeurons = wrong.reshape(wrong.shape[0], p.nNeurons, -1).any(axis = 2)
+
+  return { 'unclassified' : np.mean(~classified[:, 0])
+         , 'macs'         : np.mean(wrong)
+         , 'execMACs'     : np.mean(wrongExec)
+         , 'neurons'      : np.mean(wrongNeurons)
+         , 'traces'       : np.mean(wrongNeurons.any(axis = 1)) }
+
+def confusion(orderExecMACs, truth):
+  """ The confusion matrix of the MAC types of the classified waveforms: true type x classified type. """
+  classified = orderExecMACs[:, 0] != 255
+  counts = np.bincount(truth[classified].ravel().astype(np.int64) * len(types) + orderExecMACs[classified].ravel(), minlength = len(types) ** 2)
+  return counts.reshape(len(types), len(types))
+
+def loadDataset(db):
+  """ Load the first 'numWaves' waveforms of @db@ and their ground truth (see 'groundTruth'). """
+  waves = np.load(f'{datapath}/waveforms-extract-{db}.npy', mmap_mode = 'r')[:numWaves]
+  IaPAM = np.load(f'{datapath}/IaPAM-extract-{db}.npy')
+  toExecTables = np.load(f'{datapath}/toExecTables-extract-{db}.npy')[:numWaves]
+
+  keep = np.ones(shape = waves.shape[0], dtype = bool)
+  faultyPath = f'{datapath}/faulty-extract-{db}.npy'
+  if excludeFaulty and os.path.exists(faultyPath):
+    keep = ~np.load(faultyPath)[:numWaves]
+
+  return np.asarray(waves[keep], dtype = np.float32), groundTruth(IaPAM, toExecTables[keep])
+
+def benchmark(waves, truth, settings):
+  """ Classify @waves@ with the configuration @settings@; return its throughput, error rates and confusion matrix. """
+  defaults = { name: getattr(mc, name) for name in settings }
+  for name, value in settings.items():
+    setattr(mc, name, value)
+
+  try:
+    patternspath = pp.patternsPath('../artefacts/patterns', mc.preprocessing)
+    patterns = [ np.load(f'{patternspath}/pattern-{name}.npy') for name in ['IMAC', 'NIMACExec', 'NIMACSkip'] ]
+
+    start = time.perf_counter()
+    x = waves if mc.preprocessing is None else pp.apply(waves, pp.configs[mc.preprocessing])
+    orderExecMACs = classify(x, *patterns)
+    wall = time.perf_counter() - start
+  finally:
+    for name, value in defaults.items():
+      setattr(mc, name, value)
+
+  return waves.shape[0] / wall, errorRates(orderExecMACs, truth), confusion(orderExecMACs, truth)
+
+def main():
+  rows = []
+  for db in databases:
+    waves, truth = loadDataset(db)
+    print(f">> {db}: {waves.shape[0]} waveforms")
+
+    for name, settings in configurations.items():
+      try:
+        throughput, errors, matrix = benchmark(waves, truth, settings)
+      except FileNotFoundError as e:
+        print(f">> Warning: skipping {name}, missing patterns ({e.filename})")
+        continue
+      rows.append(dict(database = db, configuration = name, waves = waves.shape[0], throughput = throughput, **errors))
+
+      print(f">> {name}: {throughput:.1f} waveforms/s, unclassified {errors['unclassified']:.4f}, " +
+            f"error rates: MACs {errors['macs']:.5f}, execMACs {errors['execMACs']:.5f}, neurons {errors['neurons']:.4f}, waveforms {errors['traces']:.4f}")
+      print(f">> Confusion (true x classified, {'/'.join(types)}): {matrix.tolist()}")
+
+  if not rows:
+    print(">> No configuration could be benchmarked")
+    return
+
+  os.makedirs(os.path.dirname(resultsPath), exist_ok = True)
+  with open(resultsPath, 'w', newline = '') as fp:
+    writer = csv.DictWriter(fp, fieldnames = list(rows[0].keys()))
+    writer.writeheader()
+    writer.writerows(rows)
+  print(f">> Saved the results in {resultsPath}")
+
+  # The throughput and the waveform error rate of each configuration, over all the datasets.
+  summary = {}
+  for name in configurations:
+    selected = [ r for r in rows if r['configuration'] == name ]
+    if not selected:
+      continue
+    totalWaves = sum(r['waves'] for r in selected)
+    throughput = totalWaves / sum(r['waves'] / r['throughput'] for r in selected)
+    summary[name] = (throughput, sum(r['traces'] * r['waves'] for r in selected) / totalWaves)
+
+  accurate = [ name for name, (_, errorRate) in summary.items() if errorRate <= maxTraceErrorRate ]
+  if accurate:
+    fastest = max(accurate, key = lambda name : summary[name][0])
+    print(f">> Fastest configuration with waveform error rate <= {maxTraceErrorRate}: {fastest} ({summary[fastest][0]:.1f} waveforms/s, error rate {summary[fastest][1]:.4f})")
+  else:
+    print(f">> No configuration with waveform error rate <= {maxTraceErrorRate}")
+
+if __name__ == '__main__':
+  main()
@@ -16,8 +16,6 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import glob               as g
-import matplotlib.pyplot  as plt
-import matplotlib.style   as style
 import numpy              as np
 import params             as p
 
@@ -51,6 +49,7 @@ def computeGE(ranking):
 ## - unprotected
 ## - protected
 ## - circumvented
+## - templates (the template attack on the unprotected implementation, see 'templates.py')
 ## The implementation to analyse is indicatated by the 'implementation'
 ## variable.
 ## The script handles also traces partitioned according to the
@@ -64,32 +63,22 @@ def computeGE(ranking):
 ## assuming that the dataset path contains such strings.
 ## They do not change any other parameters in this script.
 ##
-## By default, the script saves the computed GEs.
-## The datapaths where the script peaks the rankings and saves the plots and GEs
-## are defined by 'datapathRanking', 'datapathPlots', 'datapathGE'.
+## The script saves the GE of the true weight of each input of a neuron, a
+## matrix (numInputs, numSnapshots), in
+##   '{datapathGE}/{implementation}/neuron-{n}/{implementation}-ge-input-{firstInput}-{lastInput}.npy'
+## (with the '-exec' and '-non-exec' suffixes for the partitioned traces).
+## The datapaths where the script peaks the rankings and saves the GEs are
+## defined by 'datapathRanking' and 'datapathGE'; set 'analysis' to the suffix
+## of the analysis to consider (e.g., '-lra', or '-poi-snr-10', see
+## 'compute_ranking.analysisSuffix'), none for the correlation analysis of the
+## whole window.
 ##
-## The script provides a 'toPlot' boolean variable to save in SVG format the
-## GE.
-##
-## NOTA BENE: certain plot-relatede parameteres (e.g., the plot title) are
-## hardcoded.
-
-# Matplotlib parameters
-plt.rcParams['font.family'] = 'serif'
-plt.rcParams['font.serif'] = ['Computer Modern Serif']
-plt.rcParams['font.size'] = 10
-plt.rcParams['font.weight'] = 'bold'
-plt.rcParams['text.usetex'] = True
-plt.rcParams['text.latex.preamble'] = r'\boldmath'
-
-style.use('tableau-colorblind10')
-
-toPlot = True
+## The plots are rendered from the saved GEs by 'reporting.py'.
 
 datapath='../data'
-datapathRanking=f'{datapath}/rankings'
-datapathPlots=f'{datapath}/plots'
-datapathGE=f'{datapath}/ges'
+analysis=''
+datapathRanking=f'{datapath}/rankings{analysis}'
+datapathGE=f'{datapath}/ges{analysis}'
 
 # Computation parameters
 firstInput = 7
@@ -103,7 +92,7 @@ numNeurons = lastNeuron - firstNeuron
 numWeights = 32
 
 # MLP implementations considered.
-available_implementations = ['unprotected', 'protected', 'circumvented']
+available_implementations = ['unprotected', 'protected', 'circumvented', 'templates']
 # Partition traces according to what weight to skip
 available_filteredTypes   = ['exec-5', 'non-exec-5', 'exec-7', 'non-exec-7']
 
@@ -117,16 +106,6 @@ assert implementation in available_implementations
 # Reverse the set of weights
 weights = np.flip(np.split(p.weights, p.weights.shape[0] // 8), axis = 1).reshape(-1)
 
-if toPlot:
-  #f, axs = plt.subplots(numNeurons, 1, figsize = (3.15, 2), sharex = True, sharey = True, dpi = 300)
-  fig = plt.figure(figsize = (7.15, 5), dpi = 300)
-  plt.suptitle(r"\textbf{Protected}")
-  fig.supylabel(r"\textbf{Guessing Entropy}")
-
-  gs = fig.add_gridspec(numNeurons, hspace = 0)
-  axs = gs.subplots(sharex = True, sharey = True)
-
-
 ## Compute the GE for each neuron and each weight.
 for n in range(firstNeuron, lastNeuron):
   weightsSetBegin = numWeights * n
@@ -200,47 +179,8 @@ for n in range(firstNeuron, lastNeuron):
         gePerInput.append(geTrueWeight)
       bar()
 
-  if toPlot:
-    axs[n].ticklabel_format(axis = 'x', style = 'sci', scilimits = (0, 0), useMathText=True)
-    axs[n].grid(axis = 'both', color = "lightgrey", linewidth = '0.5', linestyle = 'dashed')
-    axs[n].set_ylim(-0.99, 7.99)
-    axs[n].text(0.0, 6.0, r'\textbf{Neuron} ' + f'${n}$')
-    #axs[n].set_ylabel(r'\textbf{GE}')
-    axs[n].set_xlabel(r'\textbf{Traces}')
-    axs[n].xaxis.set_ticks(range(0, 251, 50))
-
-  if filteredWaveforms:
-    geExecPerInput = np.asarray(geExecPerInput)
-    geNonExecPerInput = np.asarray(geNonExecPerInput)
-
-    if toPlot:
-      for i, ge in enumerate(geExecPerInput[:, :]):
-        axs[n].plot(ge, label = r"$w_{5}$", linestyle = 'solid')
-      for i, ge in enumerate(geNonExecPerInput[:, :]):
-        axs[n].plot(ge, label = r"$w_{7}$", linestyle = 'dotted')
-
-
-    np.save(f'{datapathGE}/{implementation}/neuron-{n}/{implementation}-ge-input-{i}-exec.npy', geExecPerInput)
-    np.save(f'{datapathGE}/{implementation}/neuron-{n}/{implementation}-ge-input-{i}-non-exec.npy', geNonExecPerInput)
-  else:
-    gePerInput = np.asarray(gePerInput)
-    if toPlot:
-      for i, ge in enumerate(gePerInput[:, :]):
-        axs[n].plot(ge, label = r"$w_{1}$" + f"${i + 1}$")
-    np.save(f'{datapathGE}/{implementation}/neuron-{n}/{implementation}-ge-input-{i}.npy', gePerInput)
-
-if toPlot:
-  box = axs[numNeurons - 1].get_position()
-  axs[numNeurons - 1].set_position([box.x0, box.y0 + box.height * 0.1, box.width, box.height * 0.9])
-  leg = axs[numNeurons - 1].legend(loc='upper center', bbox_to_anchor=(0.5, -0.05),
-          fancybox=True, shadow=False, ncol=4, columnspacing = 0.75)
-
-  for line in leg.get_lines():
-      line.set_linewidth(1.75)
-
-
-  plt.tight_layout()
   if filteredWaveforms:
-    plt.savefig(f'{datapathPlots}/{implementation}/{implementation}-ge-input-{firstInput}-{lastInput}-filtered.svg')
+    np.save(f'{datapathGE}/{implementation}/neuron-{n}/{implementation}-ge-input-{firstInput}-{lastInput}-exec.npy', np.asarray(geExecPerInput))
+    np.save(f'{datapathGE}/{implementation}/neuron-{n}/{implementation}-ge-input-{firstInput}-{lastInput}-non-exec.npy', np.asarray(geNonExecPerInput))
   else:
-    plt.savefig(f'{datapathPlots}/{implementation}/{implementation}-ge-input-{firstInput}-{lastInput}.svg')
+    np.save(f'{datapathGE}/{implementation}/neuron-{n}/{implementation}-ge-input-{firstInput}-{lastInput}.npy', np.asarray(gePerInput))
@@ -13,12 +13,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import matplotlib.pyplot  as plt
-import matplotlib.patches as patches
 import numpy as np
+import lra
+import moment_store as ms
+import os
+import poi
+import prefetch as pf
+import preprocess as pp
+import profiling as prof
+import utils as u
 
 from build_hyps import flatten, rev, split
-from corrl      import onePassPearsonCorrl
+from corrl      import momentsPearsonCorrl, onePassPearsonCorrl
 from functools  import partial
 from params     import weights
 
@@ -124,9 +130,52 @@ if (implementation == 'circumvented'):
     # to provide results based on the same number of waveforms.
     lastWaveform = 24500
 
+# Set to the name of a preprocessing configuration (see 'preprocess.py') to
+# analyse the preprocessed waveforms (or the IMACs/segments classified from
+# them); the sample windows set above are scaled accordingly.
+preprocessing = None
+
+if preprocessing is not None:
+  firstSample = pp.scale(firstSample, preprocessing)
+  lastSample  = pp.scale(lastSample, preprocessing)
+  if implementation == 'protected':
+    neuronMinLength  = pp.scale(neuronMinLength, preprocessing)
+    neuronMaxLength  = pp.scale(neuronMaxLength, preprocessing)
+    subwaveMinLength = pp.scale(subwaveMinLength, preprocessing)
+    subwaveMaxLength = pp.scale(subwaveMaxLength, preprocessing)
+  else:
+    neuronLength  = pp.scale(neuronLength, preprocessing)
+    subwaveLength = pp.scale(subwaveLength, preprocessing)
+  if implementation == 'circumvented':
+    subwaveBegins = [ pp.scale(b, preprocessing) for b in subwaveBegins ]
+
+# Set to 'True' to analyse the per-MAC segments saved by
+# 'macs_classification.py' (datasets 'segments-extract-*.npy'), instead of the
+# concatenated IMACs: the correlation runs only on the 'segmentSpan' segments
+# starting at the MAC of the targeted input (100 samples each), without relying
+# on 'subwaveBegins' and 'neuronLength'.
+# Set 'segmentSpan = 2' to include the next MAC as well.
+# True allowed only for circumvented waveforms.
+useSegments = False
+segmentSpan = 1
+# The segment dataset to analyse: 'segments' or, e.g., 'segments-pca' for the
+# segments projected on their principal components (see 'pca.py').
+segmentsName = 'segments'
+assert not useSegments or implementation == 'circumvented'
+
 # Run the correlation analysis on this number of samples.
 windowSize = subwaveLength
 
+# Set 'numPOIs' > 0 to run the correlation analysis only on the 'numPOIs'
+# samples of the window with the highest 'poiMetric' score (see 'poi.py'),
+# where the classes are the Hamming Weight of the targeted accumulator. The
+# per-class statistics are computed once per dataset, target and window, and
+# cached in '../data/poi'; the indices of the selected samples are saved there
+# as well.
+numPOIs = 0
+poiMetric = 'snr'
+assert poiMetric in poi.available_metrics
+
 # Run the correlation analysis from firstNeuron to the lastNeuron.
 firstNeuron = 0
 lastNeuron  = 2
@@ -139,97 +188,274 @@ numInputs   = 32
 # Store the correlation score each 'corrlSampling' waveforms
 corrlSampling = 100
 
+# The distinguisher ranking the weight candidates:
+# - 'cpa': Pearson's correlation with the Hamming Weight of the accumulator;
+# - 'lra': linear regression on the bits of the accumulator (see 'lra.py'),
+#   ranking according to the R^2; the saved scores are the R^2.
+available_distinguishers = ['cpa', 'lra']
+distinguisher = 'cpa'
+assert distinguisher in available_distinguishers
+
+# Set to 'True' to compute the correlation ('cpa') on the raw ADC codes of the
+# waveforms (see 'utils.adcCodes'), accumulating the moments exactly in int64
+# (see 'corrl.CorrlMoments'), instead of the one-pass floating point update.
+# True allowed only for the waveforms that are not preprocessed nor projected.
+integerCorrl = False
+assert not integerCorrl or (preprocessing is None and segmentsName == 'segments')
+
+# Set to 'True' to save the correlation analysis ('cpa') as the moments of
+# each block of 'corrlSampling' waveforms (see 'moment_store.py'), in
+# '../data/moments', instead of the correlation scores. If the moments of the
+# target are already saved, only the waveforms following the stored ones (up to
+# 'lastWaveform') are analysed and appended. The rankings are saved as usual.
+saveMoments = False
+assert not saveMoments or (distinguisher == 'cpa' and numPOIs == 0)
+
+def analysisSuffix():
+  """
+  Return the suffix of the folders of the scores and rankings ('../data/corrls',
+  '../data/rankings'), so that the analyses with another distinguisher or on
+  the POIs do not overwrite the correlation analysis of the whole window (see
+  'analysis' in 'compute_ge.py').
+  """
+  suffix = '' if distinguisher == 'cpa' else f'-{distinguisher}'
+  return suffix + (f'-poi-{poiMetric}-{numPOIs}' if numPOIs > 0 else '')
+
+# Set to 'True' to record the wall/CPU time, I/O and memory of each stage of
+# the analysis (see 'profiling.py'). The records are saved, in JSON and CSV
+# format, with the 'profilePath' prefix.
+profile = False
+profilePath = f'../data/profiles/compute-ranking-{implementation}'
+
+# Number of datasets loaded in advance, on a background thread, while the
+# current one is analysed (see 'prefetch.py'); 0 loads them synchronously.
+prefetchDepth = 1
+
 # Reverse the weights.
 weights = np.flip(np.split(weights, weights.shape[0] // 8), axis = 1).reshape(-1)
 
-# Compute correlation and ranking on each database.
-for db in databases[implementation]:
-  wavesPath     = f'../data/{implementation}/waveforms-extract-{db}.npy'
-  inpsPath      = f'../data/{implementation}/inputs-extract-{db}.npy'
-  accumHypsPath = f'../data/{implementation}/hyps-accum-extract-{db}.npy'
-
-  print(f">> Analysing database {db}")
-
-  w = []
-  i = []
-  if not filteredWaveforms:
-    w = np.load(wavesPath)[firstWaveform:lastWaveform, firstSample:lastSample]
-
-    # reverse the inputs.
-    i = np.load(inpsPath)[firstWaveform:lastWaveform, :].astype(np.uint32)
-    chunks = list(map(partial(split, nChunks = 4), i))
-    i = np.asarray(list(map(flatten, list(map(rev, chunks)))), dtype = np.uint32)
-
-  # Iterate over each neuron.
-  for neuron in range(firstNeuron, lastNeuron):
-    if filteredWaveforms:
-      wavesPath     = f'../data/{implementation}/waveforms-extract-neuron-{neuron}-{filteredType}-{db}.npy'
-      inpsPath      = f'../data/{implementation}/inputs-extract-neuron-{neuron}-{filteredType}-{db}.npy'
-      accumHypsPath = f'../data/{implementation}/hyps-accum-extract-neuron-{neuron}-{filteredType}-{db}.npy'
-      w = np.load(wavesPath)[firstWaveform:lastWaveform, firstSample:lastSample]
-      # reverse the inputs.
-      i = np.load(inpsPath)[firstWaveform:lastWaveform, :].astype(np.uint32)
-      chunks = list(map(partial(split, nChunks = 4), i))
-      i = np.asarray(list(map(flatten, list(map(rev, chunks)))), dtype = np.uint32)
-
-    # Iterate over each input/weight/MAC.
-    for inputIndex in range(firstInput, lastInput):
-      print(f">> Input #{inputIndex} -- Neuron #{neuron}")
-
-      neuronShift = neuron * numInputs
-      neuronWaveBegin = neuron * neuronLength
-
-      weightsSet = inputIndex // 8
-      weightsSetBegin = weightsSet * 8 + neuronShift
-      weightsSetEnd = weightsSetBegin + 8
-
-      inputSetWaveBegin = neuronWaveBegin + ((inputIndex) // 8) * subwaveLength
-      inputSetWaveEnd = inputSetWaveBegin + subwaveLength
-
-      if implementation == 'protected':
-        neuronMinWaveBegin = neuron * neuronMinLength
-        neuronMaxWaveBegin = neuron * neuronMaxLength
-        inputSetMaxWaveBegin = neuronMaxWaveBegin + ((inputIndex) // 8) * subwaveMaxLength
-        inputSetWaveBegin = neuronMinWaveBegin + ((inputIndex) // 8) * subwaveMinLength
-        inputSetWaveEnd = inputSetMaxWaveBegin + subwaveMaxLength
-
-      if implementation == "circumvented":
-        neuronWaveBegin = neuron * neuronLength
-        inputSetWaveBegin = neuronWaveBegin + subwaveBegins[((inputIndex) // 8)]
-        inputSetWaveEnd = inputSetWaveBegin + subwaveLength
-        if inputSetWaveEnd > lastSample:
-          inputSetWaveEnd = lastSample
-        
-      trueWeight = weights[weightsSetBegin:weightsSetEnd][inputIndex % 8]
-
-      subwave = w[:, inputSetWaveBegin:inputSetWaveEnd]
-
-      # Load precomputed accumulator's hypotheses for the preceeding weight.
-      hyps = np.load(accumHypsPath)[firstWaveform:lastWaveform, neuron, (inputIndex - 1):inputIndex]
-      inputs = i[:, inputIndex:inputIndex + 1]
-
-      # Hypotheses computation.
-      # Target the accumulator; Hamming Weight leakage model.
+wavesName = segmentsName if useSegments else 'waveforms'
+
+def loadWaves(path, mmap = False):
+  """
+  Load the waveforms (or the segments) in @path@. If @mmap@ is set, or if the
+  segments are analysed, the waveforms are memory-mapped, and the samples of
+  each input are read when analysed.
+  """
+  if useSegments:
+    return prof.npLoad(path, mmap_mode = 'r')[firstWaveform:lastWaveform]
+  w = prof.npLoad(path, mmap_mode = 'r')[firstWaveform:lastWaveform, firstSample:lastSample]
+  return w if mmap else np.array(w)
+
+def loadInputs(path):
+  """ Load the inputs in @path@, reversed as processed by the MLP. """
+  i = prof.npLoad(path)[firstWaveform:lastWaveform, :].astype(np.uint32)
+  chunks = list(map(partial(split, nChunks = 4), i))
+  return np.asarray(list(map(flatten, list(map(rev, chunks)))), dtype = np.uint32)
+
+def loadAccumHyps(path):
+  """ Memory-map the precomputed accumulator's hypotheses in @path@. """
+  return prof.npLoad(path, mmap_mode = 'r')[firstWaveform:lastWaveform]
+
+def datasetPaths(db, neuron = None, filteredType = None):
+  """
+  Return the paths of the waveforms, inputs and accumulator's hypotheses of
+  the dataset @db@ (of the partition @filteredType@ of @neuron@, if given).
+  """
+  if filteredType is None:
+    return ( f'../data/{implementation}/{wavesName}-extract-{db}{pp.datasetSuffix(preprocessing)}.npy'
+           , f'../data/{implementation}/inputs-extract-{db}.npy'
+           , f'../data/{implementation}/hyps-accum-extract-{db}.npy' )
+  return ( f'../data/{implementation}/{wavesName}-extract-neuron-{neuron}-{filteredType}-{db}{pp.datasetSuffix(preprocessing)}.npy'
+         , f'../data/{implementation}/inputs-extract-neuron-{neuron}-{filteredType}-{db}.npy'
+         , f'../data/{implementation}/hyps-accum-extract-neuron-{neuron}-{filteredType}-{db}.npy' )
+
+def loadDataset(wavesPath, inpsPath, accumHypsPath):
+  """ Load the waveforms, inputs and accumulator's hypotheses of a dataset (see 'datasetPaths'). """
+  with prof.stage('load'):
+    return loadWaves(wavesPath), loadInputs(inpsPath), loadAccumHyps(accumHypsPath)
+
+def inputWindow(neuron, inputIndex):
+  """ Return the window of samples (first, last) where the given input is analysed. """
+
+  neuronWaveBegin = neuron * neuronLength
+
+  inputSetWaveBegin = neuronWaveBegin + ((inputIndex) // 8) * subwaveLength
+  inputSetWaveEnd = inputSetWaveBegin + subwaveLength
+
+  if implementation == 'protected':
+    neuronMinWaveBegin = neuron * neuronMinLength
+    neuronMaxWaveBegin = neuron * neuronMaxLength
+    inputSetMaxWaveBegin = neuronMaxWaveBegin + ((inputIndex) // 8) * subwaveMaxLength
+    inputSetWaveBegin = neuronMinWaveBegin + ((inputIndex) // 8) * subwaveMinLength
+    inputSetWaveEnd = inputSetMaxWaveBegin + subwaveMaxLength
+
+  if implementation == "circumvented":
+    neuronWaveBegin = neuron * neuronLength
+    inputSetWaveBegin = neuronWaveBegin + subwaveBegins[((inputIndex) // 8)]
+    inputSetWaveEnd = inputSetWaveBegin + subwaveLength
+    if inputSetWaveEnd > lastSample:
+      inputSetWaveEnd = lastSample
+
+  return inputSetWaveBegin, inputSetWaveEnd
+
+def analyse(w, i, accumHyps, db, neuron, inputIndex, filteredType = None):
+  """
+  Compute and save the correlation scores and the ranking of the weight
+  candidates of the given input.
+
+  Args:
+    - w: the waveforms (or segments), possibly memory-mapped (see 'loadWaves').
+    - i: the reversed inputs (see 'loadInputs').
+    - accumHyps: the accumulator's hypotheses (see 'loadAccumHyps').
+    - db: the dataset name.
+    - neuron, inputIndex: the targeted weight.
+    - filteredType: the partition of the waveforms, if any.
+  """
+
+  neuronShift = neuron * numInputs
+
+  weightsSet = inputIndex // 8
+  weightsSetBegin = weightsSet * 8 + neuronShift
+  weightsSetEnd = weightsSetBegin + 8
+
+  trueWeight = weights[weightsSetBegin:weightsSetEnd][inputIndex % 8]
+
+  savePathCorrls = f'../data/corrls{analysisSuffix()}/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-corrls-input-{inputIndex}-neuron-{neuron}-extract-{db}{pp.datasetSuffix(preprocessing)}.npy'
+  savePathRankings = f'../data/rankings{analysisSuffix()}/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-ranking-per-sample-input-{inputIndex}-neuron-{neuron}-extract-{db}{pp.datasetSuffix(preprocessing)}.npy'
+  savePathMoments = f'../data/moments/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-moments-input-{inputIndex}-neuron-{neuron}-extract-{db}{pp.datasetSuffix(preprocessing)}.npz'
+
+  if filteredType is not None:
+    savePathCorrls = f'../data/corrls{analysisSuffix()}/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-corrls-input-{inputIndex}-neuron-{neuron}-extract-{filteredType}-{db}{pp.datasetSuffix(preprocessing)}.npy'
+    savePathRankings = f'../data/rankings{analysisSuffix()}/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-ranking-per-sample-input-{inputIndex}-neuron-{neuron}-extract-{filteredType}-{db}{pp.datasetSuffix(preprocessing)}.npy'
+    savePathMoments = f'../data/moments/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-moments-input-{inputIndex}-neuron-{neuron}-extract-{filteredType}-{db}{pp.datasetSuffix(preprocessing)}.npz'
+
+  # Analyse only the waveforms following the ones whose moments are stored.
+  store = None
+  firstNew = 0
+  if saveMoments and os.path.exists(savePathMoments):
+    with prof.stage('load'):
+      store = ms.MomentStore.load(savePathMoments)
+    firstNew = store.numTraces
+    print(f">> Appending waveforms #{firstWaveform + firstNew}--{lastWaveform} to the stored moments")
+
+  if useSegments:
+    # Segments of the targeted MAC (and of the next ones, if segmentSpan > 1).
+    macIndex = neuronShift + inputIndex
+    with prof.stage('load'):
+      subwave = np.array(w[firstNew:, macIndex:macIndex + segmentSpan, :])
+      subwave = subwave.reshape(subwave.shape[0], -1)
+    inputSetWaveBegin = macIndex * w.shape[2]
+    inputSetWaveEnd = inputSetWaveBegin + subwave.shape[1]
+  else:
+    inputSetWaveBegin, inputSetWaveEnd = inputWindow(neuron, inputIndex)
+    with prof.stage('load'):
+      subwave = np.asarray(w[firstNew:, inputSetWaveBegin:inputSetWaveEnd])
+
+  dataset = f'{implementation}-{wavesName}-{filteredType}-{db}' if filteredType is not None else f'{implementation}-{wavesName}-{db}'
+  dataset = dataset + pp.datasetSuffix(preprocessing)
+
+  if numPOIs > 0:
+    # Select the samples leaking the accumulator of the targeted input, i.e.,
+    # the accumulator of the preceeding input plus the true product (the
+    # hypotheses are read only if the statistics are not cached).
+    def classes():
+      accum = np.asarray(accumHyps[:, neuron, inputIndex - 1], dtype = np.uint32) if inputIndex > 0 else 0
+      return poi.hwClasses(accum + i[:, inputIndex] * trueWeight)
+    statsPath = poi.cachePath('../data', dataset, neuron, inputIndex, inputSetWaveBegin, inputSetWaveEnd, firstWaveform, lastWaveform)
+    pois = poi.selectPOIs(poi.cachedStats(statsPath, subwave, classes).score(poiMetric), numPOIs)
+    subwave = subwave[:, pois]
+
+  with prof.stage('hypotheses'):
+    # Precomputed accumulator's hypotheses for the preceeding weight.
+    hyps = np.asarray(accumHyps[firstNew:, neuron, (inputIndex - 1):inputIndex])
+    inputs = i[firstNew:, inputIndex:inputIndex + 1]
+
+    # Hypotheses computation.
+    # Target the accumulator; Hamming Weight leakage model.
+    if distinguisher == 'cpa':
       hypsLast = np.asarray([ (np.bitwise_count(hyps + (inputs * weight))[:, 0]) for weight in range(1, 128)], dtype = np.uint32).transpose().astype(np.float32)
 
-      # Compute the Pearson's Correlation Coefficient
-      corrls = onePassPearsonCorrl(subwave, hypsLast, corrlSampling, lastWaveform)
-
+  if distinguisher == 'lra':
+    # Linear regression on the bits of the accumulator; a matrix of
+    # dimensions (numSamples, weight candidates) per snapshot.
+    with prof.stage('regression') as s:
+      corrls = lra.lraR2(subwave, hyps[:, 0], inputs[:, 0], corrlSampling)
+      s.addTraces(subwave.shape[0])
+  else:
+    # Compute the Pearson's Correlation Coefficient
+    with prof.stage('correlation') as s:
+      if saveMoments:
+        # A matrix of dimensions (numSamples, weight candidates) per snapshot.
+        if store is None:
+          store = ms.MomentStore(subwave.shape[1], hypsLast.shape[1], corrlSampling, integerCorrl)
+        if integerCorrl:
+          store.append(u.adcCodes(subwave), hypsLast.astype(np.uint8))
+        else:
+          store.append(subwave, hypsLast)
+        corrls = store.corrls()
+      elif integerCorrl:
+        corrls = momentsPearsonCorrl(u.adcCodes(subwave), hypsLast.astype(np.uint8), corrlSampling, lastWaveform, integer = True)
+      else:
+        corrls = onePassPearsonCorrl(subwave, hypsLast, corrlSampling, lastWaveform)
+      s.addTraces(subwave.shape[0])
+
+  with prof.stage('ranking'):
+    if saveMoments:
+      corrls = np.absolute(corrls)
+    elif distinguisher == 'cpa':
       # Transpose to a matrix of dimensions (numSamples, weight candidates)
       corrls = np.absolute(corrls.reshape(corrls.shape[0], hypsLast.shape[1], subwave.shape[1])).transpose((0, 2, 1))
-      rankedGuesses = np.asarray([[ np.unique(x, return_index = True) for x in np.flip(np.argsort(sample), axis = 1) ] for sample in corrls], dtype = np.uint8)[:, :, 1, :]
-      #Required, as, otherwise, ranking is in the range [0; 128].
-      rankedGuesses = rankedGuesses + 1
-
-      savePathCorrls = f'../data/corrls/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-corrls-input-{inputIndex}-neuron-{neuron}-extract-{db}.npy'
-      savePathRankings = f'../data/rankings/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-ranking-per-sample-input-{inputIndex}-neuron-{neuron}-extract-{db}.npy'
-
-      if filteredWaveforms:
-        savePathCorrls = f'../data/corrls/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-corrls-input-{inputIndex}-neuron-{neuron}-extract-{filteredType}-{db}.npy'
-        savePathRankings = f'../data/rankings/{implementation}/neuron-{neuron}/input-{inputIndex}/{implementation}-ranking-per-sample-input-{inputIndex}-neuron-{neuron}-extract-{filteredType}-{db}.npy'
-
-      np.save(savePathCorrls, corrls)
-      np.save(savePathRankings, rankedGuesses)
+    rankedGuesses = np.asarray([[ np.unique(x, return_index = True) for x in np.flip(np.argsort(sample), axis = 1) ] for sample in corrls], dtype = np.uint8)[:, :, 1, :]
+    #Required, as, otherwise, ranking is in the range [0; 128].
+    rankedGuesses = rankedGuesses + 1
+
+  with prof.stage('save'):
+    # The folders of the other analyses are not created by 'create-data-fs.sh'.
+    for path in [ savePathCorrls, savePathRankings ]:
+      os.makedirs(os.path.dirname(path), exist_ok = True)
+    if saveMoments:
+      store.save(savePathMoments)
+    else:
+      prof.npSave(savePathCorrls, corrls)
+    prof.npSave(savePathRankings, rankedGuesses)
+    if numPOIs > 0:
+      prof.npSave(f'../data/poi/pois-{poiMetric}-{numPOIs}-{dataset}-neuron-{neuron}-input-{inputIndex}.npy', pois + inputSetWaveBegin)
+
+def main():
+  if profile:
+    prof.enable()
+
+  partition = filteredType if filteredWaveforms else None
+
+  # The datasets to analyse: one per database, or one per database and
+  # neuron with the filtered waveforms.
+  if filteredWaveforms:
+    keys = [ (db, neuron) for db in databases[implementation] for neuron in range(firstNeuron, lastNeuron) ]
+  else:
+    keys = [ (db, None) for db in databases[implementation] ]
+
+  # Compute correlation and ranking on each database, loading the next
+  # dataset while analysing the current one.
+  for (db, neuron), (w, i, accumHyps) in pf.prefetch(keys, lambda key : loadDataset(*datasetPaths(key[0], key[1], partition)), prefetchDepth):
+    if neuron is None or neuron == firstNeuron:
+      print(f">> Analysing database {db}")
+
+    # Iterate over each neuron.
+    neurons = [ neuron ] if filteredWaveforms else range(firstNeuron, lastNeuron)
+    for neuron in neurons:
+      # Iterate over each input/weight/MAC.
+      for inputIndex in range(firstInput, lastInput):
+        print(f">> Input #{inputIndex} -- Neuron #{neuron}")
+        analyse(w, i, accumHyps, db, neuron, inputIndex, partition)
+
+  if profile:
+    prof.report()
+    prof.saveJSON(f'{profilePath}.json')
+    prof.saveCSV(f'{profilePath}.csv')
+
+if __name__ == '__main__':
+  main()
 
 #  """ DEBUG -- Plot correlation score vs samples
 
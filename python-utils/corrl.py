@@ -13,10 +13,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import matplotlib.pyplot  as plt
 import numpy              as np
 
-from alive_progress   import alive_bar
 from functools        import partial
 from math             import ceil
 
@@ -55,23 +53,157 @@ def onePassPearsonCorrl(subwave, hyps, corrlSampling, lastWaveform):
   corrls = np.zeros(shape = (lastWaveform // corrlSampling, subwave.shape[1] * hyps.shape[1]))
 
   # One-pass coefficient correlation computation.
-  with alive_bar(lastWaveform - 1) as bar:
-    for trace in range(1, lastWaveform):
-      # array of size numSamples
-      _x = np.tile(subwave[trace, :], hyps.shape[1])
-      # array of size numCandidates * numSamples
-      _y = np.repeat(hyps[trace, :], subwave.shape[1])
-
-      oldMeanX = meanX
-      oldMeanY = meanY
-      meanX = meanX + deltaMean(_x, oldMeanX, trace + 1)
-      meanY = meanY + deltaMean(_y, oldMeanY, trace + 1)
-      cov = cov + deltaCov(_x, _y, oldMeanX, oldMeanY, trace + 1)
-      varX = varX + deltaVar(_x, oldMeanX, meanX)
-      varY = varY + deltaVar(_y, oldMeanY, meanY)
-
-      # Save the correlation score each 'corrlSampling' times.
-      if (trace > 0 and ((trace + 1) % corrlSampling) == 0):
-        corrls[((trace + 1) // corrlSampling) - 1] = cov/(np.sqrt(varX) * np.sqrt(varY))
-      bar()
+  # No per-trace progress report here: the caller accounts the processed traces
+  # to its profiling stage (see 'profiling.py').
+  for trace in range(1, lastWaveform):
+    # array of size numSamples
+    _x = np.tile(subwave[trace, :], hyps.shape[1])
+    # array of size numCandidates * numSamples
+    _y = np.repeat(hyps[trace, :], subwave.shape[1])
+
+    oldMeanX = meanX
+    oldMeanY = meanY
+    meanX = meanX + deltaMean(_x, oldMeanX, trace + 1)
+    meanY = meanY + deltaMean(_y, oldMeanY, trace + 1)
+    cov = cov + deltaCov(_x, _y, oldMeanX, oldMeanY, trace + 1)
+    varX = varX + deltaVar(_x, oldMeanX, meanX)
+    varY = varY + deltaVar(_y, oldMeanY, meanY)
+
+    # Save the correlation score each 'corrlSampling' times.
+    if (trace > 0 and ((trace + 1) % corrlSampling) == 0):
+      corrls[((trace + 1) // corrlSampling) - 1] = cov/(np.sqrt(varX) * np.sqrt(varY))
+  return corrls
+
+def exactProducts(x, y):
+  """
+  Return x^T y, exactly, for the integer matrices @x@ (numTraces, numSamples)
+  and @y@ (numTraces, numHyps), as an int64 matrix.
+
+  The products run on the floating point BLAS, on blocks of traces whose sums
+  of products are exactly representable: float32 (24-bit mantissa) if
+  possible, float64 (53-bit mantissa) otherwise.
+  """
+
+  products = np.zeros(shape = (x.shape[1], y.shape[1]), dtype = np.int64)
+  if x.shape[0] == 0:
+    return products
+
+  bound = max(int(np.max(np.absolute(x))), 1) * max(int(np.max(np.absolute(y))), 1)
+  dtype = np.float32 if bound * x.shape[0] < 2 ** 24 else np.float64
+  rows = max(2 ** 53 // bound, 1)
+  for first in range(0, x.shape[0], rows):
+    block = x[first:first + rows].T.astype(dtype) @ y[first:first + rows].astype(dtype)
+    products += np.rint(block).astype(np.int64)
+  return products
+
+class CorrlMoments:
+  """
+  Accumulators of the Pearson's correlation coefficient between a set of
+  samples and a set of leakage hypotheses.
+
+  Instead of the one-pass incremental update, the accumulators are the raw
+  moments (number of traces, sums, sums of squares and sums of products),
+  updated with a block of traces at a time: the correlation can be retrieved
+  at any time, and the accumulators of distinct blocks of traces can be summed
+  (see 'merge').
+
+  With 'integer = True', the samples (e.g., the ADC codes, see
+  'utils.adcCodes') and the hypotheses must be integers: the moments are
+  accumulated exactly in int64, so that they do not depend on the order and
+  on the partition of the traces in blocks; they are converted to floating
+  point only by 'corrl'.
+  """
+
+  def __init__(self, numSamples, numHyps, integer = False):
+    self.integer = integer
+    dtype = np.int64 if integer else np.float64
+    self.n = 0
+    self.sumX = np.zeros(shape = numSamples, dtype = dtype)
+    self.sumX2 = np.zeros(shape = numSamples, dtype = dtype)
+    self.sumY = np.zeros(shape = numHyps, dtype = dtype)
+    self.sumY2 = np.zeros(shape = numHyps, dtype = dtype)
+    self.sumXY = np.zeros(shape = (numSamples, numHyps), dtype = dtype)
+
+  def update(self, x, y):
+    """
+    Accumulate a block of traces.
+
+    Args:
+      - x: the samples; matrix (numTraces, numSamples).
+      - y: the leakage hypotheses; matrix (numTraces, numHyps).
+    """
+
+    if self.integer:
+      x = np.asarray(x)
+      y = np.asarray(y)
+      self.sumXY += exactProducts(x, y)
+      x = x.astype(np.int64)
+      y = y.astype(np.int64)
+    else:
+      x = np.asarray(x, dtype = np.float64)
+      y = np.asarray(y, dtype = np.float64)
+      self.sumXY += x.T @ y
+
+    self.n += x.shape[0]
+    self.sumX += x.sum(axis = 0)
+    self.sumX2 += np.einsum('ij,ij->j', x, x)
+    self.sumY += y.sum(axis = 0)
+    self.sumY2 += np.einsum('ij,ij->j', y, y)
+
+  def merge(self, other):
+    """ Add the accumulators of @other@ (e.g., computed on another shard of traces). """
+    self.n += other.n
+    self.sumX += other.sumX
+    self.sumX2 += other.sumX2
+    self.sumY += other.sumY
+    self.sumY2 += other.sumY2
+    self.sumXY += other.sumXY
+    return self
+
+  def corrl(self):
+    """ Return the correlation coefficients; matrix (numSamples, numHyps). """
+
+    # In integer mode, the numerator and the variances are exact (int64).
+    n = self.n
+    num = n * self.sumXY - np.outer(self.sumX, self.sumY)
+    varX = n * self.sumX2 - self.sumX ** 2
+    varY = n * self.sumY2 - self.sumY ** 2
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+      c = num / np.sqrt(np.outer(varX.astype(np.float64), varY.astype(np.float64)))
+    return np.nan_to_num(c, nan = 0.0, posinf = 0.0, neginf = 0.0)
+
+def momentsPearsonCorrl(subwave, hyps, corrlSampling, lastWaveform, integer = False):
+  """
+  Compute the Pearson's Correlation Coefficient with 'CorrlMoments', a block
+  of 'corrlSampling' traces at a time.
+
+  Args and returns as 'onePassPearsonCorrl'; with 'integer = True', @subwave@
+  and @hyps@ must be integers (see 'CorrlMoments').
+  """
+
+  moments = CorrlMoments(subwave.shape[1], hyps.shape[1], integer)
+  corrls = np.zeros(shape = (lastWaveform // corrlSampling, subwave.shape[1] * hyps.shape[1]))
+
+  for snapshot in range(0, corrls.shape[0]):
+    first = snapshot * corrlSampling
+    moments.update(subwave[first:first + corrlSampling], hyps[first:first + corrlSampling])
+    # Same layout of 'onePassPearsonCorrl': hypothesis-major.
+    corrls[snapshot] = moments.corrl().T.reshape(-1)
   return corrls
+
+def rankGuesses(scores):
+  """
+  Rank the candidates according to their scores (the higher, the better).
+
+  Args:
+    - scores: matrix (..., numCandidates).
+
+  Returns:
+    - A matrix of the same shape, with the rank (starting from 1) of each candidate.
+  """
+
+  order = np.flip(np.argsort(scores, axis = -1), axis = -1)
+  ranks = np.empty(shape = scores.shape, dtype = np.int64)
+  np.put_along_axis(ranks, order, np.arange(1, scores.shape[-1] + 1), axis = -1)
+  return ranks
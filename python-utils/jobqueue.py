@@ -0,0 +1,364 @@
+#! /usr/bin/env python3
+
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# 'scheduler' sets one BLAS thread per process: imported before numpy.
+import scheduler           as sc
+import build_hyps          as bh
+import compute_ranking     as cr
+import macs_classification as mc
+import numpy               as np
+import os
+import preprocess          as pp
+import secrets
+import socket
+import sys
+import threading
+import time
+
+from collections             import Counter, OrderedDict
+from multiprocessing         import Process
+from multiprocessing.managers import BaseManager
+
+## This script distributes the jobs of the analysis on several hosts.
+##
+## The coordinator runs a broker process (a 'multiprocessing' manager serving
+## a 'JobBroker' on 'brokerPort'), and submits the jobs of each stage of
+## 'stages', one stage after the other:
+## - 'classification': a job per dataset of 'macs_classification.py';
+## - 'hyps': a job per dataset of 'build_hyps.py';
+## - 'ranking': a job per (dataset, neuron, input, partition) of
+##   'scheduler.py' (with the configuration of 'compute_ranking.py').
+## The workers, 'numWorkers' processes per host, pull (lease) the jobs from the
+## broker, run them, and push back their outcome (host, process, elapsed time,
+## or the error). The jobs read and save their datasets in '../data', which
+## must be the same shared storage (e.g., NFS) on every host.
+##
+## A leased job must be renewed by its worker each 'heartbeatInterval'
+## seconds: if a worker does not renew it within 'leaseTime' seconds (e.g.,
+## the host is lost), or the job raises an exception, the job is leased again,
+## up to 'maxAttempts' times; then, it is reported as failed. Each job
+## overwrites its own results, so that running a job twice is harmless.
+## A worker leases first the jobs of the dataset of its last job, to reuse the
+## loaded dataset (see 'scheduler.loadDataset').
+##
+## Usage (the first argument sets 'role'):
+## - 'coordinator', on the host of the broker: submit the jobs and wait for them;
+## - 'worker', on each analysis host: set 'brokerHost' to the coordinator host;
+## - 'local': run the coordinator and 'localWorkers' workers on this host,
+##   as a stand-in for the cluster.
+##
+## The broker exchanges pickled objects, so that anyone holding its key can
+## run code on the coordinator host. The key is read from the 'authkeyVar'
+## environment variable or, if not set, from the 'authkeyPath' file (on the
+## shared storage, readable only by its owner), which the coordinator creates
+## with a random key if missing (see 'loadAuthkey'). The broker listens only
+## on the loopback interface by default: set 'listenHost' (e.g., to '' for all
+## the interfaces) to reach it from the other hosts.
+
+available_roles = ['coordinator', 'worker', 'local']
+role = sys.argv[1] if len(sys.argv) > 1 else 'local'
+
+available_stages = ['classification', 'hyps', 'ranking']
+stages = ['ranking']
+
+# The address of the broker: the workers connect to 'brokerHost', the broker
+# listens on 'listenHost' (only this host by default), and the key shared by
+# the coordinator and the workers.
+brokerHost = 'localhost'
+listenHost = '127.0.0.1'
+brokerPort = 50050
+authkeyVar = 'MACPRUNING_JOBS_AUTHKEY'
+authkeyPath = '../data/jobqueue.key'
+
+# Worker processes per host ('worker'), and on this host ('local').
+numWorkers = os.cpu_count()
+localWorkers = 4
+
+leaseTime = 300
+heartbeatInterval = 30
+maxAttempts = 3
+
+# Seconds between two polls of the broker, by the idle workers and by the coordinator.
+pollInterval = 1.0
+
+class JobBroker:
+  def __init__(self, leaseTime, maxAttempts):
+    """
+    Args:
+      - leaseTime: the seconds after which a job not renewed is leased again.
+      - maxAttempts: the maximum number of leases of a job.
+    """
+
+    self.leaseTime = leaseTime
+    self.maxAttempts = maxAttempts
+    self.lock = threading.Lock()
+
+    # jobId -> (job, affinity key)
+    self.pending = OrderedDict()
+    # jobId -> (job, affinity key, workerId, deadline)
+    self.leases = {}
+    self.attempts = Counter()
+    # The outcomes not yet taken by the coordinator: (jobId, job, result, error)
+    self.outcomes = []
+    self.nextId = 0
+    self.closed = False
+
+  def submit(self, jobs):
+    """ Queue the jobs @jobs@, (job, affinity key) pairs; return their identifiers. """
+    with self.lock:
+      ids = list(range(self.nextId, self.nextId + len(jobs)))
+      self.nextId += len(jobs)
+      for jobId, (job, key) in zip(ids, jobs):
+        self.pending[jobId] = (job, key)
+      return ids
+
+  def _expire(self):
+    """ Lease again (or fail) the jobs whose lease expired. """
+    now = time.monotonic()
+    for jobId in [ jobId for jobId, lease in self.leases.items() if lease[3] < now ]:
+      job, key, workerId, _ = self.leases.pop(jobId)
+      self._retry(jobId, job, key, f'lease of {workerId} expired')
+
+  def _retry(self, jobId, job, key, error):
+    if self.attempts[jobId] < self.maxAttempts:
+      print(f">> Job {jobId} {job}: {error}, retrying")
+      self.pending[jobId] = (job, key)
+    else:
+      self.outcomes.append((jobId, job, None, error))
+
+  def lease(self, workerId, affinity = None):
+    """ Lease a job to @workerId@, preferring the affinity key @affinity@; return (jobId, job, key), or None. """
+    with self.lock:
+      self._expire()
+      if not self.pending:
+        return None
+
+      jobId = next((i for i, (_, key) in self.pending.items() if key == affinity), None) if affinity is not None else None
+      if jobId is None:
+        jobId = next(iter(self.pending))
+      job, key = self.pending.pop(jobId)
+
+      self.attempts[jobId] += 1
+      self.leases[jobId] = (job, key, workerId, time.monotonic() + self.leaseTime)
+      return jobId, job, key
+
+  def heartbeat(self, workerId, jobId):
+    """ Renew the lease of @jobId@; return False if @workerId@ lost it. """
+    with self.lock:
+      lease = self.leases.get(jobId)
+      if lease is None or lease[2] != workerId:
+        return False
+      self.leases[jobId] = lease[:3] + (time.monotonic() + self.leaseTime,)
+      return True
+
+  def complete(self, workerId, jobId, result):
+    with self.lock:
+      lease = self.leases.get(jobId)
+      if lease is None or lease[2] != workerId:
+        # The lease expired and the job was leased again (or completed).
+        return
+      del self.leases[jobId]
+      self.outcomes.append((jobId, lease[0], result, None))
+
+  def fail(self, workerId, jobId, error):
+    with self.lock:
+      lease = self.leases.get(jobId)
+      if lease is None or lease[2] != workerId:
+        return
+      del self.leases[jobId]
+      self._retry(jobId, lease[0], lease[1], error)
+
+  def takeOutcomes(self):
+    """ Return the outcomes of the jobs completed or failed since the last call. """
+    with self.lock:
+      self._expire()
+      outcomes, self.outcomes = self.outcomes, []
+      return outcomes
+
+  def close(self):
+    """ No more jobs: the idle workers stop. """
+    with self.lock:
+      self.closed = True
+
+  def isClosed(self):
+    with self.lock:
+      return self.closed and not self.pending and not self.leases
+
+class BrokerManager(BaseManager):
+  pass
+
+_broker = None
+
+def _getBroker():
+  global _broker
+  if _broker is None:
+    _broker = JobBroker(leaseTime, maxAttempts)
+  return _broker
+
+BrokerManager.register('broker', callable = _getBroker)
+
+def stageJobs(stage):
+  """ Return the jobs of @stage@, with their affinity key (the dataset they load). """
+  assert stage in available_stages
+  if stage == 'classification':
+    return [ (('classification', (db,)), db) for db in mc.databases_protected ]
+  if stage == 'hyps':
+    return [ (('hyps', (suffix,)), suffix) for suffix in bh.databases[bh.implementation] ]
+  return [ (('ranking', job), sc.datasetKey(job[0], job[1], job[3])) for job in sc.jobs(sc.databases, sc.neurons, sc.inputs, sc.partitions) ]
+
+# The MAC patterns of the classification jobs, loaded by each worker once.
+_patterns = None
+
+def runClassification(db):
+  global _patterns
+  if _patterns is None:
+    patternspath = pp.patternsPath('../artefacts/patterns', mc.preprocessing)
+    _patterns = [ np.load(f'{patternspath}/pattern-{name}.npy') for name in ['IMAC', 'NIMACExec', 'NIMACSkip'] ]
+  suffix = db + pp.datasetSuffix(mc.preprocessing)
+  w = np.load(f'{mc.datapathProt}/waveforms-extract-{suffix}.npy')
+  mc.extractIaPAM(w, *_patterns, suffix = suffix)
+
+def runHyps(suffix):
+  bh.buildHyps(suffix, *bh.loadDatabase(suffix))
+
+def runRanking(db, neuron, inputIndex, partition):
+  w, i, accumHyps = sc.loadDataset(db, neuron, partition)
+  cr.analyse(w, i, accumHyps, db, neuron, inputIndex, partition)
+
+runners = { 'classification' : runClassification
+          , 'hyps'           : runHyps
+          , 'ranking'        : runRanking }
+
+def loadAuthkey(create = False):
+  """
+  Return the key of the broker, from the 'authkeyVar' environment variable or
+  the 'authkeyPath' file; with @create@, a missing file is created with a
+  random key.
+  """
+  if os.environ.get(authkeyVar):
+    return os.environ[authkeyVar].encode()
+
+  if create and not os.path.exists(authkeyPath):
+    os.makedirs(os.path.dirname(authkeyPath), exist_ok = True)
+    fd = os.open(authkeyPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as fp:
+      fp.write(secrets.token_hex(32))
+    print(f">> Created the broker key in {authkeyPath}")
+
+  with open(authkeyPath, 'r') as fp:
+    return fp.read().strip().encode()
+
+def connect(host, port, retries = 30):
+  """ Connect to the broker at @host@:@port@, waiting for it to start; return its proxy. """
+  for attempt in range(retries):
+    try:
+      # The key file is created by the coordinator: it may not exist yet.
+      manager = BrokerManager(address = (host, port), authkey = loadAuthkey())
+      manager.connect()
+      return manager.broker()
+    except (ConnectionRefusedError, FileNotFoundError):
+      time.sleep(pollInterval)
+  raise ConnectionRefusedError(f"No broker at {host}:{port}")
+
+def work(host, port):
+  """ Lease and run jobs until the broker is closed. """
+  broker = connect(host, port)
+  workerId = f'{socket.gethostname()}-{os.getpid()}'
+  affinity = None
+
+  while True:
+    lease = broker.lease(workerId, affinity)
+    if lease is None:
+      if broker.isClosed():
+        return
+      time.sleep(pollInterval)
+      continue
+
+    jobId, (kind, args), affinity = lease
+
+    # Renew the lease while the job runs (the proxy connection is per thread).
+    done = threading.Event()
+    def renew():
+      while not done.wait(heartbeatInterval):
+        if not broker.heartbeat(workerId, jobId):
+          return
+    renewer = threading.Thread(target = renew, daemon = True)
+    renewer.start()
+
+    begin = time.perf_counter()
+    try:
+      runners[kind](*args)
+      result = { 'worker': workerId, 'elapsed': time.perf_counter() - begin }
+    except Exception as e:
+      result = None
+      error = f'{e!r} on {workerId}'
+    finally:
+      done.set()
+      renewer.join()
+
+    if result is not None:
+      broker.complete(workerId, jobId, result)
+    else:
+      broker.fail(workerId, jobId, error)
+
+def startWorkers(host, port, processes):
+  workers = [ Process(target = work, args = (host, port)) for _ in range(processes) ]
+  for w in workers:
+    w.start()
+  return workers
+
+def coordinate(broker, stages):
+  """ Run the jobs of each stage of @stages@; return the failed jobs. """
+  failed = []
+  for stage in stages:
+    ids = set(broker.submit(stageJobs(stage)))
+    total = len(ids)
+    print(f">> Stage {stage}: {total} jobs")
+
+    begin = time.perf_counter()
+    while ids:
+      for jobId, job, result, error in broker.takeOutcomes():
+        ids.discard(jobId)
+        if error is None:
+          print(f">> [{total - len(ids)}/{total}] {job} ({result['elapsed']:.1f} s, {result['worker']})")
+        else:
+          print(f">> [{total - len(ids)}/{total}] {job} failed: {error}")
+          failed.append(job)
+      time.sleep(pollInterval)
+    print(f">> Stage {stage} done in {time.perf_counter() - begin:.1f} s")
+
+  broker.close()
+  return failed
+
+if __name__ == '__main__':
+  assert role in available_roles
+
+  if role == 'worker':
+    for w in startWorkers(brokerHost, brokerPort, numWorkers):
+      w.join()
+  else:
+    host = '127.0.0.1' if role == 'local' else listenHost
+    manager = BrokerManager(address = (host, brokerPort), authkey = loadAuthkey(create = True))
+    manager.start()
+    workers = startWorkers('127.0.0.1', brokerPort, localWorkers) if role == 'local' else []
+
+    failed = coordinate(manager.broker(), stages)
+    for w in workers:
+      w.join()
+    manager.shutdown()
+
+    print(f">> {len(failed)} failed jobs: {failed}")
@@ -0,0 +1,116 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+
+## This module contains the implementation of the linear regression analysis
+## (LRA), an alternative to the correlation analysis with the Hamming Weight
+## model (see 'corrl.py') that does not assume that each bit of the targeted
+## intermediate leaks the same.
+##
+## For each weight candidate, the targeted intermediate is the accumulator
+## after the MAC of the targeted input (the accumulator of the preceeding
+## inputs plus the input times the candidate). The leakage of each sample is
+## modeled as a linear combination of the bits of the intermediate (plus a
+## constant); the candidates are ranked according to the coefficient of
+## determination (R^2) of the least-squares fit.
+##
+## As for the correlation, the fit is streamed: 'LRAMoments' accumulates the
+## normal equations (X^T X and X^T y, per candidate) over blocks of traces, and
+## solves them in batch for all the samples and all the candidates.
+
+# Bits of the accumulator considered by the leakage model: the accumulator of
+# 32 MACs of 7-bit inputs and weights is lower than 2^20.
+numBits = 20
+
+def bitBasis(intermediates, numBits = numBits):
+  """
+  Return the basis functions (a constant, then the bits) of the given
+  intermediates; matrix (..., numBits + 1).
+  """
+  bits = (intermediates[..., None] >> np.arange(numBits, dtype = np.uint32)) & 1
+  return np.concatenate((np.ones(shape = intermediates.shape + (1,), dtype = np.float64), bits.astype(np.float64)), axis = -1)
+
+class LRAMoments:
+  """
+  Accumulators of the normal equations of the linear regression between a set
+  of samples and the bits of the intermediate of each candidate.
+  """
+
+  def __init__(self, numSamples, candidates, numBits = numBits):
+    self.candidates = np.asarray(candidates, dtype = np.uint32)
+    self.numBits = numBits
+    numCandidates = self.candidates.shape[0]
+
+    self.n = 0
+    self.sumY = np.zeros(shape = numSamples, dtype = np.float64)
+    self.sumY2 = np.zeros(shape = numSamples, dtype = np.float64)
+    self.XtX = np.zeros(shape = (numCandidates, numBits + 1, numBits + 1), dtype = np.float64)
+    self.Xty = np.zeros(shape = (numCandidates, numBits + 1, numSamples), dtype = np.float64)
+
+  def update(self, y, prefix, inputs):
+    """
+    Accumulate a block of traces.
+
+    Args:
+      - y: the samples; matrix (numTraces, numSamples).
+      - prefix: the accumulator after the preceeding MAC; array (numTraces,).
+      - inputs: the targeted input; array (numTraces,).
+    """
+
+    y = np.asarray(y, dtype = np.float64)
+    intermediates = np.asarray(prefix, dtype = np.uint32)[:, None] + np.asarray(inputs, dtype = np.uint32)[:, None] * self.candidates[None, :]
+    X = bitBasis(intermediates, self.numBits)
+
+    self.n += y.shape[0]
+    self.sumY += y.sum(axis = 0)
+    self.sumY2 += np.einsum('ij,ij->j', y, y)
+    self.XtX += np.einsum('ncb,ncd->cbd', X, X, optimize = True)
+    self.Xty += np.einsum('ncb,ns->cbs', X, y, optimize = True)
+
+  def r2(self):
+    """ Return the coefficient of determination; matrix (numSamples, numCandidates). """
+
+    # The pseudo-inverse handles the bits that never toggle (singular X^T X).
+    beta = np.linalg.pinv(self.XtX, hermitian = True) @ self.Xty
+    explained = np.einsum('cbs,cbs->sc', beta, self.Xty)
+    mean2 = self.sumY ** 2 / self.n
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+      r2 = (explained - mean2[:, None]) / (self.sumY2 - mean2)[:, None]
+    return np.nan_to_num(r2, nan = 0.0, posinf = 0.0, neginf = 0.0)
+
+def lraR2(subwave, prefix, inputs, corrlSampling, candidates = np.arange(1, 128)):
+  """
+  Compute the R^2 of each candidate each 'corrlSampling' traces.
+
+  Args:
+    - subwave: the portion of side-channel trace to analyse
+    - prefix: the accumulator after the preceeding MAC; array (numTraces,)
+    - inputs: the targeted input; array (numTraces,)
+    - corrlSampling: the sampling factor of the score
+    - candidates: the weight candidates
+
+  Returns:
+    - A matrix of (numTraces / corrlSampling, numSamples, numCandidates)
+  """
+
+  moments = LRAMoments(subwave.shape[1], candidates)
+  r2s = np.zeros(shape = (subwave.shape[0] // corrlSampling, subwave.shape[1], len(candidates)))
+
+  for snapshot in range(0, r2s.shape[0]):
+    first = snapshot * corrlSampling
+    moments.update(subwave[first:first + corrlSampling], prefix[first:first + corrlSampling], inputs[first:first + corrlSampling])
+    r2s[snapshot] = moments.r2()
+  return r2s
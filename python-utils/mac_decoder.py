@@ -0,0 +1,297 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy              as np
+import params             as p
+import pattern_extraction as pe
+
+## This module implements the decoding of the sequence of MACs of the
+## waveforms, as an alternative to the independent detection of the patterns
+## (see 'macs_classification.detectPatterns' and 'assembleMACs').
+##
+## The firmware runs 'nNeurons' neurons of 'imgWidth * imgHeight' MACs each;
+## each MAC is skipped (0), executed (1) or important (2), as in
+## 'orderExecMACs', and lasts a fixed number of samples, given by its type and
+## by the type of the following MAC ('durations', see 'durationModel' and
+## 'estimateDurations').
+## The MACs of a neuron are back-to-back; the neurons are separated by gaps of
+## any length (the epilogue of the neuron and the prologue of the next one).
+##
+## The decoder finds the sequence of MAC types and start samples maximising
+## the sum of the correlation scores of the patterns at the MAC starts (see
+## 'scoreTracks'), by dynamic programming (Viterbi) over the MACs: after the
+## k-th MAC, the best score of each (type, start sample) is computed from the
+## (k-1)-th with a shift per pair of types (a running maximum at the neuron
+## boundaries); the cost is linear in the number of samples and of MACs. Only
+## the samples where the k-th MAC may start (given the shortest duration and
+## the number of MACs before and after it) are considered. The waveforms are
+## decoded in blocks, vectorised over the block.
+##
+## Each waveform gets exactly one type and start per MAC: no threshold, and no
+## overlapping detections. If the IaPAM is known (e.g., the consensus of a
+## previous pass), the decoding can be constrained to it: the important MACs
+## are important, the others are executed or skipped.
+
+skipped, executed, important = 0, 1, 2
+
+def scoreTracks(waves, patterns):
+  """
+  The correlation score of each pattern at each sample of @waves@ (numWaves,
+  numSamples); @patterns@ are the skipped, executed and important MAC patterns,
+  in this order. Return a matrix (numWaves, 3, numSamples); the samples where a
+  pattern does not fit have score -inf.
+  """
+  waves = np.asarray(waves, dtype = np.float32)
+  scores = np.full(shape = (waves.shape[0], 3, waves.shape[1]), fill_value = -np.inf, dtype = np.float32)
+  for t, pattern in enumerate(patterns):
+    corrls = pe.slidingCorrls(waves, np.asarray(pattern, dtype = np.float32))
+    scores[:, t, :corrls.shape[1]] = corrls
+  return scores
+
+def estimateDurations(scores, patterns, threshold = 0.92, maxDuration = None):
+  """
+  Estimate the duration of each MAC type, followed by each MAC type, from the
+  score tracks @scores@: the most frequent distance between consecutive
+  detections above @threshold@ (as 'macs_classification.detectPatterns').
+  The durations not observed are set to the pattern length.
+
+  Return: integer matrix (3, 3); the duration of type t followed by type u is
+  at [t, u].
+  """
+  lengths = np.array([ len(pattern) for pattern in patterns ])
+  maxDuration = 2 * np.max(lengths) if maxDuration is None else maxDuration
+  minDuration = np.min(lengths) // 2
+
+  histograms = np.zeros(shape = (3, 3, maxDuration + 1), dtype = np.int64)
+  for s in scores:
+    detections = [ (pos, t) for t in range(3) for pos in pe.peaks(s[t][None], threshold, minDuration)[0] ]
+    detections.sort()
+    for (pos, t), (nextPos, u) in zip(detections[:-1], detections[1:]):
+      if nextPos - pos <= maxDuration:
+        histograms[t, u, nextPos - pos] += 1
+
+  durations = np.argmax(histograms, axis = 2)
+  return np.where(np.sum(histograms, axis = 2) > 0, durations, lengths[:, None])
+
+def allowedTypes(IaPAM):
+  """ The allowed types of each MAC (nMACs, 3), given the IaPAM of the inputs (bytes, as loaded on the target). """
+  important = np.tile(np.unpackbits(np.asarray(IaPAM, dtype = np.uint8)).astype(bool), p.nNeurons)
+  return np.stack((~important, ~important, important), axis = 1)
+
+def consensusIaPAM(types):
+  """ The IaPAM (bytes) of the majority of the decoded MACs @types@ (numWaves, nMACs), over the waveforms and the neurons. """
+  isImportant = np.asarray(types).reshape(-1, p.imgWidth * p.imgHeight) == important
+  return np.packbits(np.mean(isImportant, axis = 0) > 0.5)
+
+def decode(scores, durations, IaPAM = None):
+  """
+  Decode the sequence of MACs of each waveform from its score tracks.
+
+  Args:
+    - scores: the score tracks (numWaves, 3, numSamples), see 'scoreTracks'.
+    - durations: the durations of the MAC types (3, 3), see 'estimateDurations'.
+    - IaPAM: if not None, constrain the important MACs to this IaPAM (bytes).
+
+  Return:
+    - types: the type of each MAC (0 -> Skipped; 1 -> Executed; 2 -> Important);
+      int8 matrix (numWaves, nMACs).
+    - starts: the start sample of each MAC; int32 matrix (numWaves, nMACs).
+    - pathScores: the mean score of the decoded MACs of each waveform (-inf
+      if the MACs do not fit in the waveform).
+  """
+
+  numWaves, _, numSamples = scores.shape
+  macsPerNeuron = p.imgWidth * p.imgHeight
+  nMACs = macsPerNeuron * p.nNeurons
+  allowed = np.ones(shape = (nMACs, 3), dtype = bool) if IaPAM is None else allowedTypes(IaPAM)
+
+  # The k-th MAC starts in the band [k * minDuration, numSamples - (nMACs - 1 - k) * minDuration):
+  # the scores are computed only there. The scores are padded with
+  # 'maxDuration' samples of -inf on the left, so that the shifts by a duration
+  # stay in the array.
+  minDuration, maxDuration = int(np.min(durations)), int(np.max(durations))
+  width = numSamples - (nMACs - 1) * minDuration
+  band = lambda k : (maxDuration + k * minDuration, maxDuration + k * minDuration + max(width, 0))
+
+  # Best score of a decoding of the first k MACs whose k-th MAC has type u and
+  # starts at sample i; backpointers to the type (and, at the neuron
+  # boundaries, the start) of the previous MAC, in the band of the k-th MAC.
+  # Two buffers, alternated between the MACs.
+  best, current = np.full(shape = (2, numWaves, 3, maxDuration + numSamples), fill_value = -np.inf, dtype = np.float32)
+  lo, hi = band(0)
+  best[:, :, lo:hi] = scores[:, :, lo - maxDuration:hi - maxDuration]
+  best[:, ~allowed[0], lo:hi] = -np.inf
+  prevTypes = np.zeros(shape = (nMACs, numWaves, 3, max(width, 0)), dtype = np.int8)
+  prevStarts = {}
+
+  for k in range(1, nMACs):
+    lo, hi = band(k)
+    firstOfNeuron = k % macsPerNeuron == 0
+    if firstOfNeuron:
+      # First MAC of a neuron: the previous MAC ends any time before.
+      source = np.maximum.accumulate(best, axis = 2)
+      sourceStarts = np.maximum.accumulate(np.where(best == source, np.arange(best.shape[2]), 0), axis = 2)
+      prevStarts[k] = np.zeros(shape = (numWaves, 3, hi - lo), dtype = np.int32)
+    else:
+      source = best
+
+    # Reset the band of the MAC (k - 2) of the buffer.
+    current[:, :, slice(*band(max(k - 2, 0)))] = -np.inf
+    for u in range(3):
+      acc = current[:, u, lo:hi]
+      for t in range(3):
+        d = durations[t, u]
+        candidate = source[:, t, lo - d:hi - d]
+        better = candidate > acc
+        np.copyto(acc, candidate, where = better)
+        np.copyto(prevTypes[k, :, u], t, where = better)
+        if firstOfNeuron:
+          np.copyto(prevStarts[k][:, u], sourceStarts[:, t, lo - d:hi - d] - maxDuration, where = better)
+    current[:, :, lo:hi] += scores[:, :, lo - maxDuration:hi - maxDuration]
+    current[:, ~allowed[k], lo:hi] = -np.inf
+    best, current = current, best
+
+  # Backtracking
+  types = np.zeros(shape = (numWaves, nMACs), dtype = np.int8)
+  starts = np.zeros(shape = (numWaves, nMACs), dtype = np.int32)
+  lo, hi = band(nMACs - 1)
+  flat = best[:, :, lo:hi].reshape(numWaves, -1)
+  last = np.argmax(flat, axis = 1)
+  pathScores = flat[np.arange(numWaves), last] / nMACs
+  t, i = last // (hi - lo), last % (hi - lo) + lo - maxDuration
+  for k in range(nMACs - 1, -1, -1):
+    types[:, k], starts[:, k] = t, i
+    if k == 0:
+      break
+    offset = i - (band(k)[0] - maxDuration)
+    prev = prevTypes[k][np.arange(numWaves), t, offset]
+    i = prevStarts[k][np.arange(numWaves), t, offset] if k in prevStarts else i - durations[prev, t]
+    # Undecodable waveforms (-inf score) backtrack through invalid starts.
+    i = np.clip(i, band(k - 1)[0] - maxDuration, band(k - 1)[1] - maxDuration - 1)
+    t = prev
+
+  return types, starts, pathScores
+
+def windowCorrls(waves, positions, templates):
+  """
+  Pearson correlation of @templates@ (length, numTemplates), each centred and
+  normalised (see 'normalised'), with the windows of @waves@ (numWaves,
+  numSamples, float32) starting at @positions@ (numWaves, numPositions).
+  Return a matrix (numWaves, numPositions, numTemplates); -inf for the windows
+  not in the waveforms.
+  """
+  length = templates.shape[0]
+  valid = (positions >= 0) & (positions + length <= waves.shape[1])
+  positions = np.where(valid, positions, 0) + (np.arange(waves.shape[0]) * waves.shape[1])[:, None]
+  windows = np.take(waves, positions[:, :, None] + np.arange(length))
+
+  # The dot products with the templates and, with a column of ones, the sums
+  # of the windows: the templates are centred, so the windows need not be.
+  dots = windows.reshape(-1, length) @ np.column_stack((templates, np.ones(shape = length, dtype = np.float32)))
+  dots = dots.reshape(positions.shape + (-1,))
+  norms = np.sqrt(np.maximum(np.einsum('wpl,wpl->wp', windows, windows) - dots[:, :, -1] ** 2 / length, 0))
+  corrls = np.divide(dots[:, :, :-1], norms[:, :, None], out = np.zeros(shape = dots[:, :, :-1].shape, dtype = np.float32), where = norms[:, :, None] > 1e-6)
+  return np.where(valid[:, :, None], corrls, -np.inf)
+
+def normalised(pattern):
+  """ The centred and normalised @pattern@; the Pearson correlation of a window with a pattern is its dot product with it over the norm of the centred window. """
+  pattern = np.asarray(pattern, dtype = np.float64)
+  pattern = pattern - np.mean(pattern)
+  return (pattern / np.linalg.norm(pattern)).astype(np.float32)
+
+def durationModel(lengths):
+  """ The durations (3, 3) of the MAC types (see 'estimateDurations') given the durations of the skipped, executed and important MACs, whatever the next MAC. """
+  return np.repeat(np.asarray(lengths, dtype = np.int64)[:, None], 3, axis = 1)
+
+def segment(waves, patterns, durations, firstSample = 236, templateLength = 40, jitter = 1, startWindow = 300, maxNeuronGap = 300, matchThreshold = 0.8):
+  """
+  Segment the MACs of each waveform following the duration model: from the
+  start of a MAC, the start of the next one is at one of the durations of the
+  MAC types (see 'durationModel'); the first 'templateLength' samples of the
+  patterns are correlated only there (and 'jitter' samples around), and the
+  best match gives the type of the MAC and the start of the next one.
+  The last MAC of each neuron is typed by the correlation of the whole
+  patterns, and the next neuron is searched in the following 'maxNeuronGap'
+  samples; the first MAC within 'startWindow' samples around 'firstSample'
+  (the first match above 'matchThreshold').
+
+  The cost is a few dot products per MAC (see 'windowCorrls'), instead of the
+  correlation of the patterns with the whole waveform ('scoreTracks'); each
+  step is vectorised over the waveforms, so that large blocks amortise it.
+
+  Return:
+    - types, starts: as 'decode'.
+    - confidences: the minimum correlation of the matches of each waveform.
+  """
+
+  waves = np.ascontiguousarray(waves, dtype = np.float32)
+  numWaves = waves.shape[0]
+  macsPerNeuron = p.imgWidth * p.imgHeight
+  nMACs = macsPerNeuron * p.nNeurons
+  heads = [ np.asarray(pattern[:templateLength], dtype = np.float32) for pattern in patterns ]
+  templates = np.stack([ normalised(head) for head in heads ], axis = 1)
+  patterns = [ normalised(pattern)[:, None] for pattern in patterns ]
+  rows = np.arange(numWaves)
+
+  def nextStart(begin, end):
+    """
+    The first match of the templates in [begin, end) of each waveform (the
+    first peak above 'matchThreshold', or the best match if none): start and
+    correlation.
+    """
+    positions = begin[:, None] + np.arange(np.max(end - begin))
+    span = np.take(waves, np.minimum(begin[:, None] + np.arange(positions.shape[1] + templateLength - 1), waves.shape[1] - 1) + rows[:, None] * waves.shape[1])
+    corrls = np.max([ pe.slidingCorrls(span, head) for head in heads ], axis = 0)
+    corrls[(positions >= end[:, None]) | (positions + templateLength > waves.shape[1])] = -np.inf
+    first = np.argmax(corrls >= np.minimum(matchThreshold, np.max(corrls, axis = 1, keepdims = True)), axis = 1)
+    # The peak following the first sample above the threshold.
+    peak = first[:, None] + np.arange(2 * jitter + 1)
+    peak = np.take_along_axis(peak, np.argmax(np.take_along_axis(corrls, np.minimum(peak, corrls.shape[1] - 1), axis = 1), axis = 1)[:, None], axis = 1)[:, 0]
+    return positions[rows, peak], corrls[rows, peak]
+
+  types = np.zeros(shape = (numWaves, nMACs), dtype = np.int8)
+  starts = np.zeros(shape = (numWaves, nMACs), dtype = np.int32)
+  matches = np.zeros(shape = (numWaves, nMACs), dtype = np.float32)
+
+  begin = np.full(shape = numWaves, fill_value = max(firstSample - startWindow // 2, 0))
+  pos, matches[:, 0] = nextStart(begin, begin + startWindow)
+
+  # Candidate shifts of the next MAC: (type of this MAC, type of the next one,
+  # offset). The templates are correlated once per distinct shift.
+  candidates = (durations[:, :, None] + np.arange(-jitter, jitter + 1)).reshape(-1)
+  shifts, shiftIndex = np.unique(candidates, return_inverse = True)
+  shiftIndex = shiftIndex.reshape(3, 3, -1)
+  nextTypes = np.arange(3)[None, :, None]
+
+  for k in range(nMACs):
+    starts[:, k] = pos
+    if k % macsPerNeuron == macsPerNeuron - 1:
+      # Last MAC of a neuron: type it by the whole patterns.
+      corrls = np.concatenate([ windowCorrls(waves, pos[:, None], pattern)[:, 0] for pattern in patterns ], axis = 1)
+      types[:, k] = np.argmax(corrls, axis = 1)
+      matches[:, k] = np.minimum(matches[:, k], np.max(corrls, axis = 1))
+      if k < nMACs - 1:
+        begin = pos + np.min(durations[types[:, k]], axis = 1)
+        pos, matches[:, k + 1] = nextStart(begin, begin + maxNeuronGap)
+      continue
+
+    corrls = windowCorrls(waves, pos[:, None] + shifts, templates)
+    flat = corrls[:, shiftIndex, nextTypes].reshape(numWaves, -1)
+    best = np.argmax(flat, axis = 1)
+    types[:, k] = best // (flat.shape[1] // 3)
+    pos = pos + candidates[best]
+    matches[:, k + 1] = flat[rows, best]
+
+  return types, starts, np.min(matches, axis = 1)
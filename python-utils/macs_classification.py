@@ -16,11 +16,14 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import json
-import matplotlib.pyplot as plt
-import matplotlib.style as style
+import mac_decoder as md
 import numpy as np
 import pathlib as pl
 import params as p
+import prefetch as pf
+import peak_cache as pc
+import preprocess as pp
+import profiling as prof
 import sys
 import time
 import utils as u
@@ -42,15 +45,72 @@ databases_protected = [ '01-07-2025-15:55-33'
 datapathProt = f"../data/protected"
 datapathCirc = f"../data/protected"
 
-# Set font parameters
-plt.rcParams['font.family'] = 'serif'
-plt.rcParams['font.serif'] = ['Computer Modern Serif']
-plt.rcParams['font.size'] = 10
-plt.rcParams['font.weight'] = 'bold'
-plt.rcParams['text.usetex'] = True
-plt.rcParams['text.latex.preamble'] = r'\boldmath'
-
-style.use('tableau-colorblind10')
+# Detection threshold of the patterns' correlation score.
+threshold = 0.92
+
+# The classification of the MACs of each waveform:
+# - 'viterbi': decode the most likely sequence of MACs from the correlation
+#   scores of the patterns (see 'mac_decoder.py'), in blocks of
+#   'decoderBlockSize' waveforms. With 'constrainIaPAM', the waveforms are
+#   decoded again constrained to the consensus IaPAM of the first block.
+# - 'fast': segment the MACs following their durations, from the first MAC
+#   (about 'firstSample'), correlating the patterns only at the predicted MAC
+#   starts (see 'mac_decoder.segment'), in blocks of 'fastBlockSize'
+#   waveforms; the waveforms whose matches fall below 'fastMinConfidence' are
+#   classified as with 'threshold'.
+# - 'threshold': detect each pattern where its correlation score exceeds
+#   'threshold', then rebuild the sequence of MACs (see 'assembleMACs').
+# Compare the decoders with 'classification_benchmark.py' before switching:
+# on simulated waveforms, 'viterbi' is about 14 times slower than 'threshold',
+# with the same accuracy.
+available_decoders = ['viterbi', 'fast', 'threshold']
+decoder = 'threshold'
+decoderBlockSize = 16
+constrainIaPAM = False
+firstSample = 236
+fastBlockSize = 512
+fastMinConfidence = 0.7
+
+# The durations (samples) of the skipped, executed and important MACs, scaled
+# with the preprocessing. Set to None to estimate them from the detections
+# above 'threshold' of the first block (see 'mac_decoder.estimateDurations').
+macDurations = [84, 120, 100]
+
+# Set to 'True' to cache, with the 'threshold' decoder, the correlation peaks
+# of the patterns above 'peakFloor' in 'peaks-extract-{suffix}.npz' (see
+# 'peak_cache.py'): 'threshold_sweep.py' tunes the detection from the cache.
+savePeaks = False
+peakFloor = 0.8
+
+# Set to 'True' to record the wall/CPU time, I/O and memory of each stage of
+# the classification (see 'profiling.py'). The records are saved, in JSON and
+# CSV format, with the 'profilePath' prefix.
+profile = False
+profilePath = "../data/profiles/macs-classification"
+
+# Number of datasets loaded in advance, on a background thread, while the
+# current one is classified (see 'prefetch.py'); 0 loads them synchronously.
+prefetchDepth = 1
+
+# Datasets saved by the classification:
+# - saveConcatenated: the IMACs (NIMACExecs) datasets, i.e., the detected IMAC
+#   (NIMAC executed) patterns of each waveform concatenated back-to-back and
+#   padded with zeros to the waveform length;
+# - saveSegments: the segment tensor, i.e., the samples of each MAC, indexed by
+#   its neuron/input position (see 'assembleMACs'), and the start sample of
+#   each segment in the waveform. The type of each segment is given by the
+#   orderExecMACs dataset.
+# The concatenated IMACs are the input of the default analysis
+# ('partition_circum_waveforms.py', then 'compute_ranking.py' with
+# 'useSegments = False'); clear 'saveConcatenated' only to analyse the
+# segments.
+saveConcatenated = True
+saveSegments = True
+
+# Set to the name of a preprocessing configuration (see 'preprocess.py') to
+# classify the preprocessed waveforms with the preprocessed patterns; the
+# datasets are saved with the '-{preprocessing}' suffix.
+preprocessing = None
 
 def checkIaPAMs(IaPAMs, refIndex):
   """
@@ -77,20 +137,255 @@ def checkIaPAMs(IaPAMs, refIndex):
 
   return np.asarray(consistencies, dtype = np.uint32), np.asarray(inconsistencies, dtype = np.uint32)
 
-def saveIaPAM(IaPAM, IMACs, NIMACExecs, orderExecMACs, execMACs, suffix = ""):
+def saveIaPAM(IaPAM, IMACs, NIMACExecs, orderExecMACs, execMACs, segments, segmentStarts, suffix = ""):
   print(">> Extraction terminated")
   print(">> Identified IaPAM, IMACs and exec'd MACs positions")
   print(f">> Saving IaPAM in {datapathCirc}/IaPAM-extract-{suffix}.npy")
-  print(f">> Saving IMACs in {datapathCirc}/IMACs-extract-{suffix}.npy")
-  print(f">> Saving IMACs in {datapathCirc}/NIMACExecs-extract-{suffix}.npy")
-  print(f">> Saving IMACs in {datapathCirc}/orderExecMACs-extract-{suffix}.npy")
+  if saveConcatenated:
+    print(f">> Saving IMACs in {datapathCirc}/IMACs-extract-{suffix}.npy")
+    print(f">> Saving NIMACExecs in {datapathCirc}/NIMACExecs-extract-{suffix}.npy")
+  print(f">> Saving MACs order in {datapathCirc}/orderExecMACs-extract-{suffix}.npy")
   print(f">> Saving exec'd MACs in {datapathCirc}/execMACs-extract-{suffix}.npy")
+  if saveSegments:
+    print(f">> Saving MAC segments in {datapathCirc}/segments-extract-{suffix}.npy")
+    print(f">> Saving MAC segments' start in {datapathCirc}/segmentStarts-extract-{suffix}.npy")
+
+  with prof.stage('save'):
+    prof.npSave(f"{datapathCirc}/IaPAM-extract-{suffix}.npy", IaPAM)
+    if saveConcatenated:
+      prof.npSave(f"{datapathCirc}/IMACs-extract-{suffix}.npy", IMACs)
+      prof.npSave(f"{datapathCirc}/NIMACExecs-extract-{suffix}.npy", NIMACExecs)
+    prof.npSave(f"{datapathCirc}/orderExecMACs-extract-{suffix}.npy", orderExecMACs)
+    prof.npSave(f"{datapathCirc}/execMACs-extract-{suffix}.npy", execMACs)
+    if saveSegments:
+      prof.npSave(f"{datapathCirc}/segments-extract-{suffix}.npy", segments)
+      prof.npSave(f"{datapathCirc}/segmentStarts-extract-{suffix}.npy", segmentStarts)
+
+def detectPatterns(w, patternIMAC, patternNIMACExec, patternNIMACSkip, threshold = None, peaks = None, index = None):
+  """
+  Detect the MAC patterns in the given side-channel waveform.
+
+  Args:
+    - w: side-channel waveform; numpy array of shape (nSamples,).
+    - patternIMAC, patternNIMACExec, patternNIMACSkip: the MAC patterns.
+    - threshold: detection threshold on the correlation score; if None, the
+      module-level 'threshold' is used.
+    - peaks, index: if given, the correlation peaks are recorded in the
+      'peak_cache.PeakCache' @peaks@ as the ones of the waveform @index@.
+
+  Return: three sorted numpy arrays, with the position of the detected IMAC,
+  NIMAC (executed) and NIMAC (skipped) patterns.
+  """
+
+  threshold = globals()['threshold'] if threshold is None else threshold
+
+  with prof.stage('pattern-correlation'):
+    scoresIMAC = pattern_detection.correlation(w, patternIMAC)
+    scoresNIMACExec = pattern_detection.correlation(w, patternNIMACExec)
+    scoresNIMACSkip = pattern_detection.correlation(w, patternNIMACSkip)
+
+  if peaks is not None:
+    with prof.stage('peak-caching'):
+      peaks.add(index, [ scoresIMAC, scoresNIMACExec, scoresNIMACSkip ])
+
+  with prof.stage('peak-picking'):
+    corrlIMAC = np.flatnonzero(scoresIMAC > threshold)
+    corrlNIMACExec = np.flatnonzero(scoresNIMACExec > threshold)
+    corrlNIMACSkip = np.flatnonzero(scoresNIMACSkip > threshold)
+
+  return corrlIMAC, corrlNIMACExec, corrlNIMACSkip
+
+def positionMACs(corrlIMAC, corrlNIMACExec, corrlNIMACSkip):
+  """
+  Place the detected patterns in the MLP (see 'assembleMACs'); the waveform is
+  not needed.
+
+  Return: a tuple (IaPAM, execMACs, orderExecMACs), as in 'assembleMACs'; None,
+  if the detected patterns do not fit in the MLP.
+  """
 
-  np.save(f"{datapathCirc}/IaPAM-extract-{suffix}.npy", IaPAM)
-  np.save(f"{datapathCirc}/IMACs-extract-{suffix}.npy", IMACs)
-  np.save(f"{datapathCirc}/NIMACExecs-extract-{suffix}.npy", NIMACExecs)
-  np.save(f"{datapathCirc}/orderExecMACs-extract-{suffix}.npy", orderExecMACs)
-  np.save(f"{datapathCirc}/execMACs-extract-{suffix}.npy", execMACs)
+  nMACs = p.imgWidth * p.imgHeight * p.nNeurons
+
+  # Overlapping skipped/executed NIMAC patterns are all kept.
+  # FIXME: The overlap should be resolved according to the correlation value
+  corrlNIMACSkip = np.asarray(corrlNIMACSkip, dtype = np.uint32)
+
+  # Build the IaPAM:
+  # For each identified IMAC pattern, count how many NIMAC (executed and
+  # skipped) patterns preceed it: the k-th IMAC lies at position
+  # (#preceeding NIMACs + k) of the IaPAM.
+  numNIMACs = np.searchsorted(corrlNIMACExec, corrlIMAC) + np.searchsorted(corrlNIMACSkip, corrlIMAC)
+  posIMACs = numNIMACs + np.arange(corrlIMAC.shape[0])
+
+  # Build list of processed pixels:
+  # For each identified IMAC and executed NIMAC, count how many skipped NIMACs
+  # preceed it.
+  corrlExecMACs = np.sort(np.concatenate((corrlIMAC, corrlNIMACExec)))
+  numNIMACs = np.searchsorted(corrlNIMACSkip, corrlExecMACs)
+  posExecMACs = numNIMACs + np.arange(corrlExecMACs.shape[0])
+
+  if (posIMACs >= nMACs).any() or (posExecMACs >= nMACs).any():
+    return None
+
+  # If there are not more IMACs (exec'd MACs), and we have not explored the
+  # whole image, the remaining image's pixels are left to 0.
+  IaPAM = np.zeros(shape = nMACs, dtype = bool)
+  IaPAM[posIMACs] = True
+  execMACs = np.zeros(shape = nMACs, dtype = bool)
+  execMACs[posExecMACs] = True
+
+  # 0 -> Skipped; 1 -> Executed; 2 -> Important
+  orderExecMACs = execMACs.astype(np.uint8) + IaPAM.astype(np.uint8)
+
+  return IaPAM, execMACs, orderExecMACs
+
+def assembleMACs(w, corrlIMAC, corrlNIMACExec, corrlNIMACSkip, lenIMAC, lenNIMACExec):
+  """
+  Rebuild the sequence of MACs of a waveform from the positions of the
+  detected patterns.
+
+  Args:
+    - w: side-channel waveform; numpy array of shape (nSamples,).
+    - corrlIMAC, corrlNIMACExec, corrlNIMACSkip: sorted positions of the
+      detected IMAC, NIMAC (executed) and NIMAC (skipped) patterns.
+    - lenIMAC, lenNIMACExec: the length of the IMAC and NIMAC (executed) patterns.
+
+  Return: a tuple (IaPAM, execMACs, orderExecMACs, IMACs, NIMACExecs, segments, segmentStarts), where:
+    - IaPAM: the important MACs; boolean array of shape (imgWidth * imgHeight * nNeurons,).
+    - execMACs: the executed MACs; boolean array of the same shape.
+    - orderExecMACs: 0 -> Skipped; 1 -> Executed; 2 -> Important.
+    - IMACs, NIMACExecs: the concatenation of the IMAC and NIMAC (executed)
+      patterns, padded with zeros to the waveform length.
+    - segments: the 'lenIMAC' samples starting at each MAC; numpy array of
+      shape (imgWidth * imgHeight * nNeurons, lenIMAC). The MAC of input k
+      (in processing order) of neuron n is at index n * imgWidth * imgHeight + k.
+      Samples past the waveform end, and MACs not detected, are set to 0.
+    - segmentStarts: the start sample of each segment in the waveform (-1 if
+      the MAC is not detected); numpy array of shape (imgWidth * imgHeight * nNeurons,).
+    None, if the detected patterns do not fit in the MLP.
+  """
+
+  nMACs = p.imgWidth * p.imgHeight * p.nNeurons
+
+  IMACs = np.zeros(shape = w.shape, dtype = np.float32)
+  NIMACExecs = np.zeros(shape = w.shape, dtype = np.float32)
+
+  pos = 0
+  for i in corrlIMAC:
+    # If we reached the end of the waveform, stop extraction for this
+    # waveform.
+    if (w.shape[0] < i + lenIMAC):
+      break
+    if (IMACs.shape[0] - pos < lenIMAC):
+      break
+    IMACs[pos:pos + lenIMAC] = w[i:i + lenIMAC]
+    pos = pos + lenIMAC
+  pos = 0
+  for i in corrlNIMACExec:
+    NIMACExecs[pos:pos + lenNIMACExec] = w[i:i + lenNIMACExec]
+    pos = pos + lenNIMACExec
+
+  positions = positionMACs(corrlIMAC, corrlNIMACExec, corrlNIMACSkip)
+  if positions is None:
+    return None
+  IaPAM, execMACs, orderExecMACs = positions
+
+  # Build the segments:
+  # The k-th detected pattern (of any type) is the k-th MAC, consistently with
+  # the positions computed above.
+  corrlMACs = np.sort(np.concatenate((corrlIMAC, corrlNIMACExec, corrlNIMACSkip)))[:nMACs]
+  segmentStarts = np.full(shape = nMACs, fill_value = -1, dtype = np.int32)
+  segmentStarts[:corrlMACs.shape[0]] = corrlMACs
+
+  indices = corrlMACs[:, None] + np.arange(lenIMAC)
+  valid = indices < w.shape[0]
+  segments = np.zeros(shape = (nMACs, lenIMAC), dtype = np.float32)
+  segments[:corrlMACs.shape[0]] = np.where(valid, w[np.minimum(indices, w.shape[0] - 1)], 0)
+
+  return IaPAM, execMACs, orderExecMACs, IMACs, NIMACExecs, segments, segmentStarts
+
+def classifyWave(w, patternIMAC, patternNIMACExec, patternNIMACSkip, threshold = None, peaks = None, index = None):
+  """
+  Classify the MACs of a single side-channel waveform.
+
+  Args:
+    - w: side-channel waveform; numpy array of shape (nSamples,).
+    - patternIMAC, patternNIMACExec, patternNIMACSkip: the MAC patterns.
+    - threshold, peaks, index: see 'detectPatterns'.
+
+  Return: the tuple returned by 'assembleMACs'; None if the waveform cannot be
+  classified.
+  """
+
+  corrlIMAC, corrlNIMACExec, corrlNIMACSkip = detectPatterns(w, patternIMAC, patternNIMACExec, patternNIMACSkip, threshold, peaks, index)
+
+  if corrlIMAC.shape[0] == 0:
+    print("No IMAC identified.")
+    return None
+  if corrlNIMACExec.shape[0] == 0:
+    print("No NIMAC (Executed) identified.")
+    return None
+  if corrlNIMACSkip.shape[0] == 0:
+    print("No NIMAC (Skipped) identified.")
+    return None
+
+  with prof.stage('iapam-assembly'):
+    macs = assembleMACs(w, corrlIMAC, corrlNIMACExec, corrlNIMACSkip, len(patternIMAC), len(patternNIMACExec))
+
+  if macs is None:
+    print("Too many MACs identified.")
+  return macs
+
+def decodeWaves(waves, patternIMAC, patternNIMACExec, patternNIMACSkip):
+  """
+  Classify the MACs of the given side-channel waveforms with the sequence
+  decoder or the fast segmentation (see 'mac_decoder.py'), in blocks of
+  'decoderBlockSize' ('fastBlockSize') waveforms.
+
+  Yield: the index of each waveform and the tuple returned by 'assembleMACs'
+  (None if the MACs do not fit in the waveform).
+  """
+
+  patterns = [ patternNIMACSkip, patternNIMACExec, patternIMAC ]
+  scale = lambda n : pp.scale(n, preprocessing)
+  durations = None if macDurations is None else md.durationModel([ scale(d) for d in macDurations ])
+  IaPAM = None
+  blockSize = fastBlockSize if decoder == 'fast' else decoderBlockSize
+
+  for first in range(0, waves.shape[0], blockSize):
+    block = np.asarray(waves[first:first + blockSize], dtype = np.float32)
+    scores = None
+    if durations is None:
+      with prof.stage('pattern-correlation'):
+        scores = md.scoreTracks(block, patterns)
+      durations = md.estimateDurations(scores, patterns, threshold)
+      print(f">> MAC durations (skipped, executed, important): {durations.tolist()}")
+
+    if decoder == 'fast':
+      with prof.stage('fast-segmentation'):
+        types, starts, pathScores = md.segment(block, patterns, durations, firstSample = scale(firstSample), templateLength = scale(40), startWindow = scale(300), maxNeuronGap = scale(300))
+      # The waveforms segmented with low confidence (e.g., desynchronised) are
+      # classified by the threshold detection.
+      fallback = pathScores < fastMinConfidence
+    else:
+      with prof.stage('pattern-correlation'):
+        scores = md.scoreTracks(block, patterns) if scores is None else scores
+      with prof.stage('viterbi'):
+        types, starts, pathScores = md.decode(scores, durations, IaPAM)
+        if constrainIaPAM and IaPAM is None:
+          IaPAM = md.consensusIaPAM(types)
+          types, starts, pathScores = md.decode(scores, durations, IaPAM)
+      fallback = np.zeros(shape = block.shape[0], dtype = bool)
+
+    for j, w in enumerate(block):
+      if fallback[j]:
+        yield first + j, classifyWave(w, patternIMAC, patternNIMACExec, patternNIMACSkip)
+        continue
+      with prof.stage('iapam-assembly'):
+        macs = None
+        if np.isfinite(pathScores[j]):
+          macs = assembleMACs(w, starts[j][types[j] == md.important], starts[j][types[j] == md.executed], starts[j][types[j] == md.skipped], len(patternIMAC), len(patternNIMACExec))
+      yield first + j, macs
 
 def extractIaPAM(waves, patternIMAC, patternNIMACExec, patternNIMACSkip, suffix = ""):
   """
@@ -122,164 +417,96 @@ def extractIaPAM(waves, patternIMAC, patternNIMACExec, patternNIMACSkip, suffix
   # to '0'.
   IMACs = np.zeros(shape = (waves.shape[0], waves.shape[1]), dtype = np.float32)
   NIMACExecs = np.zeros(shape = (waves.shape[0], waves.shape[1]), dtype = np.float32)
+  # Per-MAC segments (see 'assembleMACs').
+  segments = np.zeros(shape = (waves.shape[0], p.imgWidth * p.imgHeight * p.nNeurons, len(patternIMAC)), dtype = np.float32)
+  segmentStarts = np.full(shape = (waves.shape[0], p.imgWidth * p.imgHeight * p.nNeurons), fill_value = -1, dtype = np.int32)
 
-  #fig = plt.figure(figsize = (7.5, 2), dpi = 300)
-  #gs = fig.add_gridspec(1, hspace = 0)
-  #axs = gs.subplots(sharex = True, sharey = True)
+  assert decoder in available_decoders
 
   with alive_bar(waves.shape[0]) as bar:
-    for index, w in enumerate(waves):
-      corrlIMAC = np.asarray( [c[0] for c in enumerate(pattern_detection.correlation(w, patternIMAC)) if c[1] > 0.92] )
-      corrlNIMACExec = np.asarray( [c[0] for c in enumerate(pattern_detection.correlation(w, patternNIMACExec)) if c[1] > 0.92] )
-      corrlNIMACSkip = np.asarray( [c[0] for c in enumerate(pattern_detection.correlation(w, patternNIMACSkip)) if c[1] > 0.92] )
-
-      if corrlIMAC.shape[0] == 0:
-        print(f"Skipping {index}/{waves.shape[0]}: no IMAC identified.")
-        continue
-      if corrlNIMACExec.shape[0] == 0:
-        print(f"Skipping {index}/{waves.shape[0]}: no NIMAC (Executed) identified.")
-        continue
-      if corrlNIMACSkip.shape[0] == 0:
-        print(f"Skipping {index}/{waves.shape[0]}: no IMAC (Skipped) identified.")
+    if decoder != 'threshold':
+      for index, macs in decodeWaves(waves, patternIMAC, patternNIMACExec, patternNIMACSkip):
+        if macs is None:
+          print(f"Skipping {index}/{waves.shape[0]}.")
+          continue
+
+        IaPAMs[index], execMACs[index], orderExecMACs[index], IMACs[index], NIMACExecs[index], segments[index], segmentStarts[index] = macs
+        bar()
+    else:
+      peaks = pc.PeakCache(peakFloor) if savePeaks else None
+      for index, w in enumerate(waves):
+        macs = classifyWave(w, patternIMAC, patternNIMACExec, patternNIMACSkip, peaks = peaks, index = index)
+
+        if macs is None:
+          print(f"Skipping {index}/{waves.shape[0]}.")
+          continue
+
+        IaPAMs[index], execMACs[index], orderExecMACs[index], IMACs[index], NIMACExecs[index], segments[index], segmentStarts[index] = macs
+        bar()
+
+      if peaks is not None:
+        print(f">> Saving {peaks.peaks().shape[0]} correlation peaks in {datapathCirc}/peaks-extract-{suffix}.npz")
+        with prof.stage('save'):
+          peaks.save(f"{datapathCirc}/peaks-extract-{suffix}.npz")
+
+  with prof.stage('consistency-check'):
+    execMACs = np.asarray([ u.bytify(u.reverse(e)) for e in execMACs ], dtype = np.uint8)
+
+    # Consistency check.
+    # We first check what is the most recurrent IaPAM.
+    # If the analysed IaPAM has inconsistency rate of less than 0.25, we keep it and end the extraction.
+    # Otherwise, we explore the next IaPAM.
+    # In case of an incosistent IaPAM, the check identifies also the corresponding waveform for later
+    # processing (e.g., discarding it from future analyses).
+    for i in range(0, IaPAMs.shape[0]):
+      consistencies, inconsistencies = checkIaPAMs(IaPAMs, i)
+
+      if not inconsistencies.size:
+        saveIaPAM(u.bytify(u.reverse(IaPAMs[i])), IMACs, NIMACExecs, orderExecMACs, execMACs, segments, segmentStarts, suffix)
+        return u.reverse(IaPAMs[i])
+
+      inconsistencyRate = inconsistencies.size / (inconsistencies.size + consistencies.size)
+      print(f">> Detected the following inconsistencies (rate = {inconsistencyRate}):")
+      print(f">> Waveform indeces: {inconsistencies}")
+
+      if inconsistencyRate > 0.25:
         continue
- 
-      # These "masks" are the original side-channel waveform, but only the
-      # samples with the identified patterns are kept.
-      IMACMask = np.zeros(shape = w.shape)
-      NIMACMaskExec = np.zeros(shape = w.shape)
-      NIMACMaskSkip = np.zeros(shape = w.shape)
-
-      pos = 0
-      # Used to store the NIMAC skipped not overlapping the NIMAC executed.
-      updatedCorrlNIMACSkip = []
-      for i in corrlIMAC:
-        # If we reached the end of the waveform, stop extraction for this
-        # waveform.
-        if (w.shape[0] < i + len(patternIMAC)):
-          break
-        if (IMACs.shape[1] - pos < len(patternIMAC)):
-          break
-
-        IMACMask[i:i + len(patternIMAC)] = w[i:i + len(patternIMAC)]
-        IMACs[index, pos:pos + len(patternIMAC)] = w[i:i + len(patternIMAC)]
-        #axs[index].text(i - (len(patternIMAC) * 1.5), -0.4, r'$\textit{I}$')
-        pos = pos + len(patternIMAC)
-      pos = 0
-      for i in corrlNIMACExec:
-        NIMACMaskExec[i:i + len(patternNIMACExec)] = w[i:i + len(patternNIMACExec)]
-        NIMACExecs[index, pos:pos + len(patternNIMACExec)] = w[i:i + len(patternNIMACExec)]
-        #axs[index].text(i - (len(patternNIMACExec) * 1.25), -0.4, r'$\textit{E}$')
-        pos = pos + len(patternNIMACExec)
-      for i in corrlNIMACSkip:
-        # Filter out the overlapping patterns (assuming skipped NIMACs exhibit a shorter pattern)
-        # FIXME: This check should be done according to the correlation value
-        #if not (NIMACMaskExec[i:i + len(patternNIMACSkip)] != 0.0).any():
-        NIMACMaskSkip[i:i + len(patternNIMACSkip)] = w[i:i + len(patternNIMACSkip)]
-        #axs[index].text(i - len(patternNIMACSkip) * 2, -0.4, r'$\textit{S}$')
-        updatedCorrlNIMACSkip.append(i)
-
-      updatedCorrlNIMACSkip = np.array(updatedCorrlNIMACSkip, dtype = np.uint32)
-
-      #axs.set_xlabel(r"\textbf{Sample}")
-      #axs.set_ylabel(r"\textbf{Power}")
-      #axs.ticklabel_format(axis = 'x', style = 'sci', scilimits = (0, 0), useMathText=True)
-      #axs.plot(w[160:3820], linewidth = 0.5, label=r"\textbf{Raw}")
-      #axs.plot(IMACMask[160:3820] + 0.5, alpha = 0.75, linewidth = 0.5, label = r"\textbf{IMAC}")
-      #axs.plot(NIMACMaskExec[160:3820] + 0.75, alpha = 0.75, linewidth = 0.5, label = r"\textbf{NIMAC (Exec)}")
-      #axs.plot(NIMACMaskSkip[160:3820] + 1.00, alpha = 0.75, linewidth = 0.5, label = r"\textbf{NIMAC (Skip)}")
-      #plt.show(block = True)
-
-      IaPAM = []
-      lastNumNIMACs = 0
-      # build the IaPAM:
-      # For each identified IMAC pattern:
-      # 1. Compute how many preceeding NIMAC (executed and skipped) pattern are
-      # present (numNIMACs)
-      # 2. Append a number #numNIMACs of zeros
-      # 3. Append a 1 (the identified IMAC)
-      for i in corrlIMAC:
-        numNIMACs = len(np.where((corrlNIMACExec < i))[0]) + len(np.where((updatedCorrlNIMACSkip < i))[0])
-        #print(f"[{i}: {lastNumNIMACs}; {numNIMACs})")
-        IaPAM = IaPAM + [0] * (numNIMACs - lastNumNIMACs) + [1]
-        lastNumNIMACs = numNIMACs
-      # If there are not more IMACs, and we have not explored the whole image,
-      # append a number of 0 equivalent to the remaining image's pixels.
-      pad = p.imgWidth * p.imgHeight * p.nNeurons - len(IaPAM)
-      IaPAMs[index] = IaPAM + [0] * pad
-
-      waveExecMACs = []
-      lastNumNIMACs = 0
-      # build list of processed pixels:
-      # For each waveform:
-      #   For each identified IMAC and executed NIMAC
-      #   1. Compute how many preceeding skipped NIMACs are present
-      #   2. Append a number of #numNIMACs of zeros
-      #   3. Append a 1 (the identified IMAC or executed NIMAC)
-      corrlExecMACs = np.sort(np.concatenate((corrlIMAC, corrlNIMACExec)))
-      for i in corrlExecMACs:
-        numNIMACs = len(np.where((updatedCorrlNIMACSkip < i))[0])
-        waveExecMACs = waveExecMACs + [0] * (numNIMACs - lastNumNIMACs) + [1]
-        lastNumNIMACs = numNIMACs
-      pad = p.imgWidth * p.imgHeight * p.nNeurons - len(waveExecMACs)
-      execMACs[index] = waveExecMACs + [0] * pad
-
-      # 0 -> Skipped; 1 -> Executed; 2 -> Important
-      orderExecMACs[index] = execMACs[index].astype(np.uint8) + IaPAMs[index].astype(np.uint8)
-      bar()
-
-  #box = axs[1].get_position()
-  #axs[1].set_position([box.x0, box.y0 + box.height * 0.1, box.width, box.height * 0.9])
-  #leg = axs[1].legend(loc='upper center', bbox_to_anchor=(0.5, -0.05),
-  #        fancybox=True, shadow=False, ncol=5)
-  #for line in leg.get_lines():
-  #  line.set_linewidth(1.75)
-
-  #plt.tight_layout()
-  #plt.savefig('waveforms-macs-sequence-extraction.svg')
-  #plt.show()
-
-  execMACs = np.asarray([ u.bytify(u.reverse(e)) for e in execMACs ], dtype = np.uint8)
-
-  # Consistency check.
-  # We first check what is the most recurrent IaPAM.
-  # If the analysed IaPAM has inconsistency rate of less than 0.25, we keep it and end the extraction.
-  # Otherwise, we explore the next IaPAM.
-  # In case of an incosistent IaPAM, the check identifies also the corresponding waveform for later
-  # processing (e.g., discarding it from future analyses).
-  for i in range(0, IaPAMs.shape[0]):
-    consistencies, inconsistencies = checkIaPAMs(IaPAMs, i)
-
-    if not inconsistencies.size:
-      saveIaPAM(u.bytify(u.reverse(IaPAMs[i])), IMACs, NIMACExecs, orderExecMACs, execMACs, suffix)
-      return u.reverse(IaPAMs[i])
-
-    inconsistencyRate = inconsistencies.size / (inconsistencies.size + consistencies.size)
-    print(f">> Detected the following inconsistencies (rate = {inconsistencyRate}):")
-    print(f">> Waveform indeces: {inconsistencies}")
-
-    if inconsistencyRate > 0.25:
-      continue
-
-    print(">> Less than 0.25 inconsistencies")
-    saveIaPAM(u.bytify(u.reverse(IaPAMs[consistencies[0]])), IMACs, NIMACExecs, orderExecMACs, execMACs, suffix)
-
-    print(f">> Save inconsistencies in {datapathCirc}/inconsistencies.npy")
-    np.save(f"{datapathCirc}/inconsistencies-index.npy", inconsistencies)
-    np.save(f"{datapathCirc}/inconsistencies.npy", u.bytify(u.reverse(IaPAMs[inconsistencies])))
-    return u.reverse(IaPAMs[consistencies[0]])
-
-  print(">> Detected too many inconsistencies")
+
+      print(">> Less than 0.25 inconsistencies")
+      saveIaPAM(u.bytify(u.reverse(IaPAMs[consistencies[0]])), IMACs, NIMACExecs, orderExecMACs, execMACs, segments, segmentStarts, suffix)
+
+      print(f">> Save inconsistencies in {datapathCirc}/inconsistencies.npy")
+      np.save(f"{datapathCirc}/inconsistencies-index.npy", inconsistencies)
+      np.save(f"{datapathCirc}/inconsistencies.npy", u.bytify(u.reverse(IaPAMs[inconsistencies])))
+      return u.reverse(IaPAMs[consistencies[0]])
+
+    print(">> Detected too many inconsistencies")
 
 
 def main():
 
-  imac = np.load('../artefacts/patterns/pattern-IMAC.npy')
-  nimacexec = np.load('../artefacts/patterns/pattern-NIMACExec.npy')
-  nimacskip = np.load('../artefacts/patterns/pattern-NIMACSkip.npy')
+  if profile:
+    prof.enable()
+
+  patternspath = pp.patternsPath('../artefacts/patterns', preprocessing)
+  imac = np.load(f'{patternspath}/pattern-IMAC.npy')
+  nimacexec = np.load(f'{patternspath}/pattern-NIMACExec.npy')
+  nimacskip = np.load(f'{patternspath}/pattern-NIMACSkip.npy')
+
+  def load(suffix):
+    with prof.stage('load'):
+      return prof.npLoad(f'{datapathProt}/waveforms-extract-{suffix}.npy')
+
+  suffixes = [ db + pp.datasetSuffix(preprocessing) for db in databases_protected ]
+  for suffix, w in pf.prefetch(suffixes, load, prefetchDepth):
+    with prof.stage('classification') as s:
+      extractIaPAM(w, imac, nimacexec, nimacskip, suffix = suffix)
+      s.addTraces(w.shape[0])
 
-  for db in databases_protected:
-    w = np.load(f'{datapathProt}/waveforms-extract-{db}.npy')
-    extractIaPAM(w, imac, nimacexec, nimacskip, suffix = db)
+  if profile:
+    prof.report()
+    prof.saveJSON(f'{profilePath}.json')
+    prof.saveCSV(f'{profilePath}.csv')
 
 if __name__ == '__main__':
   main()
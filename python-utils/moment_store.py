@@ -0,0 +1,142 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from corrl import CorrlMoments, rankGuesses
+
+## This module implements the storage of the correlation analysis as moments
+## (see 'corrl.CorrlMoments'), instead of correlation coefficients.
+##
+## 'MomentStore' keeps, for each checkpoint (a block of 'corrlSampling'
+## traces), the moments of the block only: number of traces, sums and sums of
+## squares of the samples and of the hypotheses, and sums of their products.
+## The correlation coefficients (and the rankings) after any number of
+## checkpoints are the ones of the cumulative sum of the preceeding blocks.
+##
+## New traces are appended to the store: they first complete the last block
+## (if partial), then form new blocks; the stored blocks are not recomputed.
+##
+## With integer moments (the ADC codes and the Hamming Weight hypotheses, see
+## 'CorrlMoments'), the blocks are stored in int32 (int64 if they do not fit):
+## half of the correlation coefficients, in float64.
+
+fields = ['sumX', 'sumX2', 'sumY', 'sumY2', 'sumXY']
+
+class MomentStore:
+  def __init__(self, numSamples, numHyps, corrlSampling, integer = True):
+    self.numSamples = numSamples
+    self.numHyps = numHyps
+    self.corrlSampling = corrlSampling
+    self.integer = integer
+
+    dtype = np.int32 if integer else np.float64
+    self.counts = np.zeros(shape = 0, dtype = np.int64)
+    self.sumX = np.zeros(shape = (0, numSamples), dtype = dtype)
+    self.sumX2 = np.zeros(shape = (0, numSamples), dtype = dtype)
+    self.sumY = np.zeros(shape = (0, numHyps), dtype = dtype)
+    self.sumY2 = np.zeros(shape = (0, numHyps), dtype = dtype)
+    self.sumXY = np.zeros(shape = (0, numSamples, numHyps), dtype = dtype)
+
+  @property
+  def numTraces(self):
+    return int(np.sum(self.counts))
+
+  @property
+  def numSnapshots(self):
+    """ The number of complete checkpoints. """
+    return self.numTraces // self.corrlSampling
+
+  def _block(self, x, y):
+    m = CorrlMoments(self.numSamples, self.numHyps, self.integer)
+    m.update(x, y)
+    return m
+
+  def _store(self, name, rows):
+    """ Set the field @name@ to @rows@, widening int32 to int64 if needed. """
+    current = getattr(self, name)
+    if current.dtype == np.int32 and np.max(np.absolute(rows), initial = 0) >= 2 ** 31:
+      current = current.astype(np.int64)
+    setattr(self, name, rows.astype(current.dtype))
+
+  def append(self, x, y):
+    """
+    Append the traces @x@ (numTraces, numSamples), with hypotheses @y@
+    (numTraces, numHyps).
+    """
+
+    first = 0
+    blocks = []
+    if self.counts.size > 0 and self.counts[-1] < self.corrlSampling:
+      # Complete the last block.
+      first = min(self.corrlSampling - int(self.counts[-1]), x.shape[0])
+      last = self._block(x[:first], y[:first])
+      self.counts[-1] += last.n
+      for name in fields:
+        self._store(name, np.concatenate((getattr(self, name)[:-1], (getattr(self, name)[-1] + getattr(last, name))[None])))
+
+    for begin in range(first, x.shape[0], self.corrlSampling):
+      blocks.append(self._block(x[begin:begin + self.corrlSampling], y[begin:begin + self.corrlSampling]))
+
+    if blocks:
+      self.counts = np.concatenate((self.counts, [ b.n for b in blocks ]))
+      for name in fields:
+        self._store(name, np.concatenate((getattr(self, name), [ getattr(b, name) for b in blocks ])))
+    return self
+
+  def moments(self, numSnapshots = None):
+    """ Return the cumulative 'CorrlMoments' of the first @numSnapshots@ blocks (default: all). """
+    numSnapshots = self.counts.size if numSnapshots is None else numSnapshots
+    m = CorrlMoments(self.numSamples, self.numHyps, self.integer)
+    m.n = int(np.sum(self.counts[:numSnapshots]))
+    for name in fields:
+      setattr(m, name, np.sum(getattr(self, name)[:numSnapshots], axis = 0, dtype = getattr(m, name).dtype))
+    return m
+
+  def corrls(self, snapshots = None):
+    """
+    Return the correlation coefficients at the given checkpoints (default: all
+    the complete ones); matrix (numSnapshots, numSamples, numHyps).
+    """
+
+    snapshots = range(0, self.numSnapshots) if snapshots is None else snapshots
+    wanted = set(snapshots)
+    corrls = np.zeros(shape = (len(snapshots), self.numSamples, self.numHyps))
+    index = { s: i for i, s in enumerate(snapshots) }
+
+    m = CorrlMoments(self.numSamples, self.numHyps, self.integer)
+    for s in range(0, max(wanted, default = -1) + 1):
+      m.n += int(self.counts[s])
+      for name in fields:
+        getattr(m, name)[...] += getattr(self, name)[s]
+      if s in wanted:
+        corrls[index[s]] = m.corrl()
+    return corrls
+
+  def rankings(self, snapshots = None):
+    """ Return the rank (from 1) of each hypothesis by absolute correlation; as 'corrls'. """
+    return rankGuesses(np.absolute(self.corrls(snapshots)))
+
+  def save(self, path):
+    np.savez(path, counts = self.counts, corrlSampling = self.corrlSampling, integer = self.integer, **{ name: getattr(self, name) for name in fields })
+
+  @classmethod
+  def load(cls, path):
+    data = np.load(path)
+    store = cls(data['sumXY'].shape[1], data['sumXY'].shape[2], int(data['corrlSampling']), bool(data['integer']))
+    store.counts = data['counts']
+    for name in fields:
+      setattr(store, name, data[name])
+    return store
@@ -0,0 +1,154 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy  as np
+import params as p
+import utils  as u
+
+from corrl import CorrlMoments
+
+## This module implements the online correlation power analysis (CPA) run
+## beside the acquisition campaign.
+##
+## 'OnlineCPAMonitor' is a consumer of the capture loop (see
+## 'test_vector.collect'). It buffers the captured traces and, each 'every'
+## traces, it updates the correlation accumulators (see 'corrl.CorrlMoments')
+## of each target (a weight, identified by its neuron and input index), and
+## computes the rank of the true weight and of the best candidate.
+##
+## As in 'compute_ranking.py', the analysis targets the accumulator (Hamming
+## Weight leakage model) after the MAC of the targeted input, and the
+## hypotheses are computed from the true weights of the preceeding inputs.
+## The input index follows the processing order of the MLP (each set of 8
+## inputs is processed in reverse order), and the non-important MACs skipped by
+## MACPruning do not contribute to the accumulator.
+##
+## The monitor prints the guessing entropy (log2 of the rank of the true weight)
+## of each target at each snapshot, and, if 'plot' is set, it updates a live
+## plot of the GE curves.
+##
+## The monitor sets 'done' once the convergence criterion holds: the true
+## weight of every target has been ranked first in the last 'stableSnapshots'
+## snapshots. The capture loop stops at the first consumer done.
+
+def defaultWindow(neuron, inputIndex):
+  """
+  Return the window of samples (first, last) of the unprotected implementation
+  where to look for the leakage of the given input (see 'compute_ranking.py').
+  """
+  firstSample = 236 + neuron * 3500 + (inputIndex // 8) * 1000
+  return firstSample, min(firstSample + 1000, p.nSamples)
+
+class OnlineCPAMonitor:
+  def __init__(self, targets, every = 500, stableSnapshots = 5, plot = False, savePath = None):
+    """
+    Args:
+      - targets: list of (neuron, inputIndex) or (neuron, inputIndex, firstSample, lastSample);
+        'inputIndex' in [1, 32). If the window of samples is omitted,
+        'defaultWindow' is used.
+      - every: the number of traces between two snapshots.
+      - stableSnapshots: the number of consecutive snapshots where every
+        target must be ranked first before stopping the capture.
+      - plot: show the live GE curves.
+      - savePath: if not None, save the history of the ranks (.npz) when closed.
+    """
+
+    self.targets = [ t if len(t) == 4 else tuple(t) + defaultWindow(*t) for t in targets ]
+    assert all(1 <= t[1] < p.imgWidth * p.imgHeight for t in self.targets)
+
+    self.every = every
+    self.stableSnapshots = stableSnapshots
+    self.plot = plot
+    self.savePath = savePath
+    self.done = False
+
+    numInputs = p.imgWidth * p.imgHeight
+    self.weights = u.processingOrder(p.weights.astype(np.uint32).reshape(p.nNeurons, numInputs))
+    self.candidates = np.arange(1, 128, dtype = np.uint32)
+
+    self.moments = [ CorrlMoments(last - first, self.candidates.shape[0]) for _, _, first, last in self.targets ]
+
+    # History of the snapshots: number of traces, rank of the true weight and
+    # best candidate of each target.
+    self.numTraces = []
+    self.ranks = []
+    self.best = []
+
+  def start(self, nWaves, IaPAM):
+    self.IaPAM = np.asarray(IaPAM, dtype = np.uint8)
+    self.buffer = []
+
+  def push(self, index, wave, toExecTable, inputs):
+    self.buffer.append((np.array(wave), toExecTable, inputs))
+    if len(self.buffer) == self.every:
+      self.snapshot()
+
+  def snapshot(self):
+    waves = np.asarray([ b[0] for b in self.buffer ], dtype = np.float64)
+    execMACs = u.execMask(self.IaPAM, np.asarray([ b[1] for b in self.buffer ]))
+    inputs = u.processingOrder(np.asarray([ b[2] for b in self.buffer ], dtype = np.uint32))
+    self.buffer = []
+
+    numInputs = p.imgWidth * p.imgHeight
+    ranks = []
+    best = []
+    for (neuron, inputIndex, first, last), moments in zip(self.targets, self.moments):
+      weights = self.weights[neuron]
+      execs = execMACs[:, neuron * numInputs:(neuron + 1) * numInputs]
+
+      # Accumulator after the MAC of the preceeding input.
+      prefix = np.sum(inputs[:, :inputIndex] * weights[:inputIndex] * execs[:, :inputIndex], axis = 1, dtype = np.uint32)
+      hyps = u.hwArray(prefix[:, None] + inputs[:, inputIndex:inputIndex + 1] * self.candidates[None, :])
+
+      moments.update(waves[:, first:last], hyps)
+
+      scores = np.max(np.absolute(moments.corrl()), axis = 0)
+      trueScore = scores[weights[inputIndex] - 1]
+      ranks.append(1 + np.count_nonzero(scores > trueScore))
+      best.append(self.candidates[np.argmax(scores)])
+
+    self.numTraces.append(self.moments[0].n)
+    self.ranks.append(ranks)
+    self.best.append(best)
+
+    ges = np.log2(ranks)
+    print(f"> Online CPA -- {self.numTraces[-1]} traces -- GE: " + " ".join([ f"n{t[0]}/i{t[1]}={ge:.2f}" for t, ge in zip(self.targets, ges) ]))
+
+    if self.plot:
+      self.draw()
+
+    if len(self.ranks) >= self.stableSnapshots and (np.asarray(self.ranks[-self.stableSnapshots:]) == 1).all():
+      print(f"> Online CPA -- all targets ranked first in the last {self.stableSnapshots} snapshots")
+      self.done = True
+
+  def draw(self):
+    import matplotlib.pyplot as plt
+
+    if not hasattr(self, 'axs'):
+      plt.ion()
+      self.fig, self.axs = plt.subplots(1)
+
+    self.axs.clear()
+    self.axs.grid(axis = 'both', color = "lightgrey", linewidth = '0.5', linestyle = 'dashed')
+    self.axs.set_xlabel('Traces')
+    self.axs.set_ylabel('Guessing Entropy')
+    for t, ge in zip(self.targets, np.log2(np.asarray(self.ranks)).T):
+      self.axs.plot(self.numTraces, ge, label = f"Neuron {t[0]} -- Input {t[1]}")
+    self.axs.legend()
+    plt.pause(0.001)
+
+  def close(self):
+    if self.savePath is not None and self.ranks:
+      np.savez(self.savePath, targets = np.asarray(self.targets), numTraces = np.asarray(self.numTraces), ranks = np.asarray(self.ranks), best = np.asarray(self.best))
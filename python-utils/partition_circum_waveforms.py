@@ -1,4 +1,6 @@
 import numpy as np
+import os
+import preprocess as pp
 
 ## This script partition traces captured from implementations with MACPruning
 ## enabled.
@@ -17,6 +19,18 @@ import numpy as np
 ## By default, the scripts saves in numpy format the partitions.
 ## The 'datapath' variable refers to the base path where to save the partitions.
 ##
+## If 'partitionSegments' is set, the script partitions also the per-MAC
+## segment datasets listed in 'segmentDatasets' (see 'macs_classification.py'
+## and 'pca.py'). The datasets not saved by the classification (e.g., the
+## IMACs, with 'saveConcatenated = False', or the segments of the datasets
+## classified before they were introduced) are skipped.
+##
+## If 'preprocessing' is set (see 'preprocess.py'), the script partitions the
+## classification of the preprocessed waveforms (IMACs, execMACs and segments
+## with the '-{preprocessing}' suffix), and saves the waveform (and segment)
+## partitions with the same suffix, as loaded by 'compute_ranking.py'; the
+## inputs and the hypotheses are not preprocessed.
+##
 ## The script prints on stdout the number of traces in each partition and the minimum between the two partitions.
 
 databases_protected = [ '01-07-2025-15:55-33'
@@ -33,17 +47,22 @@ numInputs = 32
 
 datapath = '../data/circumvented/'
 
+# See 'macs_classification.preprocessing'.
+preprocessing = None
+
+partitionSegments = False
+segmentDatasets = ['segments']
+
 numWaveformsExec = []
 numWaveformsNonExec = []
 
 for db in databases_protected: 
   for neuron in range(firstNeuron, lastNeuron):
-    waveformsFile = f'{datapath}/IMACs-extract-{db}.npy'
-    execMACsFile = f'{datapath}/execMACs-extract-{db}.npy'
+    suffix = pp.datasetSuffix(preprocessing)
+    execMACsFile = f'{datapath}/execMACs-extract-{db}{suffix}.npy'
     inputsFile = f'{datapath}/inputs-extract-{db}.npy'
     hypsFile = f'{datapath}/hyps-accum-extract-{db}.npy'
     
-    waveforms = np.load(waveformsFile)
     execMACs = np.load(execMACsFile)
     inputs = np.load(inputsFile)
     hyps = np.load(hypsFile)
@@ -53,7 +72,7 @@ for db in databases_protected:
     
     weightSet = (filteringWeight // 8) + neuron * numInputs // 8
 
-    for i in range(0, waveforms.shape[0]):
+    for i in range(0, execMACs.shape[0]):
       # We subtract from seven since the weights are processed in reverse order.
       if execMACs[i, weightSet] & (0x1 << (7 - filteringWeight)):
         execSet.append(i)
@@ -63,14 +82,22 @@ for db in databases_protected:
     numWaveformsExec.append(len(execSet))
     numWaveformsNonExec.append(len(nonExecSet))
 
-    np.save(f'{datapath}/waveforms-extract-neuron-{neuron}-exec-{filteringWeight}-{db}.npy', waveforms[execSet, :])
     np.save(f'{datapath}/inputs-extract-neuron-{neuron}-exec-{filteringWeight}-{db}.npy', inputs[execSet, :])
     np.save(f'{datapath}/hyps-accum-extract-neuron-{neuron}-exec-{filteringWeight}-{db}.npy', hyps[execSet, :])
     
-    np.save(f'{datapath}/waveforms-extract-neuron-{neuron}-non-exec-{filteringWeight}-{db}.npy', waveforms[nonExecSet, :])
     np.save(f'{datapath}/inputs-extract-neuron-{neuron}-non-exec-{filteringWeight}-{db}.npy', inputs[nonExecSet, :])
     np.save(f'{datapath}/hyps-accum-extract-neuron-{neuron}-non-exec-{filteringWeight}-{db}.npy', hyps[nonExecSet, :])
 
+    # The partitions of the IMACs are loaded as waveforms by 'compute_ranking.py'.
+    datasets = [ ('IMACs', 'waveforms') ] + ([ (name, name) for name in segmentDatasets ] if partitionSegments else [])
+    for name, outName in datasets:
+      if not os.path.exists(f'{datapath}/{name}-extract-{db}{suffix}.npy'):
+        print(f">> Skipping {name} of {db}: {datapath}/{name}-extract-{db}{suffix}.npy not found")
+        continue
+      x = np.load(f'{datapath}/{name}-extract-{db}{suffix}.npy', mmap_mode = 'r')
+      np.save(f'{datapath}/{outName}-extract-neuron-{neuron}-exec-{filteringWeight}-{db}{suffix}.npy', x[execSet])
+      np.save(f'{datapath}/{outName}-extract-neuron-{neuron}-non-exec-{filteringWeight}-{db}{suffix}.npy', x[nonExecSet])
+
 print(f"Minimum #waveforms EXEC: {min(numWaveformsExec)}")
 print(f"Minimum #waveforms NON-EXEC: {min(numWaveformsNonExec)}")
 print(f"Global minimum #waveforms: {min(numWaveformsNonExec + numWaveformsExec)}")
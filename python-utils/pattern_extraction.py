@@ -0,0 +1,439 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import numpy       as np
+import os
+import params      as p
+import profiling   as prof
+import sim_target  as st
+import test_vector as tv
+import time
+
+## This script extracts the MAC patterns (IMAC, NIMAC executed and NIMAC
+## skipped), used by 'macs_classification.py', from a sample of the waveforms
+## of the protected implementation: the first step of the circumvention of
+## MACPruning (Patterns Identification), otherwise carried out by hand.
+##
+## The extraction runs in five steps:
+## 1. Boundary motif: each MAC starts with the same instructions (the loop
+##    head), so that a short window ('motifLength' samples) at the start of a
+##    MAC recurs once per MAC. Among the windows starting in one MAC period
+##    (estimated from the autocorrelation of the waveforms) of a reference
+##    waveform, the motif is the one whose occurrences are most often spaced
+##    by a MAC duration, i.e., in [minLength, maxLength] samples.
+## 2. Segmentation: the occurrences of the motif (the peak of each run of
+##    correlation above 'motifThreshold') in each waveform are the
+##    boundaries of its MACs; the window between two consecutive boundaries is
+##    a candidate MAC.
+## 3. Clustering: the candidate MACs (their first 'windowLength' samples and
+##    their duration) are clustered by a mini-batch k-means in
+##    'numClusters' clusters; the clusters beyond the three largest gather the
+##    irregular windows (e.g., the last MAC of each neuron, followed by the
+##    epilogue of the neuron).
+## 4. Alignment: the motif does not sit at the same offset in every MAC type,
+##    so that the gap from a MAC of type t to the next one, of type u, is
+##    length[t] + offset[u] - offset[t]. The duration and the offset of each
+##    type are solved from the most frequent gap of each pair of types (see
+##    'alignMACs'); then, the offsets are shifted together to the MAC starts,
+##    where the windows of each type vary the least across the waveforms: a
+##    window starting earlier (later) includes the end of the previous (the
+##    start of the next) MAC, which changes with its type.
+## 5. Templates: the pattern of a type is the mean of its windows, each
+##    starting at the best correlation of the mean of the aligned windows
+##    within 'alignJitter' samples (see 'refineStarts'). The patterns are
+##    labelled by duration: the skipped NIMACs are the shortest (only the check
+##    of the toExecTable), the executed NIMACs the longest (check and MAC), the
+##    IMACs in between.
+##
+## The patterns are saved as '{outpath}/pattern-{IMAC,NIMACExec,NIMACSkip}.npy',
+## along with 'patterns.json', recording the duration of each MAC type and the
+## extraction parameters. The sample must include the three MAC types, i.e.,
+## waveforms with MACPruning enabled.
+##
+## With 'mode = "check"', the script extracts the patterns from 'checkWaves'
+## waveforms of the simulated target ('sim_target.py'), built from the
+## reference patterns in 'referencePath', and reports the durations and the
+## correlation of the extracted patterns with the reference ones (see
+## 'checkExtraction').
+
+# Duration range of a MAC (samples).
+minLength = 60
+maxLength = 160
+
+# Length of the boundary motif (samples) and detection threshold (a higher
+# threshold misses the boundaries of the noisier waveforms, a lower one merges
+# the types in the clustering).
+motifLength = 40
+motifThreshold = 0.85
+
+# Number of clusters and of samples of each candidate MAC.
+numClusters = 4
+windowLength = 130
+
+# Weight of the duration of a candidate MAC with respect to its samples.
+durationWeight = 0.05
+
+# Number of waveforms segmented at once.
+chunkSize = 256
+
+# Mini-batch k-means.
+batchSize = 2048
+numIterations = 100
+
+# Alignment: the number of windows of each type whose variance is measured,
+# and the maximum misalignment (samples) of a window from the template.
+alignSample = 2000
+alignJitter = 2
+
+labels = [ 'NIMACSkip', 'IMAC', 'NIMACExec' ]
+
+def normalisedWindows(x, length):
+  """ The windows of @length@ samples of each waveform of @x@, centred and of unit norm. """
+  windows = np.lib.stride_tricks.sliding_window_view(x, length, axis = -1)
+  windows = windows - np.mean(windows, axis = -1, keepdims = True)
+  norms = np.linalg.norm(windows, axis = -1, keepdims = True)
+  return np.divide(windows, norms, out = np.zeros(shape = windows.shape, dtype = np.float32), where = norms > 0)
+
+def slidingCorrls(x, motif):
+  """ Pearson correlation of @motif@ with each window of each waveform of @x@ (numWaves, numSamples). """
+  m = motif.shape[0]
+  motif = motif - np.mean(motif)
+  motif = (motif / np.linalg.norm(motif)).astype(np.float32)
+
+  cumsum = np.cumsum(np.pad(x, ((0, 0), (1, 0))), axis = 1, dtype = np.float64)
+  cumsum2 = np.cumsum(np.pad(np.square(x, dtype = np.float64), ((0, 0), (1, 0))), axis = 1)
+  sums = cumsum[:, m:] - cumsum[:, :-m]
+  norms = np.sqrt(np.maximum(cumsum2[:, m:] - cumsum2[:, :-m] - sums ** 2 / m, 0))
+
+  dots = np.zeros(shape = sums.shape, dtype = np.float32)
+  term = np.empty(shape = sums.shape, dtype = np.float32)
+  for k, t in enumerate(motif):
+    dots += np.multiply(t, x[:, k:k + dots.shape[1]], out = term)
+  return np.divide(dots, norms, out = np.zeros(shape = dots.shape), where = norms > 1e-6)
+
+def peaks(corrls, threshold, distance):
+  """
+  The peaks of @corrls@ (numWaves, numPositions): the maximum of each run of
+  positions above @threshold@, less than @distance@ positions apart; a list of
+  the positions of each waveform.
+  """
+  rows, cols = np.nonzero(corrls > threshold)
+  values = corrls[rows, cols]
+  newRun = np.ones(shape = rows.shape[0], dtype = bool)
+  newRun[1:] = (rows[1:] != rows[:-1]) | (cols[1:] - cols[:-1] >= distance)
+  runs = np.cumsum(newRun) - 1
+  best = np.lexsort((-values, runs))[np.flatnonzero(newRun)]
+  return np.split(cols[best], np.searchsorted(rows[best], np.arange(1, corrls.shape[0])))
+
+def period(x):
+  """ The MAC period: the lag in [minLength, maxLength] of the maximum mean autocorrelation of @x@. """
+  x = x - np.mean(x, axis = 1, keepdims = True)
+  spectrum = np.fft.rfft(x, n = 2 * x.shape[1], axis = 1)
+  autocorrl = np.mean(np.fft.irfft(np.abs(spectrum) ** 2, axis = 1), axis = 0)
+  return minLength + int(np.argmax(autocorrl[minLength:maxLength + 1]))
+
+def boundaryMotif(w, macPeriod):
+  """
+  The boundary motif of the waveform @w@ (step 1), searched among the windows
+  starting in one MAC period at the middle of the waveform.
+  """
+  middle = w.shape[0] // 2
+  candidates = normalisedWindows(w[middle:middle + macPeriod + motifLength - 1], motifLength)
+  corrls = candidates @ normalisedWindows(w, motifLength).T
+
+  scores = []
+  for motifPeaks in peaks(corrls, motifThreshold, minLength):
+    gaps = np.diff(motifPeaks)
+    scores.append(np.count_nonzero((gaps >= minLength) & (gaps <= maxLength)))
+  best = int(np.argmax(scores))
+
+  # Average the motif over its occurrences, to reduce the noise.
+  occurrences = peaks(corrls[best:best + 1], motifThreshold, minLength)[0]
+  return np.mean([ w[o:o + motifLength] for o in occurrences ], axis = 0)
+
+def candidateMACs(x, motif):
+  """
+  The candidate MACs of the waveforms @x@ (step 2): the index of the waveform,
+  the start sample and the duration of each of them.
+  """
+  allBoundaries = []
+  for first in range(0, x.shape[0], chunkSize):
+    allBoundaries += peaks(slidingCorrls(x[first:first + chunkSize], motif), motifThreshold, minLength)
+
+  indices, starts, durations = [], [], []
+  for i, boundaries in enumerate(allBoundaries):
+    gaps = np.diff(boundaries)
+    valid = (gaps >= minLength) & (gaps <= maxLength) & (boundaries[:-1] + windowLength <= x.shape[1])
+    indices.append(np.full(shape = np.count_nonzero(valid), fill_value = i))
+    starts.append(boundaries[:-1][valid])
+    durations.append(gaps[valid])
+  return np.concatenate(indices), np.concatenate(starts), np.concatenate(durations)
+
+def kmeansPlusPlus(x, k, rng):
+  """ k-means++ initialisation of @k@ centroids among the rows of @x@. """
+  centroids = [ x[rng.integers(x.shape[0])] ]
+  distances = np.sum((x - centroids[0]) ** 2, axis = 1)
+  for _ in range(1, k):
+    centroids.append(x[rng.choice(x.shape[0], p = distances / np.sum(distances))])
+    distances = np.minimum(distances, np.sum((x - centroids[-1]) ** 2, axis = 1))
+  return np.array(centroids)
+
+def assign(x, centroids):
+  """ The index of the nearest centroid of each row of @x@. """
+  distances = np.sum(centroids ** 2, axis = 1) - 2 * x @ centroids.T
+  return np.argmin(distances, axis = 1)
+
+def miniBatchKMeans(x, k, batchSize = batchSize, numIterations = numIterations, seed = 0):
+  """
+  Cluster the rows of @x@ in @k@ clusters, by mini-batch k-means (each
+  centroid moves towards the rows of the batch assigned to it, with a learning
+  rate of the inverse of its number of assigned rows).
+
+  Return: the centroids and the cluster of each row.
+  """
+  rng = np.random.default_rng(seed)
+  centroids = kmeansPlusPlus(x[rng.choice(x.shape[0], size = min(x.shape[0], 10 * batchSize), replace = False)], k, rng)
+  counts = np.zeros(shape = k)
+
+  for _ in range(numIterations):
+    batch = x[rng.integers(x.shape[0], size = min(batchSize, x.shape[0]))]
+    nearest = assign(batch, centroids)
+    batchCounts = np.bincount(nearest, minlength = k)
+    batchSums = (nearest == np.arange(k)[:, None]).astype(batch.dtype) @ batch
+    counts += batchCounts
+    updated = batchCounts > 0
+    rate = (batchCounts[updated] / counts[updated])[:, None]
+    centroids[updated] += rate * (batchSums[updated] / batchCounts[updated][:, None] - centroids[updated])
+
+  return centroids, assign(x, centroids)
+
+def pairGaps(types, durations, follows):
+  """
+  The most frequent gap between the boundary of a candidate MAC of each type
+  and the one of the following MAC, of each type, over the candidates whose
+  next candidate follows them (@follows@): matrices (3, 3) of the gaps (-1 if
+  not observed) and of their number.
+  """
+  gaps = np.full(shape = (len(labels), len(labels)), fill_value = -1)
+  counts = np.zeros(shape = gaps.shape, dtype = np.int64)
+  for t in range(len(labels)):
+    for u in range(len(labels)):
+      pairs = follows & (types[:-1] == t) & (types[1:] == u)
+      counts[t, u] = np.count_nonzero(pairs)
+      if counts[t, u] > 0:
+        gaps[t, u] = np.argmax(np.bincount(durations[:-1][pairs]))
+  return gaps, counts
+
+def alignMACs(x, indices, boundaries, durations, types):
+  """
+  The duration of each MAC type and the offset of its start before its
+  boundary (step 4), from the candidate MACs of the waveforms @x@ (see
+  'candidateMACs') of the given types (0 to 2, -1 for the irregular ones).
+  """
+  follows = (indices[1:] == indices[:-1]) & (boundaries[:-1] + durations[:-1] == boundaries[1:])
+  gaps, counts = pairGaps(types, durations, follows)
+
+  # gap[t, u] = length[t] + offset[u] - offset[t], with 'offset' the samples
+  # from the MAC start to the boundary; least squares over the observed pairs
+  # (weighted by their number), with offset[0] = 0.
+  rows, values, weights = [], [], []
+  for t, u in zip(*np.nonzero(counts)):
+    row = np.zeros(shape = 2 * len(labels))
+    row[t] += 1
+    row[len(labels) + u] += 1
+    row[len(labels) + t] -= 1
+    rows.append(row)
+    values.append(gaps[t, u])
+    weights.append(np.sqrt(counts[t, u]))
+  rows.append(np.eye(2 * len(labels))[len(labels)])
+  values.append(0)
+  weights.append(np.sqrt(np.max(counts)))
+  weights = np.asarray(weights)
+  solution = np.linalg.lstsq(np.asarray(rows) * weights[:, None], np.asarray(values) * weights, rcond = None)[0]
+  lengths = np.rint(solution[:len(labels)]).astype(np.int64)
+  offsets = np.rint(solution[len(labels):]).astype(np.int64)
+
+  # Shift the offsets together to the minimum total variance of the windows
+  # of each type (a sample of 'alignSample' windows per type).
+  shifts = np.arange(-motifLength, minLength)
+  variances = np.zeros(shape = shifts.shape[0])
+  rng = np.random.default_rng(0)
+  for t in range(len(labels)):
+    # The windows starting at each shift: boundary - offset - shift.
+    first = boundaries - offsets[t] - shifts[-1]
+    members = np.flatnonzero((types == t) & (first >= 0) & (first + lengths[t] + shifts.shape[0] <= x.shape[1]))
+    members = rng.choice(members, size = min(alignSample, members.shape[0]), replace = False)
+    windows = x[indices[members, None], first[members, None] + np.arange(lengths[t] + shifts.shape[0] - 1)]
+    cumsum = np.concatenate(([0], np.cumsum(np.var(windows, axis = 0, dtype = np.float64))))
+    # The window at shift s begins at (shifts[-1] - s) in the extended windows.
+    begins = shifts[-1] - shifts
+    variances += cumsum[begins + lengths[t]] - cumsum[begins]
+  offsets = offsets + shifts[np.argmin(variances)]
+
+  return lengths, offsets
+
+def refineStarts(x, indices, starts, length, jitter):
+  """
+  The mean of the windows of @length@ samples of @x@ at @starts@ (of the
+  waveforms @indices@), and the start of each window moved to its best
+  correlation with the mean within @jitter@ samples.
+  """
+  windows = lambda i, s : x[indices[i, None], s[:, None] + np.arange(length)]
+  everyone = np.arange(starts.shape[0])
+  template = np.mean(windows(everyone, starts), axis = 0)
+  template = template - np.mean(template)
+  offsets = np.arange(-jitter, jitter + 1)
+  valid = (starts - jitter >= 0) & (starts + jitter + length <= x.shape[1])
+
+  refined = starts.copy()
+  for first in range(0, starts.shape[0], batchSize):
+    batch = np.flatnonzero(valid[first:first + batchSize]) + first
+    corrls = []
+    for o in offsets:
+      w = windows(batch, starts[batch] + o)
+      w = w - np.mean(w, axis = 1, keepdims = True)
+      corrls.append((w @ template) / np.maximum(np.linalg.norm(w, axis = 1), 1e-12))
+    refined[batch] = starts[batch] + offsets[np.argmax(corrls, axis = 0)]
+  return np.mean(windows(everyone, refined), axis = 0).astype(np.float32), refined
+
+def extractPatterns(x):
+  """
+  Extract the MAC patterns from the waveforms @x@ (numWaves, numSamples).
+
+  Return: a dictionary with the pattern of each MAC type (see 'labels'), and a
+  dictionary with the duration of each MAC type.
+  """
+  x = np.asarray(x, dtype = np.float32)
+
+  with prof.stage('boundary-motif'):
+    macPeriod = period(x[:min(x.shape[0], 100)])
+    motif = boundaryMotif(x[0], macPeriod)
+
+  with prof.stage('segmentation'):
+    indices, starts, durations = candidateMACs(x, motif)
+    # Cluster at most the shortest MAC: the samples of the following MAC would
+    # split each type by the type of its successor.
+    length = min(windowLength, int(np.percentile(durations, 5)))
+    windows = x[indices[:, None], starts[:, None] + np.arange(length)]
+    features = np.concatenate((windows, durationWeight * durations[:, None]), axis = 1, dtype = np.float32)
+
+  with prof.stage('clustering'):
+    _, clusters = miniBatchKMeans(features, numClusters)
+
+  with prof.stage('alignment'):
+    # The three largest clusters are the MAC types; the others are irregular.
+    largest = np.argsort(np.bincount(clusters, minlength = numClusters))[::-1][:len(labels)]
+    types = np.full(shape = clusters.shape[0], fill_value = -1)
+    for t, c in enumerate(largest):
+      types[clusters == c] = t
+    macLengths, offsets = alignMACs(x, indices, starts, durations, types)
+
+  patterns, lengths = {}, {}
+  with prof.stage('templates'):
+    for label, t in zip(labels, np.argsort(macLengths)):
+      macStarts = starts - offsets[t]
+      members = (types == t) & (macStarts >= 0) & (macStarts + macLengths[t] <= x.shape[1])
+      patterns[label], _ = refineStarts(x, indices[members], macStarts[members], macLengths[t], alignJitter)
+      lengths[label] = int(macLengths[t])
+      print(f">> {label}: {macLengths[t]} samples, {np.count_nonzero(members)} windows")
+  return patterns, lengths
+
+def savePatterns(outpath, patterns, lengths, source):
+  os.makedirs(outpath, exist_ok = True)
+  for label, pattern in patterns.items():
+    np.save(f'{outpath}/pattern-{label}.npy', pattern)
+
+  params = { 'lengths': lengths, 'source': source, 'minLength': minLength, 'maxLength': maxLength
+           , 'motifLength': motifLength, 'motifThreshold': motifThreshold, 'numClusters': numClusters
+           , 'windowLength': windowLength, 'durationWeight': durationWeight }
+  with open(f'{outpath}/patterns.json', 'w') as fp:
+    json.dump(params, fp, sort_keys = True, indent = 2)
+
+def checkExtraction(referencePath, numWaves, seed = 0):
+  """
+  Extract the patterns from @numWaves@ waveforms of the simulated target, built
+  from the patterns in @referencePath@, and compare them with the reference
+  ones: the durations must match those of the simulated MACs (the skipped
+  NIMACs include their padding), and the correlation of each extracted pattern
+  with the reference one, over their common samples, must reach
+  'minCorrelation'.
+
+  Return: True if all the patterns pass the check.
+  """
+  nWaves, p.nWaves = p.nWaves, numWaves
+  try:
+    scope, target = st.openConnection(referencePath, seed = seed)
+    waves, _, _, _, _ = tv.collect(scope, target, 1, 2, enable = True)
+  finally:
+    p.nWaves = nWaves
+
+  patterns, lengths = extractPatterns(waves)
+  references = { 'IMAC': target.patternIMAC, 'NIMACExec': target.patternNIMACExec, 'NIMACSkip': target.patternNIMACSkip }
+
+  passed = True
+  for label, reference in references.items():
+    common = min(lengths[label], reference.shape[0])
+    corrl = np.corrcoef(patterns[label][:common], reference[:common])[0, 1]
+    ok = lengths[label] == reference.shape[0] and corrl >= minCorrelation
+    passed &= ok
+    print(f">> {label}: {lengths[label]} samples (simulated {reference.shape[0]}), correlation {corrl:.3f}: {'ok' if ok else 'FAILED'}")
+  return passed
+
+# The dataset to sample, the number of sampled waveforms, and the folder of the
+# extracted patterns (a separate folder, not to overwrite the patterns of the
+# article in 'artefacts/patterns').
+datapath = '../data/protected'
+database = '01-07-2025-15:55-33'
+numWaves = 2000
+outpath = '../artefacts/patterns-extracted'
+
+# Set to 'True' to record the wall/CPU time, I/O and memory of each step of
+# the extraction (see 'profiling.py').
+profile = False
+profilePath = '../data/profiles/pattern-extraction'
+
+# Extract the patterns of the dataset ('extract'), or check the extraction
+# against the simulated target ('check'): the number of simulated waveforms,
+# the reference patterns and the minimum correlation of each extracted pattern.
+available_modes = ['extract', 'check']
+mode = 'extract'
+checkWaves = 100
+referencePath = '../artefacts/patterns'
+minCorrelation = 0.95
+
+if __name__ == '__main__':
+  assert mode in available_modes
+
+  if mode == 'check':
+    passed = checkExtraction(referencePath, checkWaves)
+    print(f">> Check against the simulated target: {'passed' if passed else 'FAILED'}")
+    raise SystemExit(0 if passed else 1)
+
+  if profile:
+    prof.enable()
+
+  wavesPath = f'{datapath}/waveforms-extract-{database}.npy'
+  begin = time.perf_counter()
+  with prof.stage('load'):
+    x = np.asarray(prof.npLoad(wavesPath, mmap_mode = 'r')[:numWaves], dtype = np.float32)
+  patterns, lengths = extractPatterns(x)
+  savePatterns(outpath, patterns, lengths, os.path.basename(wavesPath))
+  print(f">> Extracted the patterns of {x.shape[0]} waveforms in {time.perf_counter() - begin:.1f} s; saved in {outpath}")
+
+  if profile:
+    prof.report()
+    prof.saveJSON(f'{profilePath}.json')
+    prof.saveCSV(f'{profilePath}.csv')
@@ -0,0 +1,159 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy     as np
+import os
+import profiling as prof
+
+from alive_progress import alive_bar
+
+## This module implements the principal component analysis (PCA) of the MAC
+## segments saved by 'macs_classification.py' (datasets 'segments-extract-*.npy',
+## of shape (numWaves, numMACs, segmentLength)).
+##
+## Each MAC (i.e., each neuron/input position) gets its own projection:
+## 'SegmentPCA' accumulates, over chunks of waveforms, the mean and the
+## covariance matrix of the segments of each MAC, then keeps the
+## 'numComponents' eigenvectors with the largest eigenvalues. Optionally, the
+## fit considers only the segments of given types (see the orderExecMACs
+## datasets: 0 -> Skipped; 1 -> Executed; 2 -> Important).
+##
+## The projection is saved in '{datapath}/pca-extract-{db}.npz', and the
+## projected segments in '{datapath}/segments-pca-extract-{db}.npy', of shape
+## (numWaves, numMACs, numComponents). The projected segments have the same
+## layout of the segments: 'compute_ranking.py' and
+## 'partition_circum_waveforms.py' analyse them by dataset name (see
+## 'segmentsName' and 'segmentDatasets').
+
+class SegmentPCA:
+  def __init__(self, numMACs, segmentLength, numComponents = 4):
+    self.numComponents = numComponents
+    self.counts = np.zeros(shape = numMACs, dtype = np.int64)
+    self.sums = np.zeros(shape = (numMACs, segmentLength), dtype = np.float64)
+    self.sumsOuter = np.zeros(shape = (numMACs, segmentLength, segmentLength), dtype = np.float64)
+    self.mean = None
+    self.components = None
+    self.explained = None
+
+  def update(self, x, mask = None):
+    """
+    Accumulate the segments @x@ (numWaves, numMACs, segmentLength); if given,
+    only the segments where @mask@ (numWaves, numMACs) is True.
+    """
+    x = np.asarray(x, dtype = np.float64)
+    if mask is not None:
+      x = x * mask[:, :, None]
+      self.counts += np.count_nonzero(mask, axis = 0)
+    else:
+      self.counts += x.shape[0]
+    self.sums += np.sum(x, axis = 0)
+    self.sumsOuter += np.einsum('nml,nmk->mlk', x, x, optimize = True)
+
+  def fit(self):
+    """ Compute the projection from the accumulated statistics. """
+    n = np.maximum(self.counts, 1)[:, None]
+    self.mean = self.sums / n
+    covs = self.sumsOuter / n[:, :, None] - self.mean[:, :, None] * self.mean[:, None, :]
+
+    # eigh returns the eigenvalues in ascending order.
+    values, vectors = np.linalg.eigh(covs)
+    self.components = np.flip(vectors[:, :, -self.numComponents:], axis = 2).transpose(0, 2, 1).astype(np.float32)
+    values = np.maximum(values, 0)
+    self.explained = np.flip(values[:, -self.numComponents:], axis = 1) / np.maximum(np.sum(values, axis = 1, keepdims = True), np.finfo(np.float64).tiny)
+    return self
+
+  def project(self, x):
+    """ Project the segments @x@ (numWaves, numMACs, segmentLength) on the components. """
+    x = np.asarray(x, dtype = np.float32) - self.mean[None].astype(np.float32)
+    return np.einsum('nml,mcl->nmc', x, self.components, optimize = True)
+
+  def save(self, path):
+    np.savez(path, mean = self.mean, components = self.components, explained = self.explained, counts = self.counts)
+
+  @classmethod
+  def load(cls, path):
+    data = np.load(path)
+    pca = cls(data['mean'].shape[0], data['mean'].shape[1], data['components'].shape[1])
+    pca.mean = data['mean']
+    pca.components = data['components']
+    pca.explained = data['explained']
+    pca.counts = data['counts']
+    return pca
+
+def fitDataset(segments, numComponents = 4, orderExecMACs = None, fitTypes = None, chunkSize = 1000):
+  """
+  Fit the projection of the (memory-mapped) @segments@, in chunks of
+  @chunkSize@ waveforms. If @fitTypes@ is given, only the segments whose type
+  (in @orderExecMACs@) is in @fitTypes@ are considered.
+  """
+  pca = SegmentPCA(segments.shape[1], segments.shape[2], numComponents)
+  with prof.stage('pca-fit') as s, alive_bar(segments.shape[0]) as bar:
+    for first in range(0, segments.shape[0], chunkSize):
+      x = segments[first:first + chunkSize]
+      mask = None if fitTypes is None else np.isin(orderExecMACs[first:first + chunkSize], fitTypes)
+      pca.update(x, mask)
+      s.addTraces(x.shape[0])
+      bar(x.shape[0])
+  return pca.fit()
+
+def projectDataset(pca, segments, outPath, chunkSize = 1000):
+  """ Project the (memory-mapped) @segments@ in blocks, and save them in @outPath@. """
+  y = np.lib.format.open_memmap(outPath, mode = 'w+', dtype = np.float32, shape = (segments.shape[0], segments.shape[1], pca.numComponents))
+  with prof.stage('pca-project') as s:
+    for first in range(0, segments.shape[0], chunkSize):
+      y[first:first + chunkSize] = pca.project(segments[first:first + chunkSize])
+      s.addTraces(y[first:first + chunkSize].shape[0])
+    y.flush()
+    s.addBytesWritten(os.path.getsize(outPath))
+
+datapath = '../data/circumvented'
+
+databases_protected = [ '01-07-2025-15:55-33'
+                      , '01-07-2025-17:06-18'
+                      , '01-07-2025-18:21-37'
+                      , '01-07-2025-20:03-54'
+                      , '02-07-2025-05:41-16']
+
+# Number of principal components kept for each MAC.
+numComponents = 4
+# Types of the segments considered by the fit (None for all the segments).
+fitTypes = [1, 2]
+
+# Set to 'True' to record the wall/CPU time, I/O and memory of the fit and of
+# the projection (see 'profiling.py').
+profile = False
+profilePath = '../data/profiles/pca'
+
+if __name__ == '__main__':
+  if profile:
+    prof.enable()
+
+  for db in databases_protected:
+    print(f">> PCA of the segments of database {db}")
+    with prof.stage('load'):
+      segments = prof.npLoad(f'{datapath}/segments-extract-{db}.npy', mmap_mode = 'r')
+      orderExecMACs = prof.npLoad(f'{datapath}/orderExecMACs-extract-{db}.npy', mmap_mode = 'r')
+
+    pca = fitDataset(segments, numComponents, orderExecMACs, fitTypes)
+    pca.save(f'{datapath}/pca-extract-{db}.npz')
+    print(f">> Mean explained variance: {np.mean(np.sum(pca.explained, axis = 1)):.3f}")
+
+    projectDataset(pca, segments, f'{datapath}/segments-pca-extract-{db}.npy')
+    print(f">> Saved projected segments in {datapath}/segments-pca-extract-{db}.npy")
+
+  if profile:
+    prof.report()
+    prof.saveJSON(f'{profilePath}.json')
+    prof.saveCSV(f'{profilePath}.csv')
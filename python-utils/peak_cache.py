@@ -0,0 +1,106 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+import numpy as np
+
+## This module implements a sparse cache of the correlation peaks of the MAC
+## patterns, to tune the classification (see 'macs_classification.py') without
+## correlating the waveforms again.
+##
+## While classifying the waveforms with the 'threshold' decoder,
+## 'macs_classification.detectPatterns' records in a 'PeakCache' every sample
+## whose correlation score with a pattern exceeds 'floor' (below any detection
+## threshold of interest), as a row (trace, position, pattern, score); the
+## cache is saved in 'peaks-extract-{suffix}.npz'.
+## 'PeakCache.detections' returns, for each trace, the positions of the cached
+## peaks above a given threshold, as 'macs_classification.detectPatterns';
+## with 'minDistance', only the best peak (of any pattern) within 'minDistance'
+## samples is kept, i.e., the overlapping patterns are resolved by their
+## correlation score (see 'threshold_sweep.py').
+
+# The patterns, in the order of 'macs_classification.detectPatterns'.
+patterns = ['IMAC', 'NIMACExec', 'NIMACSkip']
+
+peakType = np.dtype([ ('trace', np.uint32)
+                    , ('position', np.uint32)
+                    , ('pattern', np.uint8)
+                    , ('score', np.float32)])
+
+def suppress(peaks, minDistance):
+  """ Keep the peaks (of a trace, sorted by position) with the best score within @minDistance@ samples. """
+  kept, keptPositions = [], []
+  positions = peaks['position'].astype(np.int64)
+  for i in np.argsort(-peaks['score'], kind = 'stable'):
+    # The kept peaks closest to the i-th one, before and after it.
+    j = bisect.bisect_left(keptPositions, positions[i])
+    if j > 0 and positions[i] - keptPositions[j - 1] < minDistance:
+      continue
+    if j < len(keptPositions) and keptPositions[j] - positions[i] < minDistance:
+      continue
+    keptPositions.insert(j, positions[i])
+    kept.append(i)
+  return peaks[np.sort(np.asarray(kept, dtype = np.int64))]
+
+class PeakCache:
+  def __init__(self, floor, peaks = None):
+    """ @floor@: the lowest cached correlation score. """
+    self.floor = floor
+    self.chunks = [] if peaks is None else [peaks]
+
+  def add(self, trace, scores):
+    """ Record the peaks of the trace @trace@; @scores@: the correlation scores of each pattern (see 'patterns'). """
+    for pattern, s in enumerate(scores):
+      positions = np.flatnonzero(s > self.floor)
+      chunk = np.empty(shape = positions.shape[0], dtype = peakType)
+      chunk['trace'] = trace
+      chunk['position'] = positions
+      chunk['pattern'] = pattern
+      chunk['score'] = s[positions]
+      self.chunks.append(chunk)
+
+  def peaks(self):
+    """ The cached peaks, sorted by trace and position. """
+    if len(self.chunks) != 1:
+      peaks = np.concatenate(self.chunks) if self.chunks else np.empty(shape = 0, dtype = peakType)
+      self.chunks = [ np.sort(peaks, order = ['trace', 'position', 'pattern']) ]
+    return self.chunks[0]
+
+  def save(self, path):
+    np.savez(path, peaks = self.peaks(), floor = self.floor)
+
+  @staticmethod
+  def load(path):
+    cache = np.load(path)
+    return PeakCache(float(cache['floor']), cache['peaks'])
+
+  def detections(self, numTraces, threshold, minDistance = 0):
+    """
+    Yield, for each of the @numTraces@ traces, the positions of its peaks above
+    @threshold@ (not below 'floor') of each pattern (see 'patterns'); with
+    @minDistance@, only the best peak within @minDistance@ samples is kept.
+    """
+
+    assert threshold >= self.floor
+
+    peaks = self.peaks()
+    peaks = peaks[peaks['score'] > threshold]
+    bounds = np.searchsorted(peaks['trace'], np.arange(numTraces + 1))
+
+    for trace in range(numTraces):
+      tracePeaks = peaks[bounds[trace]:bounds[trace + 1]]
+      if minDistance > 0:
+        tracePeaks = suppress(tracePeaks, minDistance)
+      yield [ tracePeaks['position'][tracePeaks['pattern'] == k].astype(np.int64) for k in range(len(patterns)) ]
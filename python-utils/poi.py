@@ -0,0 +1,156 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy     as np
+import os
+import profiling as prof
+import utils     as u
+
+## This module implements the selection of the points of interest (POIs), i.e.,
+## the samples leaking the targeted intermediate.
+##
+## For a given target (neuron, input) and window of samples, the traces are
+## partitioned in classes according to the Hamming Weight of the targeted
+## accumulator (see the 'hyps-accum' datasets of 'build_hyps.py'). The
+## per-class sample statistics (count, mean, variance) are accumulated in a
+## single streaming pass over the traces ('ClassStats'), and are cached on disk
+## ('cachedStats'), so that each (dataset, target, window) is processed once.
+##
+## From the statistics, two per-sample scores are available:
+## - SNR: the variance of the class means over the mean of the class variances;
+## - SOST: the sum, over each pair of classes, of the squared difference of
+##   the means over the sum of the variances (divided by the class counts).
+## 'selectPOIs' returns the samples with the top-N scores.
+##
+## Usage:
+##   import poi
+##
+##   classes = poi.hwClasses(hypsAccum[:, neuron, inputIndex - 1] + inputs[:, inputIndex] * weight)
+##   stats = poi.cachedStats(poi.cachePath(datapath, dataset, neuron, inputIndex, first, last), subwave, classes)
+##   pois = poi.selectPOIs(stats.snr(), 10)
+##   corrls = onePassPearsonCorrl(subwave[:, pois], ...)
+
+# Hamming Weight classes of a 32-bit accumulator.
+numClasses = 33
+
+available_metrics = ['snr', 'sost']
+
+class ClassStats:
+  def __init__(self, numSamples, numClasses = numClasses):
+    self.counts = np.zeros(shape = numClasses, dtype = np.int64)
+    self.sums = np.zeros(shape = (numClasses, numSamples), dtype = np.float64)
+    self.sumsSq = np.zeros(shape = (numClasses, numSamples), dtype = np.float64)
+
+  def update(self, x, classes):
+    """
+    Accumulate the traces @x@ (numTraces, numSamples) in the classes
+    @classes@ (numTraces,).
+    """
+    x = np.asarray(x, dtype = np.float64)
+    classes = np.asarray(classes, dtype = np.intp)
+
+    for c in np.unique(classes):
+      xc = x[classes == c]
+      self.counts[c] += xc.shape[0]
+      self.sums[c] += np.sum(xc, axis = 0)
+      self.sumsSq[c] += np.sum(xc * xc, axis = 0)
+
+  def populated(self):
+    """ Return the mask of the classes with at least two traces. """
+    return self.counts > 1
+
+  def means(self):
+    c = self.populated()
+    return self.sums[c] / self.counts[c, None]
+
+  def variances(self):
+    c = self.populated()
+    means = self.sums[c] / self.counts[c, None]
+    return np.maximum(self.sumsSq[c] / self.counts[c, None] - means * means, 0)
+
+  def snr(self):
+    """ Return the per-sample signal-to-noise ratio. """
+    noise = np.mean(self.variances(), axis = 0)
+    return np.nan_to_num(np.var(self.means(), axis = 0) / noise)
+
+  def sost(self):
+    """ Return the per-sample sum of squared pairwise t-differences. """
+    means = self.means()
+    scaled = self.variances() / self.counts[self.populated(), None]
+    i, j = np.triu_indices(means.shape[0], k = 1)
+    return np.nan_to_num(np.sum((means[i] - means[j]) ** 2 / (scaled[i] + scaled[j]), axis = 0))
+
+  def score(self, metric):
+    assert metric in available_metrics
+    return self.snr() if metric == 'snr' else self.sost()
+
+  def save(self, path):
+    np.savez(path, counts = self.counts, sums = self.sums, sumsSq = self.sumsSq)
+
+  @classmethod
+  def load(cls, path):
+    data = np.load(path)
+    stats = cls(data['sums'].shape[1], data['sums'].shape[0])
+    stats.counts = data['counts']
+    stats.sums = data['sums']
+    stats.sumsSq = data['sumsSq']
+    return stats
+
+def computeStats(x, classes, chunkSize = 5000):
+  """
+  Compute the per-class statistics of the traces @x@ (numTraces, numSamples),
+  possibly memory-mapped, processing @chunkSize@ traces at time.
+  """
+  stats = ClassStats(x.shape[1])
+  for first in range(0, x.shape[0], chunkSize):
+    stats.update(x[first:first + chunkSize], classes[first:first + chunkSize])
+  return stats
+
+def cachePath(datapath, dataset, neuron, inputIndex, firstSample, lastSample, firstWaveform = 0, lastWaveform = None):
+  """ Return the path of the cached statistics of the given target and window. """
+  waveforms = f'{firstWaveform}-{"all" if lastWaveform is None else lastWaveform}'
+  return f'{datapath}/poi/stats-{dataset}-neuron-{neuron}-input-{inputIndex}-samples-{firstSample}-{lastSample}-waves-{waveforms}.npz'
+
+def cachedStats(path, x, classes, chunkSize = 5000):
+  """
+  Return the statistics cached in @path@, if any; otherwise, compute them from
+  @x@ and @classes@ (see 'computeStats') and cache them in @path@. @classes@
+  may be a function returning the classes, called only if not cached.
+  """
+  if os.path.exists(path):
+    with prof.stage('poi-load'):
+      prof.current().addBytesRead(os.path.getsize(path))
+      return ClassStats.load(path)
+
+  if callable(classes):
+    classes = classes()
+
+  with prof.stage('poi-stats') as s:
+    stats = computeStats(x, classes, chunkSize)
+    s.addTraces(x.shape[0])
+
+  os.makedirs(os.path.dirname(path), exist_ok = True)
+  stats.save(path)
+  return stats
+
+def hwClasses(hypsAccum):
+  """ Return the Hamming Weight class of each accumulator of @hypsAccum@. """
+  return u.hwArray(np.asarray(hypsAccum, dtype = np.uint32))
+
+def selectPOIs(scores, n):
+  """ Return the (sorted) indices of the @n@ samples with the highest @scores@. """
+  if n >= scores.shape[0]:
+    return np.arange(scores.shape[0])
+  return np.sort(np.argpartition(scores, -n)[-n:])
@@ -0,0 +1,95 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import profiling as prof
+import queue
+import threading
+
+## This module implements the background loading of the datasets of an
+## analysis loop (e.g., 'compute_ranking.py', 'macs_classification.py',
+## 'build_hyps.py'), so that the disk reads of the next dataset overlap with
+## the processing of the current one.
+##
+## 'prefetch(keys, load, depth)' yields, in order, each key of @keys@ with the
+## datasets returned by 'load(key)'. A worker thread runs 'load' on the next
+## keys, and keeps at most 'depth' loaded datasets waiting in a bounded queue:
+## when the queue is full, the worker blocks until the loop takes the next
+## datasets. Thus, at most 'depth' + 2 datasets are held in memory: the
+## processed one, the queued ones and the one being loaded. With 'depth = 0',
+## the datasets are loaded synchronously.
+##
+## NumPy releases the GIL while reading the files, so the loads run in
+## parallel with the processing; pure Python work (e.g., 'utils.binarise')
+## should be left to the loop. An exception raised by 'load' is raised again
+## by the loop when it reaches the corresponding key. If the loop stops early,
+## the worker is stopped as well.
+##
+## With the profiler enabled, the loads are recorded at the top level (see
+## 'profiling.py'), and the time the loop waits for them in the 'load-wait'
+## stage.
+
+# Poll interval (seconds) of the worker blocked on a full queue, to stop it if
+# the loop has stopped.
+pollInterval = 0.1
+
+def prefetch(keys, load, depth = 1):
+  """ Yield (key, load(key)) for each key of @keys@, loading up to @depth@ keys in advance. """
+
+  if depth == 0:
+    for key in keys:
+      yield key, load(key)
+    return
+
+  items = queue.Queue(maxsize = depth)
+  stop = threading.Event()
+
+  def put(item):
+    while not stop.is_set():
+      try:
+        items.put(item, timeout = pollInterval)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def run():
+    for key in keys:
+      try:
+        item = (key, load(key), None)
+      except Exception as e:
+        item = (key, None, e)
+      if not put(item) or item[2] is not None:
+        return
+    put(None)
+
+  thread = threading.Thread(target = run, daemon = True)
+  thread.start()
+
+  try:
+    while True:
+      with prof.stage('load-wait'):
+        item = items.get()
+      if item is None:
+        break
+      key, datasets, error = item
+      if error is not None:
+        raise error
+      # Release the reference of the queue entry before processing.
+      item = None
+      yield key, datasets
+      datasets = None
+  finally:
+    stop.set()
+    thread.join()
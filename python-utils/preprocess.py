@@ -0,0 +1,216 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import numpy     as np
+import os
+import profiling as prof
+
+from alive_progress import alive_bar
+
+## This module implements the preprocessing of the side-channel waveforms
+## before the MACs classification and the correlation analysis.
+##
+## The CW-Lite samples the target at about 4 samples per clock cycle (see the
+## 'sampling_rate' and 'target_clock' entries of the acquisition parameters),
+## so that the waveforms can be compressed by the same factor:
+## - 'integrate': average the samples of each clock cycle ('factor' samples);
+## - 'fir': low-pass filter the waveforms (windowed-sinc FIR filter with
+##   'numTaps' taps and normalised cut-off frequency 'cutoff'), then keep one
+##   sample each 'factor'.
+## Before preprocessing a dataset, the factor is checked against the samples
+## per clock cycle of its acquisition parameters ('samplesPerCycle').
+##
+## The preprocessing configurations are listed in 'configs', and identified by
+## their name (e.g., 'cycles'). The preprocessed waveforms of
+##                  '{datapath}/waveforms-extract-{db}.npy'
+## are saved in
+##                  '{datapath}/waveforms-extract-{db}-{name}.npy'
+## along with a JSON sidecar ('{datapath}/waveforms-extract-{db}-{name}.json')
+## recording the configuration and the source dataset. The MAC patterns are
+## preprocessed as well, and saved in '{patternspath}/{name}'; the consumers
+## preprocess them on first use if missing (see 'patternsPath').
+##
+## The classification ('macs_classification.py') and the correlation analysis
+## ('compute_ranking.py') consume the preprocessed datasets when their
+## 'preprocessing' variable is set to the configuration name: they load the
+## preprocessed waveforms and patterns, and scale their sample windows by
+## 'factor' (see 'scale').
+##
+## The waveforms are processed in chunks of 'chunkSize' waveforms; the input
+## dataset is memory-mapped.
+
+configs = { 'cycles'  : { 'mode': 'integrate', 'factor': 4 }
+          , 'lowpass' : { 'mode': 'fir', 'factor': 4, 'numTaps': 15, 'cutoff': 0.125 } }
+
+available_modes = ['integrate', 'fir']
+
+def samplesPerCycle(paramsPath):
+  """ Return the number of samples per clock cycle from the acquisition parameters (JSON). """
+  with open(paramsPath, 'r') as fp:
+    params = json.load(fp)
+  return params['scope']['clock']['sampling_rate'] / params['scope']['clock']['target_clock']
+
+def lowpassTaps(numTaps, cutoff):
+  """
+  Return the taps of a windowed-sinc (Hamming) low-pass FIR filter, with unit
+  gain at DC.
+
+  Args:
+    - numTaps: the number of taps (odd, so that the filter is centred).
+    - cutoff: the cut-off frequency, normalised to the sampling rate (0; 0.5).
+  """
+  assert numTaps % 2 == 1 and 0 < cutoff < 0.5
+  n = np.arange(numTaps) - numTaps // 2
+  taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(numTaps)
+  return (taps / np.sum(taps)).astype(np.float32)
+
+def firFilter(x, taps):
+  """
+  Filter each waveform of @x@ (numWaves, numSamples) with @taps@; the output is
+  centred on the input (as np.convolve(..., mode = 'same')).
+  """
+  pad = taps.shape[0] // 2
+  xp = np.pad(x, ((0, 0), (pad, taps.shape[0] - 1 - pad)))
+  y = np.zeros(shape = x.shape, dtype = np.float32)
+  for k, t in enumerate(taps[::-1]):
+    y += t * xp[:, k:k + x.shape[1]]
+  return y
+
+def integrate(x, factor):
+  """ Average each 'factor' consecutive samples of @x@ (numWaves, numSamples). """
+  numSamples = (x.shape[1] // factor) * factor
+  return np.mean(x[:, :numSamples].reshape(x.shape[0], -1, factor), axis = 2, dtype = np.float32)
+
+def apply(x, config):
+  """ Preprocess the waveforms @x@ (numWaves, numSamples) according to @config@. """
+  assert config['mode'] in available_modes
+  x = np.asarray(x, dtype = np.float32)
+  if config['mode'] == 'integrate':
+    return integrate(x, config['factor'])
+  y = firFilter(x, lowpassTaps(config['numTaps'], config['cutoff']))
+  return np.ascontiguousarray(y[:, ::config['factor']])
+
+def numOutputSamples(numSamples, config):
+  if config['mode'] == 'integrate':
+    return numSamples // config['factor']
+  return (numSamples + config['factor'] - 1) // config['factor']
+
+def scale(n, preprocessing):
+  """ Scale the number of samples (or sample index) @n@ to the preprocessed waveforms. """
+  if preprocessing is None:
+    return n
+  return n // configs[preprocessing]['factor']
+
+def datasetSuffix(preprocessing):
+  """ Return the suffix of the datasets preprocessed with @preprocessing@. """
+  return '' if preprocessing is None else f'-{preprocessing}'
+
+patternNames = [ 'IMAC', 'NIMACExec', 'NIMACSkip' ]
+
+def patternsPath(patternspath, preprocessing):
+  """
+  Return the folder of the MAC patterns preprocessed with @preprocessing@;
+  the patterns are preprocessed on first use (see 'preprocessPatterns').
+  """
+  if preprocessing is None:
+    return patternspath
+  outpath = f'{patternspath}/{preprocessing}'
+  if not all(os.path.exists(f'{outpath}/pattern-{pattern}.npy') for pattern in patternNames):
+    preprocessPatterns(patternspath, preprocessing)
+  return outpath
+
+def preprocessDataset(inPath, outPath, name, chunkSize = 1000):
+  """
+  Preprocess the waveforms in @inPath@ with the configuration @name@, and save
+  them, with the JSON sidecar, in @outPath@.
+  """
+  config = configs[name]
+  x = prof.npLoad(inPath, mmap_mode = 'r')
+  y = np.lib.format.open_memmap(outPath, mode = 'w+', dtype = np.float32, shape = (x.shape[0], numOutputSamples(x.shape[1], config)))
+
+  with alive_bar(x.shape[0]) as bar:
+    for first in range(0, x.shape[0], chunkSize):
+      y[first:first + chunkSize] = apply(x[first:first + chunkSize], config)
+      prof.current().addTraces(y[first:first + chunkSize].shape[0])
+      bar(y[first:first + chunkSize].shape[0])
+
+  y.flush()
+  prof.current().addBytesWritten(os.path.getsize(outPath))
+
+  sidecar = dict(config, name = name, source = os.path.basename(inPath), numSamples = y.shape[1], sourceNumSamples = x.shape[1])
+  with open(os.path.splitext(outPath)[0] + '.json', 'w') as fp:
+    json.dump(sidecar, fp, sort_keys = True, indent = 2)
+
+def preprocessPatterns(patternspath, name):
+  """ Preprocess the MAC patterns in @patternspath@ and save them in '{patternspath}/{name}'. """
+  outpath = f'{patternspath}/{name}'
+  os.makedirs(outpath, exist_ok = True)
+  for pattern in patternNames:
+    x = np.load(f'{patternspath}/pattern-{pattern}.npy')
+    np.save(f'{outpath}/pattern-{pattern}.npy', apply(x[None, :], configs[name])[0])
+
+# The preprocessing to run, the implementation and the datasets to preprocess.
+preprocessing = 'cycles'
+datapath = '../data'
+patternspath = '../artefacts/patterns'
+
+available_implementations = ['unprotected', 'protected']
+implementation = 'protected'
+
+databases_unprotected = [ '01-07-2025-15:20-21'
+                        , '01-07-2025-16:32-03'
+                        , '01-07-2025-17:47-50'
+                        , '01-07-2025-19:30-01'
+                        , '01-07-2025-20:44-19']
+
+databases_protected = [ '01-07-2025-15:55-33'
+                      , '01-07-2025-17:06-18'
+                      , '01-07-2025-18:21-37'
+                      , '01-07-2025-20:03-54'
+                      , '02-07-2025-05:41-16']
+
+databases = { 'unprotected' : databases_unprotected
+            , 'protected'   : databases_protected }
+
+# Set to 'True' to record the wall/CPU time, I/O and memory of the
+# preprocessing (see 'profiling.py').
+profile = False
+profilePath = f'{datapath}/profiles/preprocess-{preprocessing}'
+
+if __name__ == '__main__':
+  assert implementation in available_implementations
+  assert preprocessing in configs
+
+  if profile:
+    prof.enable()
+
+  preprocessPatterns(patternspath, preprocessing)
+
+  for db in databases[implementation]:
+    # The compression factor should match the samples per clock cycle of the
+    # acquisition.
+    paramsPath = f'{datapath}/{implementation}/params-extract-{db}.json'
+    if os.path.exists(paramsPath) and abs(samplesPerCycle(paramsPath) - configs[preprocessing]['factor']) > 0.5:
+      print(f">> Warning: {db} has {samplesPerCycle(paramsPath):.2f} samples per cycle, '{preprocessing}' compresses by {configs[preprocessing]['factor']}")
+
+    print(f">> Preprocessing ({preprocessing}) database {db}")
+    with prof.stage('preprocess'):
+      preprocessDataset(f'{datapath}/{implementation}/waveforms-extract-{db}.npy', f'{datapath}/{implementation}/waveforms-extract-{db}{datasetSuffix(preprocessing)}.npy', preprocessing)
+
+  if profile:
+    prof.report()
+    prof.saveJSON(f'{profilePath}.json')
+    prof.saveCSV(f'{profilePath}.csv')
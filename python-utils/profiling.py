@@ -0,0 +1,256 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import json
+import numpy    as np
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+## This module implements the instrumentation layer shared by the python-utils
+## stages.
+##
+## A stage is a named region of code (e.g., 'classification') opened with
+## 'stage()' as a context manager; stages can be nested (e.g.,
+## 'classification/pattern-correlation'). For each stage, the profiler records:
+## - the number of times the stage has been entered (calls);
+## - the wall time and the CPU time (seconds);
+## - the bytes read and written (declared by the stage, or counted by 'npLoad',
+##   except for the memory-mapped files, and 'npSave');
+## - the number of processed traces (declared by the stage);
+## - the peak resident memory of the process at the end of the stage (bytes);
+## - the peak traced memory reached within the stage (bytes), only if the
+##   profiler is enabled with 'traceMemory = True' (it relies on tracemalloc,
+##   which slows down allocation-heavy code).
+##
+## Repeated entries of a stage with the same name are aggregated.
+## Stages are nested per thread: stages opened by a worker thread are recorded
+## at the top level (tracemalloc peaks, however, are process-wide).
+##
+## The module exposes a module-level profiler, disabled by default: when
+## disabled, 'stage()' returns a shared no-op object, so that instrumented code
+## pays only a function call per stage.
+## The records can be exported in JSON and CSV format ('saveJSON', 'saveCSV').
+##
+## Usage:
+##   import profiling as prof
+##
+##   prof.enable()
+##   with prof.stage('classification') as s:
+##     w = prof.npLoad(path)
+##     with prof.stage('pattern-correlation'):
+##       ...
+##     s.addTraces(w.shape[0])
+##   prof.report()
+##   prof.saveJSON('profile.json')
+
+fields = [ 'stage', 'calls', 'wall', 'cpu', 'bytesRead', 'bytesWritten'
+         , 'traces', 'peakRSS', 'peakTraced' ]
+
+class _NullStage:
+  """ No-op stage returned by a disabled profiler. """
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+  def addTraces(self, n):
+    pass
+
+  def addBytesRead(self, n):
+    pass
+
+  def addBytesWritten(self, n):
+    pass
+
+_nullStage = _NullStage()
+
+class _Stage:
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+    self.traces = 0
+    self.bytesRead = 0
+    self.bytesWritten = 0
+    self.peakTraced = 0
+
+  def __enter__(self):
+    stack = self.profiler.stack
+    self.path = '/'.join([ s.name for s in stack ] + [ self.name ])
+
+    if self.profiler.traceMemory:
+      # Propagate the peak reached so far to the enclosing stage before
+      # resetting it for this one.
+      if stack:
+        stack[-1].peakTraced = max(stack[-1].peakTraced, tracemalloc.get_traced_memory()[1])
+      tracemalloc.reset_peak()
+
+    stack.append(self)
+    self.wall = time.perf_counter()
+    self.cpu = time.process_time()
+    return self
+
+  def __exit__(self, *exc):
+    wall = time.perf_counter() - self.wall
+    cpu = time.process_time() - self.cpu
+
+    stack = self.profiler.stack
+    stack.pop()
+
+    if self.profiler.traceMemory:
+      self.peakTraced = max(self.peakTraced, tracemalloc.get_traced_memory()[1])
+      if stack:
+        stack[-1].peakTraced = max(stack[-1].peakTraced, self.peakTraced)
+
+    # ru_maxrss is expressed in KiB on Linux.
+    peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    with self.profiler.lock:
+      r = self.profiler.records.get(self.path)
+      if r is None:
+        r = dict.fromkeys(fields, 0)
+        r['stage'] = self.path
+        self.profiler.records[self.path] = r
+
+      r['calls'] += 1
+      r['wall'] += wall
+      r['cpu'] += cpu
+      r['bytesRead'] += self.bytesRead
+      r['bytesWritten'] += self.bytesWritten
+      r['traces'] += self.traces
+      r['peakRSS'] = max(r['peakRSS'], peakRSS)
+      r['peakTraced'] = max(r['peakTraced'], self.peakTraced)
+    return False
+
+  def addTraces(self, n):
+    self.traces += int(n)
+
+  def addBytesRead(self, n):
+    self.bytesRead += int(n)
+
+  def addBytesWritten(self, n):
+    self.bytesWritten += int(n)
+
+class Profiler:
+  def __init__(self, enabled = False, traceMemory = False):
+    self.enabled = False
+    self.traceMemory = False
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.records = {}
+
+    if enabled:
+      self.enable(traceMemory)
+
+  def enable(self, traceMemory = False):
+    self.enabled = True
+    self.traceMemory = traceMemory
+    if traceMemory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  def disable(self):
+    self.enabled = False
+    if self.traceMemory and tracemalloc.is_tracing():
+      tracemalloc.stop()
+    self.traceMemory = False
+
+  @property
+  def stack(self):
+    """ The stages currently open by the calling thread. """
+    if not hasattr(self.local, 'stack'):
+      self.local.stack = []
+    return self.local.stack
+
+  def reset(self):
+    self.local = threading.local()
+    self.records = {}
+
+  def stage(self, name):
+    """ Return the context manager measuring the stage @name@. """
+    if not self.enabled:
+      return _nullStage
+    return _Stage(self, name)
+
+  def current(self):
+    """ Return the innermost open stage (a no-op stage if none is open). """
+    if not self.enabled or not self.stack:
+      return _nullStage
+    return self.stack[-1]
+
+  def npLoad(self, path, **kwargs):
+    """
+    np.load @path@, accounting the file size to the current stage. A
+    memory-mapped file counts 0 bytes: its pages are read only when accessed,
+    possibly a slice of them.
+    """
+    a = np.load(path, **kwargs)
+    if self.enabled and kwargs.get('mmap_mode') is None:
+      self.current().addBytesRead(os.path.getsize(path))
+    return a
+
+  def npSave(self, path, array):
+    """ np.save @array@ in @path@, accounting the written bytes to the current stage. """
+    np.save(path, array)
+    if self.enabled:
+      # np.save appends the extension if missing.
+      path = str(path)
+      path = path if path.endswith('.npy') else path + '.npy'
+      self.current().addBytesWritten(os.path.getsize(path))
+
+  def getRecords(self):
+    return list(self.records.values())
+
+  def saveJSON(self, path):
+    with open(path, 'w') as fp:
+      json.dump(self.getRecords(), fp, indent = 2)
+
+  def saveCSV(self, path):
+    with open(path, 'w', newline = '') as fp:
+      writer = csv.DictWriter(fp, fieldnames = fields)
+      writer.writeheader()
+      writer.writerows(self.getRecords())
+
+  def report(self):
+    """ Print the records as a table on stdout. """
+    if not self.records:
+      return
+
+    width = max(len(r['stage']) for r in self.records.values())
+    print(f"{'stage':<{width}} {'calls':>8} {'wall [s]':>10} {'cpu [s]':>10} {'read [MB]':>10} {'write [MB]':>10} {'traces':>10} {'traces/s':>10} {'RSS [MB]':>10}")
+    for r in self.records.values():
+      rate = r['traces'] / r['wall'] if r['wall'] > 0 else 0
+      print(f"{r['stage']:<{width}} {r['calls']:>8} {r['wall']:>10.3f} {r['cpu']:>10.3f} "
+            f"{r['bytesRead'] / 2**20:>10.1f} {r['bytesWritten'] / 2**20:>10.1f} "
+            f"{r['traces']:>10} {rate:>10.1f} {r['peakRSS'] / 2**20:>10.1f}")
+
+# Module-level profiler shared by the python-utils stages.
+profiler = Profiler()
+
+enable = profiler.enable
+disable = profiler.disable
+reset = profiler.reset
+stage = profiler.stage
+current = profiler.current
+npLoad = profiler.npLoad
+npSave = profiler.npSave
+getRecords = profiler.getRecords
+saveJSON = profiler.saveJSON
+saveCSV = profiler.saveCSV
+report = profiler.report
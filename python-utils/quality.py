@@ -0,0 +1,113 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import utils as u
+
+from collections import Counter, deque
+
+## This module implements the quality gate of the traces in the capture loop
+## (see 'test_vector.collect'): a trace failing one of the checks below is
+## recaptured with the same test vector.
+##
+## 'QualityGate' checks, for each trace:
+## - 'timeout': the scope did not trigger;
+## - 'saturation': more than 'maxSaturated' samples at the limits of the
+##   10-bit ADC (clipped trace, e.g., wrong gain);
+## - 'energy': the mean squared value of the trace deviates from the median of
+##   the last 'energyHistory' accepted traces by more than 'energyTolerance'
+##   (relative), once 'calibration' traces have been accepted (e.g., glitches,
+##   missing inference);
+## - 'start': the expected pattern of the first MAC (IMAC, NIMAC executed or
+##   skipped, given by the IaPAM and the toExecTable) does not correlate above
+##   'minStartCorrl' within the first 'startWindow' samples (desynchronised
+##   execution).
+## The checks cost a few operations per sample: the gate does not slow down the
+## capture.
+
+# Limits of the 10-bit ADC, as fractions of its range (see 'utils.adcCodes').
+adcLow = -512 / 1024
+adcHigh = 511 / 1024
+
+def slidingCorrl(w, pattern):
+  """ Pearson correlation of @pattern@ with each window of @w@ (as 'scared' pattern detection). """
+  windows = np.lib.stride_tricks.sliding_window_view(np.asarray(w, dtype = np.float64), pattern.shape[0])
+  windows = windows - np.mean(windows, axis = 1, keepdims = True)
+  pattern = pattern - np.mean(pattern)
+  norms = np.linalg.norm(windows, axis = 1) * np.linalg.norm(pattern)
+  return np.divide(windows @ pattern, norms, out = np.zeros(shape = windows.shape[0]), where = norms > 0)
+
+class QualityGate:
+  def __init__(self, patternspath = '../artefacts/patterns', maxSaturated = 0, energyTolerance = 0.5, calibration = 50, energyHistory = 1000, minStartCorrl = 0.8, startWindow = 600):
+    """
+    Args:
+      - patternspath: the folder with the MAC patterns.
+      - maxSaturated: the maximum number of saturated samples.
+      - energyTolerance: the maximum relative deviation of the energy from
+        the median energy of the accepted traces.
+      - calibration: the number of accepted traces before checking the energy.
+      - energyHistory: the number of accepted traces of the median energy.
+      - minStartCorrl: the minimum correlation of the first MAC pattern.
+      - startWindow: the number of samples where the first MAC is searched.
+    """
+
+    self.maxSaturated = maxSaturated
+    self.energyTolerance = energyTolerance
+    self.calibration = calibration
+    self.minStartCorrl = minStartCorrl
+    self.startWindow = startWindow
+
+    self.patternIMAC = np.load(f'{patternspath}/pattern-IMAC.npy')
+    self.patternNIMACExec = np.load(f'{patternspath}/pattern-NIMACExec.npy')
+    self.patternNIMACSkip = np.load(f'{patternspath}/pattern-NIMACSkip.npy')
+
+    self.energies = deque(maxlen = energyHistory)
+    self.rejected = Counter()
+
+  def startPattern(self, IaPAM, toExecTable):
+    """ The pattern of the first processed MAC of the inference. """
+    if np.unpackbits(np.asarray(IaPAM, dtype = np.uint8))[0]:
+      return self.patternIMAC
+    if u.execMask(IaPAM, toExecTable)[0]:
+      return self.patternNIMACExec
+    return self.patternNIMACSkip
+
+  def failure(self, wave, IaPAM, toExecTable):
+    """ Return the first failed check of @wave@ (see above); None if it passes. """
+    if np.count_nonzero((wave <= adcLow) | (wave >= adcHigh)) > self.maxSaturated:
+      return 'saturation'
+
+    energy = float(np.mean(np.square(wave, dtype = np.float64)))
+    if len(self.energies) >= self.calibration:
+      median = np.median(self.energies)
+      if abs(energy - median) > self.energyTolerance * median:
+        return 'energy'
+
+    pattern = self.startPattern(IaPAM, toExecTable)
+    if np.max(slidingCorrl(wave[:self.startWindow + pattern.shape[0]], pattern)) < self.minStartCorrl:
+      return 'start'
+
+    self.energies.append(energy)
+    return None
+
+  def check(self, timeout, wave, IaPAM, toExecTable):
+    """ Return True if the trace passes the gate; count the failures otherwise. """
+    reason = 'timeout' if timeout else self.failure(wave, IaPAM, toExecTable)
+    if reason is not None:
+      self.rejected[reason] += 1
+    return reason is None
+
+  def summary(self):
+    return ', '.join(f'{reason}: {count}' for reason, count in sorted(self.rejected.items())) or 'none'
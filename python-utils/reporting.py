@@ -0,0 +1,208 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import numpy   as np
+import os
+import params  as p
+import shutil
+
+## This script renders the plots of the analyses from their saved artefacts:
+## - the GE of the true weights, saved by 'compute_ge.py';
+## - the mean correlation scores (MCS), saved by 'compute_mean_corrl.py'.
+##
+## The analysis scripts do not import matplotlib: it is imported here, when the
+## first plot is rendered.
+##
+## Two backends are available ('backend'):
+## - 'paper': the figures of the article (LaTeX text, SVG);
+## - 'preview': a fast preview, without LaTeX (PNG, lower resolution).
+##
+## The rendered figures are cached in '{datapathPlots}/cache', keyed by the hash
+## of the backend, of the plot parameters and of the input artefacts (path,
+## size and modification time): a figure is rendered again only if one of them
+## changes.
+##
+## NOTA BENE: certain plot-related parameters (e.g., the legend labels of the
+## partitioned traces) are hardcoded.
+
+available_backends = ['paper', 'preview']
+backend = 'preview'
+assert backend in available_backends
+
+extensions = { 'paper': 'svg', 'preview': 'png' }
+dpis = { 'paper': 300, 'preview': 100 }
+
+datapath = '../data'
+datapathGE = f'{datapath}/ges'
+datapathCorrls = f'{datapath}/corrls'
+datapathPlots = f'{datapath}/plots'
+
+numWeights = 32
+
+# Reverse the set of weights
+weights = np.flip(np.split(p.weights, p.weights.shape[0] // 8), axis = 1).reshape(-1)
+
+_plt = None
+
+def pyplot(backend):
+  """ Import and configure matplotlib for @backend@ (once). """
+  global _plt
+  if _plt is None:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.style  as style
+    style.use('tableau-colorblind10')
+    _plt = plt
+
+  _plt.rcParams['font.family'] = 'serif'
+  _plt.rcParams['font.size'] = 10
+  if backend == 'paper':
+    _plt.rcParams['font.serif'] = ['Computer Modern Serif']
+    _plt.rcParams['font.weight'] = 'bold'
+    _plt.rcParams['text.usetex'] = True
+    _plt.rcParams['text.latex.preamble'] = r'\boldmath'
+  else:
+    _plt.rcParams['font.weight'] = 'normal'
+    _plt.rcParams['text.usetex'] = False
+  return _plt
+
+def bold(text, backend):
+  return r'\textbf{' + text + '}' if backend == 'paper' else text
+
+def inputsHash(backend, params, paths):
+  """ Hash of the backend, of the plot parameters and of the artefacts in @paths@. """
+  h = hashlib.sha256(repr((backend, params)).encode())
+  for path in sorted(paths):
+    st = os.stat(path)
+    h.update(repr((path, st.st_size, st.st_mtime_ns)).encode())
+  return h.hexdigest()[:16]
+
+def render(name, backend, params, paths, draw):
+  """
+  Render the figure @name@ with @draw@ (a function of the pyplot module and of
+  the backend, returning the figure), unless cached; return its path.
+  """
+  ext = extensions[backend]
+  cachePath = f'{datapathPlots}/cache/{name}-{inputsHash(backend, params, paths)}.{ext}'
+  outPath = f'{datapathPlots}/{name}.{ext}'
+
+  if not os.path.exists(cachePath):
+    plt = pyplot(backend)
+    fig = draw(plt, backend)
+    os.makedirs(os.path.dirname(cachePath), exist_ok = True)
+    fig.savefig(cachePath, dpi = dpis[backend])
+    plt.close(fig)
+    print(f">> Rendered {outPath}")
+  else:
+    print(f">> {outPath} is up to date")
+
+  os.makedirs(os.path.dirname(outPath), exist_ok = True)
+  shutil.copyfile(cachePath, outPath)
+  return outPath
+
+def gePaths(implementation, neurons, firstInput, lastInput, filteredWaveforms):
+  """ The GEs saved by 'compute_ge.py' for each neuron; a list of the paths of each neuron. """
+  base = lambda n : f'{datapathGE}/{implementation}/neuron-{n}/{implementation}-ge-input-{firstInput}-{lastInput}'
+  if filteredWaveforms:
+    return [ [f'{base(n)}-exec.npy', f'{base(n)}-non-exec.npy'] for n in neurons ]
+  return [ [f'{base(n)}.npy'] for n in neurons ]
+
+def plotGE(implementation, firstNeuron, lastNeuron, firstInput, lastInput, filteredWaveforms = False, backend = backend):
+  """ Plot the GE of the true weights of each neuron. """
+  neurons = range(firstNeuron, lastNeuron)
+  paths = gePaths(implementation, neurons, firstInput, lastInput, filteredWaveforms)
+
+  def draw(plt, backend):
+    fig = plt.figure(figsize = (7.15, 5), dpi = dpis[backend])
+    plt.suptitle(bold(implementation.capitalize(), backend))
+    fig.supylabel(bold('Guessing Entropy', backend))
+    gs = fig.add_gridspec(len(neurons), hspace = 0)
+    axs = np.atleast_1d(gs.subplots(sharex = True, sharey = True))
+
+    for ax, n, neuronPaths in zip(axs, neurons, paths):
+      ax.ticklabel_format(axis = 'x', style = 'sci', scilimits = (0, 0), useMathText = True)
+      ax.grid(axis = 'both', color = "lightgrey", linewidth = '0.5', linestyle = 'dashed')
+      ax.set_ylim(-0.99, 7.99)
+      ax.text(0.0, 6.0, bold('Neuron', backend) + f' ${n}$')
+      ax.set_xlabel(bold('Traces', backend))
+
+      if filteredWaveforms:
+        for ge in np.load(neuronPaths[0]):
+          ax.plot(ge, label = r"$w_{5}$", linestyle = 'solid')
+        for ge in np.load(neuronPaths[1]):
+          ax.plot(ge, label = r"$w_{7}$", linestyle = 'dotted')
+      else:
+        for i, ge in enumerate(np.load(neuronPaths[0])):
+          ax.plot(ge, label = r"$w_{1}$" + f"${i + 1}$")
+
+    box = axs[-1].get_position()
+    axs[-1].set_position([box.x0, box.y0 + box.height * 0.1, box.width, box.height * 0.9])
+    leg = axs[-1].legend(loc = 'upper center', bbox_to_anchor = (0.5, -0.05), fancybox = True, shadow = False, ncol = 4, columnspacing = 0.75)
+    for line in leg.get_lines():
+      line.set_linewidth(1.75)
+    fig.tight_layout()
+    return fig
+
+  suffix = '-filtered' if filteredWaveforms else ''
+  name = f'{implementation}/{implementation}-ge-input-{firstInput}-{lastInput}{suffix}'
+  return render(name, backend, (implementation, firstNeuron, lastNeuron, firstInput, lastInput, filteredWaveforms), sum(paths, []), draw)
+
+def plotMeanCorrl(implementation, neuron, firstInput, lastInput, numSamples = 1000, backend = backend):
+  """ Plot the MCS of the true weight and the best MCS of the others, for each input of @neuron@. """
+  inputs = range(firstInput, lastInput)
+  paths = [ f'{datapathCorrls}/{implementation}/neuron-{neuron}/{implementation}-avg-corrl-input-{i}.npy' for i in inputs ]
+
+  def draw(plt, backend):
+    fig = plt.figure(figsize = (7.1, 5.5), dpi = dpis[backend])
+    plt.suptitle(bold(implementation.capitalize(), backend))
+    fig.supylabel(bold('Correlation Score', backend))
+    gs = fig.add_gridspec(len(inputs), hspace = 0)
+    axs = np.atleast_1d(gs.subplots(sharex = True, sharey = False))
+
+    for ax, i, path in zip(axs, inputs, paths):
+      avgAccumCorrls = np.load(path, mmap_mode = 'r')
+      first = np.asarray(avgAccumCorrls[0, :numSamples])
+      maxCorrlScore = np.max(avgAccumCorrls)
+      trueWeight = weights[numWeights * neuron:numWeights * (neuron + 1)][i]
+
+      ax.ticklabel_format(axis = 'x', style = 'sci', scilimits = (0, 0), useMathText = True)
+      ax.grid(axis = 'both', color = "lightgrey", linewidth = '0.5', linestyle = 'dashed')
+      ax.text(0.94 * numSamples, maxCorrlScore / 2, bold('Weight', backend) + fr' ${i}$', size = 8)
+      ax.set_xlabel(bold('Sample', backend))
+      ax.plot(np.max(np.delete(first, trueWeight - 1, axis = 1), axis = 1), color = '#898989', label = bold('Best Weight Value', backend), linewidth = 1)
+      ax.plot(first[:, trueWeight - 1], label = bold('True Weight Value', backend), linewidth = 1)
+      ax.margins(y = 0.20)
+      ax.set_yticks([0, np.float32(f'{maxCorrlScore}'[:4])])
+
+    box = axs[-1].get_position()
+    axs[-1].set_position([box.x0, box.y0 + box.height * 0.1, box.width, box.height * 0.9])
+    leg = axs[-1].legend(loc = 'upper center', bbox_to_anchor = (0.5, -0.05), fancybox = True, shadow = False, ncol = 4, columnspacing = 0.75)
+    for line in leg.get_lines():
+      line.set_linewidth(1.75)
+    fig.tight_layout()
+    return fig
+
+  name = f'{implementation}/{implementation}-corrl-input-{firstInput}-{lastInput}-neuron-{neuron}'
+  return render(name, backend, (implementation, neuron, firstInput, lastInput, numSamples), paths, draw)
+
+# The reports to render: (function, arguments).
+reports = [ (plotGE, ('circumvented', 0, 2, 7, 8, True))
+          , (plotMeanCorrl, ('unprotected', 3, 1, 8)) ]
+
+if __name__ == '__main__':
+  for plot, args in reports:
+    plot(*args, backend = backend)
@@ -0,0 +1,154 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+# One BLAS thread per process: the parallelism comes from the pool.
+for var in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+  os.environ.setdefault(var, '1')
+
+import compute_ranking as cr
+import itertools
+import time
+import trace_cache as tc
+
+from multiprocessing import Pool
+
+## This script runs the analysis of 'compute_ranking.py' in parallel.
+##
+## Each (dataset, neuron, input, partition) of the analysis is an independent
+## job; the jobs are distributed on a pool of 'numProcesses' processes. The
+## configuration (implementation, windows, distinguisher, POIs, ...) is the one
+## of 'compute_ranking.py'.
+##
+## If 'sharedCache' is set, the main process loads each dataset (waveforms,
+## inputs and accumulator's hypotheses) once in shared memory, and the
+## processes analyse zero-copy views of it (see 'trace_cache.py'); the least
+## recently used datasets are evicted under 'cacheBudget' bytes.
+## Otherwise, each process loads a dataset once, the first time it runs one of
+## its jobs, and keeps it for the following ones; the waveforms and the
+## hypotheses are memory-mapped, so that the processes share their pages
+## through the page cache. The jobs are sorted by dataset, so that each
+## process keeps only the last 'cachedDatasets' datasets.
+##
+## Each job saves its correlation scores and rankings (see
+## 'compute_ranking.analyse') as soon as it completes.
+
+# Number of processes of the pool.
+numProcesses = os.cpu_count()
+
+# Number of datasets kept loaded by each process.
+cachedDatasets = 2
+
+# Set to 'True' to share a single copy of each dataset among the processes, in
+# shared memory, under a budget of 'cacheBudget' bytes (None: half of the
+# physical memory).
+sharedCache = True
+cacheBudget = None
+
+# The datasets, neurons and inputs to analyse.
+databases = cr.databases[cr.implementation]
+neurons   = range(cr.firstNeuron, cr.lastNeuron)
+inputs    = range(cr.firstInput, cr.lastInput)
+# The partitions of the waveforms to analyse (see 'partition_circum_waveforms.py'):
+# e.g., 'cr.available_filteredTypes' to analyse all of them.
+partitions = [cr.filteredType] if cr.filteredWaveforms else [None]
+
+def jobs(databases, neurons, inputs, partitions):
+  """ Return the (dataset, neuron, input, partition) jobs, sorted by dataset. """
+  return [ (db, neuron, inputIndex, partition) for db, partition, neuron, inputIndex in itertools.product(databases, partitions, neurons, inputs) ]
+
+# Datasets loaded by the process: (db, neuron, partition) -> (w, i, accumHyps)
+_datasets = {}
+
+def datasetKey(db, neuron, partition):
+  """ The dataset of a job: the partitioned datasets are per neuron. """
+  return (db, neuron if partition is not None else None, partition)
+
+def datasetArrays(key):
+  """ The arrays of the dataset @key@, loaded on demand (see 'trace_cache.TraceCache.load'). """
+  wavesPath, inpsPath, accumHypsPath = cr.datasetPaths(*key)
+  return { 'w'        : lambda : cr.loadWaves(wavesPath, mmap = True)
+         , 'i'        : lambda : cr.loadInputs(inpsPath)
+         , 'accumHyps': lambda : cr.loadAccumHyps(accumHypsPath) }
+
+def loadDataset(db, neuron, partition):
+  """ Return the waveforms, inputs and accumulator's hypotheses of the job. """
+  key = datasetKey(db, neuron, partition)
+  if key not in _datasets:
+    if len(_datasets) >= cachedDatasets:
+      del _datasets[next(iter(_datasets))]
+    _datasets[key] = tuple(load() for load in datasetArrays(key).values())
+  return _datasets[key]
+
+def runJob(job):
+  """ Run the analysis of a job; return the job, the process and the elapsed time. """
+  db, neuron, inputIndex, partition = job
+  begin = time.perf_counter()
+  w, i, accumHyps = loadDataset(db, neuron, partition)
+  cr.analyse(w, i, accumHyps, db, neuron, inputIndex, partition)
+  return job, os.getpid(), time.perf_counter() - begin
+
+def runSharedJob(descriptor, job):
+  """ As 'runJob', on the dataset shared by the main process. """
+  db, neuron, inputIndex, partition = job
+  begin = time.perf_counter()
+  views = tc.attach(descriptor)
+  cr.analyse(views['w'], views['i'], views['accumHyps'], db, neuron, inputIndex, partition)
+  return job, os.getpid(), time.perf_counter() - begin
+
+def report(done, total, job, pid, elapsed):
+  db, neuron, inputIndex, partition = job
+  print(f">> [{done}/{total}] Input #{inputIndex} -- Neuron #{neuron} -- {db}{'' if partition is None else ' -- ' + partition} ({elapsed:.1f} s, process {pid})")
+
+def runShared(grid, processes, budget = None):
+  """ Run the jobs of @grid@ on @processes@ processes, sharing the datasets in a 'trace_cache.TraceCache'. """
+  done = [0]
+  # The cache is created before the pool (see 'trace_cache.py').
+  with tc.TraceCache(budget) as cache, Pool(processes = processes) as pool:
+    def completed(result):
+      job, pid, elapsed = result
+      done[0] += 1
+      report(done[0], len(grid), job, pid, elapsed)
+      cache.release(datasetKey(*job[:2], job[3]))
+
+    def failed(key):
+      def release(e):
+        print(f">> Job failed: {e!r}")
+        cache.release(key)
+      return release
+
+    results = []
+    for key, group in itertools.groupby(grid, key = lambda job : datasetKey(job[0], job[1], job[3])):
+      descriptor = cache.load(key, datasetArrays(key))
+      for job in group:
+        cache.acquire(key)
+        results.append(pool.apply_async(runSharedJob, (descriptor, job), callback = completed, error_callback = failed(key)))
+    for r in results:
+      r.wait()
+
+if __name__ == '__main__':
+  grid = jobs(databases, neurons, inputs, partitions)
+  print(f">> {len(grid)} jobs on {numProcesses} processes")
+
+  begin = time.perf_counter()
+  if sharedCache:
+    runShared(grid, numProcesses, cacheBudget)
+  else:
+    with Pool(processes = numProcesses) as pool:
+      for done, (job, pid, elapsed) in enumerate(pool.imap_unordered(runJob, grid), start = 1):
+        report(done, len(grid), job, pid, elapsed)
+
+  print(f">> Done in {time.perf_counter() - begin:.1f} s")
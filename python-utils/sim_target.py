@@ -0,0 +1,328 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy  as np
+import params as p
+import struct
+import utils  as u
+import zlib
+
+from collections import deque
+from types       import SimpleNamespace
+
+## This module implements a simulated ChipWhisperer-Lite scope and target,
+## running the firmware in 'src/main.c', to test the acquisition campaign
+## (e.g., 'test_vector.collect') without the hardware.
+##
+## The simulated target implements the SimpleSerial commands of the firmware:
+## - 'h': hello message;
+## - 'c': load the IaPAM;
+## - 't': load the toExecTable;
+## - 'a': load the input;
+## - 'q': enqueue up to 4 test vectors (toExecTable + input); sub-command 0x01
+##   resets the queue first;
+## - 'i': run the inference; sub-command 0x01 loads the next queued test vector
+##   first;
+## - 'v': return the number of inferences and the CRC-32 digest of their raw
+##   sums, then reset them; sub-command 0x01 returns the raw sums of the
+##   inferences of the last digest (firmware built with VERIFY_INFERENCE=1).
+## Each command is acknowledged with the same error codes of the firmware.
+##
+## If the scope is armed, the inference produces a synthetic side-channel
+## trace: a preamble of 'preambleLength' samples, followed, for each neuron, by
+## the patterns (see 'artefacts/patterns') of its 32 MACs, in processing order:
+## - important MACs (IMAC pattern);
+## - executed non-important MACs (NIMACExec pattern);
+## - skipped non-important MACs (NIMACSkip pattern, followed by 'skipPadding' samples).
+## The executed MACs leak the Hamming Weight of the accumulator, scaled by
+## 'leakage', in the samples [leakOffset, leakOffset + leakLength) of their
+## pattern. The trace is affected by gaussian noise ('noise') and quantised as
+## the CW-Lite 10-bit ADC.
+##
+## With 'faultRate' > 0, each inference is faulty with such probability: the
+## raw sum of a random neuron is corrupted, as detected by the verification.
+## With 'glitchRate' > 0, each trace is desynchronised with such probability:
+## its start is delayed by a random number of samples, as detected by the
+## quality gate (see 'quality.py').
+##
+## Usage:
+##   import sim_target as st
+##   scope, target = st.openConnection()
+##   waves, IaPAM, toExecTables, inputs, faulty = tv.collect(scope, target, ...)
+
+QUEUE_SIZE = 64
+TO_EXEC_TABLE_SIZE = (p.imgWidth * p.imgHeight // 8) * p.nNeurons
+INPUT_SIZE = p.imgWidth * p.imgHeight
+QUEUE_ENTRY_SIZE = TO_EXEC_TABLE_SIZE + INPUT_SIZE
+
+VERIFY_BUFFER_SIZE = QUEUE_SIZE
+VERIFY_FRAME_ENTRIES = 12
+
+# 'q', 'i' and 'v' sub-commands
+QUEUE_RESET = 0x01
+INFER_FROM_QUEUE = 0x01
+VERIFY_READ_SUMS = 0x01
+
+# Error codes
+ERR_OK = 0x00
+ERR_CMD = 0x01
+ERR_QUEUE_LEN = 0x10
+ERR_QUEUE_FULL = 0x11
+ERR_QUEUE_EMPTY = 0x12
+ERR_VERIFY_RANGE = 0x21
+
+class SimScope:
+  def __init__(self):
+    self.adc = SimpleNamespace( samples = p.nSamples, state = False, basic_mode = 'rising_edge'
+                              , timeout = 2, offset = 0, presamples = 0, decimate = 1
+                              , fifo_fill_mode = 'normal')
+    self.gain = SimpleNamespace(mode = 'high', gain = 30, db = 24.8359375)
+    self.clock = SimpleNamespace( adc_phase = 0, adc_freq = 29538459, freq_ctr = 0
+                                , freq_ctr_src = 'extclk', clkgen_src = 'system'
+                                , extclk_freq = 10000000, clkgen_mul = 2, clkgen_div = 26
+                                , clkgen_freq = 7384615.384615385)
+    self.trigger = SimpleNamespace(triggers = 'tio4', module = 'basic')
+    self.fw_version = { 'major': 0, 'minor': 64, 'debug': 0 }
+    self.simulated = True
+
+    self.armed = False
+    self.trace = None
+    self.lastTrace = np.zeros(shape = self.adc.samples, dtype = np.float32)
+
+  def default_setup(self):
+    pass
+
+  def arm(self):
+    self.armed = True
+
+  def capture(self):
+    """ Return True on timeout, as the CW scope. """
+    timeout = self.trace is None
+    if not timeout:
+      self.lastTrace = self.trace
+    self.trace = None
+    self.armed = False
+    return timeout
+
+  def get_last_trace(self):
+    return self.lastTrace
+
+  def dis(self):
+    pass
+
+class SimTarget:
+  def __init__(self, scope, patternspath = '../artefacts/patterns', noise = 0.005, leakage = 0.004, seed = None, faultRate = 0, glitchRate = 0):
+    """
+    Args:
+      - scope: the simulated scope capturing the traces of the target.
+      - patternspath: the folder with the MAC patterns.
+      - noise: standard deviation of the gaussian noise.
+      - leakage: the amplitude of the leakage of each bit of the accumulator.
+      - seed: seed of the noise generator.
+      - faultRate: probability of a faulty inference.
+      - glitchRate: probability of a desynchronised trace.
+    """
+
+    self.scope = scope
+    self.baud = 115200
+    self.noise = noise
+    self.leakage = leakage
+    self.faultRate = faultRate
+    self.glitchRate = glitchRate
+    self.rng = np.random.default_rng(seed)
+
+    self.preambleLength = 236
+    self.skipPadding = 4
+    self.epilogueLength = 40
+    self.leakOffset = 50
+    self.leakLength = 8
+
+    self.patternIMAC = np.load(f'{patternspath}/pattern-IMAC.npy')
+    self.patternNIMACExec = np.load(f'{patternspath}/pattern-NIMACExec.npy')
+    self.patternNIMACSkip = np.concatenate((np.load(f'{patternspath}/pattern-NIMACSkip.npy'), np.zeros(shape = self.skipPadding, dtype = np.float32)))
+
+    self.IaPAM = np.zeros(shape = p.imgWidth * p.imgHeight // 8, dtype = np.uint8)
+    self.toExecTable = np.zeros(shape = TO_EXEC_TABLE_SIZE, dtype = np.uint8)
+    self.input = np.zeros(shape = INPUT_SIZE, dtype = np.uint8)
+    self.queue = deque()
+
+    # Inference verification
+    self.digest = 0
+    self.digestCount = 0
+    self.lastDigestCount = 0
+    self.sumsBuffer = np.zeros(shape = (VERIFY_BUFFER_SIZE, p.nNeurons), dtype = '<i4')
+
+    self.acks = deque()
+    self.packets = deque()
+
+    # Count of the exchanged frames, to evaluate the protocol overhead.
+    self.numFrames = 0
+
+  # SimpleSerial v2.1 host interface
+  def simpleserial_write(self, cmd, data, end = None):
+    self.send_cmd(cmd, 0x00, data)
+
+  def send_cmd(self, cmd, scmd, data):
+    self.numFrames += 1
+    data = bytes(data)
+    handler = { 'h': self.hello
+              , 'c': self.loadIaPAM
+              , 't': self.loadToExecTable
+              , 'a': self.loadInput
+              , 'q': self.enqueue
+              , 'i': self.infer
+              , 'v': self.verify }.get(cmd)
+    err = ERR_CMD if handler is None else handler(scmd, data)
+    self.acks.append(err)
+
+  def simpleserial_wait_ack(self, timeout = 500):
+    self.numFrames += 1
+    if not self.acks:
+      print("Simulated target: ack timeout")
+      return None
+    err = self.acks.popleft()
+    if err != ERR_OK:
+      print(f"Simulated target: error {hex(err)}")
+    return bytearray([err])
+
+  def simpleserial_read(self, cmd, pktlen, end = '\n', timeout = 250, ack = True):
+    self.numFrames += 1
+    while self.packets:
+      c, data = self.packets.popleft()
+      if c == cmd:
+        if ack and self.acks:
+          self.acks.popleft()
+        return bytearray(data[:pktlen])
+    return None
+
+  def flush(self):
+    self.acks.clear()
+    self.packets.clear()
+
+  def dis(self):
+    pass
+
+  # Firmware commands
+  def hello(self, scmd, data):
+    msg = b">>> CWLITEARM: ready to capture! (simulated)"
+    self.packets.append(('r', bytes([len(msg)])))
+    self.packets.append(('r', msg))
+    return ERR_OK
+
+  def loadIaPAM(self, scmd, data):
+    self.IaPAM[:len(data)] = np.frombuffer(data, dtype = np.uint8)
+    return ERR_OK
+
+  def loadToExecTable(self, scmd, data):
+    self.toExecTable[:len(data)] = np.frombuffer(data, dtype = np.uint8)
+    return ERR_OK
+
+  def loadInput(self, scmd, data):
+    self.input[:len(data)] = np.frombuffer(data, dtype = np.uint8)
+    return ERR_OK
+
+  def enqueue(self, scmd, data):
+    if scmd & QUEUE_RESET:
+      self.queue.clear()
+    if len(data) % QUEUE_ENTRY_SIZE:
+      return ERR_QUEUE_LEN
+    numEntries = len(data) // QUEUE_ENTRY_SIZE
+    if len(self.queue) + numEntries > QUEUE_SIZE:
+      return ERR_QUEUE_FULL
+    for i in range(numEntries):
+      self.queue.append(data[i * QUEUE_ENTRY_SIZE:(i + 1) * QUEUE_ENTRY_SIZE])
+    return ERR_OK
+
+  def infer(self, scmd, data):
+    if scmd == INFER_FROM_QUEUE:
+      if not self.queue:
+        return ERR_QUEUE_EMPTY
+      entry = self.queue.popleft()
+      self.loadToExecTable(scmd, entry[:TO_EXEC_TABLE_SIZE])
+      self.loadInput(scmd, entry[TO_EXEC_TABLE_SIZE:])
+
+    if self.scope.armed:
+      self.scope.trace = self.synthesise()
+
+    sums = self.outputs().astype('<i4')
+    if self.rng.random() < self.faultRate:
+      sums[self.rng.integers(p.nNeurons)] ^= 1 << int(self.rng.integers(16))
+    self.sumsBuffer[self.digestCount % VERIFY_BUFFER_SIZE] = sums
+    self.digest = zlib.crc32(sums.tobytes(), self.digest)
+    self.digestCount += 1
+    return ERR_OK
+
+  def verify(self, scmd, data):
+    if scmd == VERIFY_READ_SUMS:
+      available = min(self.lastDigestCount, VERIFY_BUFFER_SIZE)
+      if len(data) != 2 or data[1] > VERIFY_FRAME_ENTRIES or data[0] + data[1] > available:
+        return ERR_VERIFY_RANGE
+      self.packets.append(('r', self.sumsBuffer[data[0]:data[0] + data[1]].tobytes()))
+      return ERR_OK
+
+    self.packets.append(('r', struct.pack('<II', self.digestCount, self.digest)))
+    self.lastDigestCount = self.digestCount
+    self.digestCount = 0
+    self.digest = 0
+    return ERR_OK
+
+  def outputs(self):
+    """ Return the accumulator of each neuron at the end of the inference. """
+    numInputs = p.imgWidth * p.imgHeight
+    weights = u.processingOrder(p.weights.astype(np.uint32).reshape(p.nNeurons, numInputs))
+    execs = u.execMask(self.IaPAM, self.toExecTable).reshape(p.nNeurons, numInputs)
+    inputs = u.processingOrder(self.input.astype(np.uint32))
+    return np.sum(weights * inputs * execs, axis = 1, dtype = np.uint32) + p.biases.astype(np.uint32)
+
+  def synthesise(self):
+    numInputs = p.imgWidth * p.imgHeight
+    weights = u.processingOrder(p.weights.astype(np.uint32).reshape(p.nNeurons, numInputs))
+    execs = u.execMask(self.IaPAM, self.toExecTable).reshape(p.nNeurons, numInputs)
+    important = np.unpackbits(self.IaPAM).astype(bool)
+    inputs = u.processingOrder(self.input.astype(np.uint32))
+
+    preambleLength = self.preambleLength
+    if self.rng.random() < self.glitchRate:
+      preambleLength += int(self.rng.integers(1000, 5000))
+
+    segments = [ np.zeros(shape = preambleLength, dtype = np.float32) ]
+    for n in range(0, p.nNeurons):
+      accum = np.cumsum(weights[n] * inputs * execs[n], dtype = np.uint32) + np.uint32(p.biases[n])
+      leaks = u.hwArray(accum) * self.leakage
+      for k in range(0, numInputs):
+        if important[k]:
+          segment = self.patternIMAC.copy()
+        elif execs[n, k]:
+          segment = self.patternNIMACExec.copy()
+        else:
+          segments.append(self.patternNIMACSkip)
+          continue
+        segment[self.leakOffset:self.leakOffset + self.leakLength] += leaks[k]
+        segments.append(segment)
+      segments.append(np.zeros(shape = self.epilogueLength, dtype = np.float32))
+
+    trace = np.zeros(shape = self.scope.adc.samples, dtype = np.float32)
+    segments = np.concatenate(segments)[:trace.shape[0]]
+    trace[:segments.shape[0]] = segments
+    trace += self.rng.normal(0, self.noise, size = trace.shape[0]).astype(np.float32)
+
+    # 10-bit ADC
+    return (np.clip(np.round(trace * 1024), -512, 511) / 1024).astype(np.float32)
+
+def openConnection(patternspath = '../artefacts/patterns', **kwargs):
+  """ Return a simulated (scope, target) pair, as 'capture-cwlite.openConnection'. """
+  scope = SimScope()
+  target = SimTarget(scope, patternspath, **kwargs)
+  return scope, target
@@ -0,0 +1,208 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import macs_classification as mc
+import numpy               as np
+import params              as p
+import queue
+import threading
+import utils               as u
+
+from collections import Counter
+
+## This module implements the live classification of the MACs during the
+## acquisition campaign.
+##
+## 'StreamClassifier' is a consumer of the capture loop (see
+## 'test_vector.collect'): each captured trace is handed to a worker thread,
+## which classifies its MACs (see 'macs_classification.classifyWave') and
+## writes the result in the datasets:
+## - '{datapath}/IMACs{suffix}.npy'
+## - '{datapath}/NIMACExecs{suffix}.npy'
+## - '{datapath}/execMACs{suffix}.npy'
+## - '{datapath}/orderExecMACs{suffix}.npy'
+## - '{datapath}/segments{suffix}.npy'
+## - '{datapath}/segmentStarts{suffix}.npy'
+## - '{datapath}/IaPAM{suffix}-consensus.npy'
+## which follow the same format of the datasets saved by 'macs_classification.py'.
+## As there, the IMACs and NIMACExecs datasets are written only with
+## 'macs_classification.saveConcatenated', the segments and their starts only
+## with 'macs_classification.saveSegments'.
+## The datasets are memory-mapped .npy files, filled as the traces arrive.
+##
+## The worker keeps the running IaPAM consensus (i.e., the most recurrent
+## IaPAM among the classified traces), saved each 'saveEvery' traces and when
+## the consumer is closed. At closing, the consumer saves also the indices of
+## the traces whose IaPAM is inconsistent with the consensus, or that could not
+## be classified ('{datapath}/inconsistencies-index{suffix}.npy').
+## If the capture stops early, the datasets are truncated to the received traces.
+## If the classification fails, the worker stops, and the error is raised again
+## by the next 'push' (or by 'close').
+
+# Poll interval (seconds) of the capture loop blocked on a full queue, to stop
+# it if the worker has failed.
+pollInterval = 0.1
+
+class StreamClassifier:
+  def __init__(self, datapath, suffix, patternspath = '../artefacts/patterns', threshold = None, queueSize = 256, saveEvery = 1000):
+    """
+    Args:
+      - datapath: the folder where to save the datasets.
+      - suffix: the suffix of the datasets (e.g., '-extract-01-07-2025-15:55-33').
+      - patternspath: the folder with the MAC patterns.
+      - threshold: detection threshold (see 'macs_classification.detectPatterns').
+      - queueSize: the maximum number of traces waiting for classification;
+        when full, the capture loop blocks.
+      - saveEvery: save the running IaPAM consensus each 'saveEvery' traces.
+    """
+
+    self.datapath = datapath
+    self.suffix = suffix
+    self.threshold = threshold
+    self.saveEvery = saveEvery
+
+    self.patternIMAC = np.load(f'{patternspath}/pattern-IMAC.npy')
+    self.patternNIMACExec = np.load(f'{patternspath}/pattern-NIMACExec.npy')
+    self.patternNIMACSkip = np.load(f'{patternspath}/pattern-NIMACSkip.npy')
+
+    self.queue = queue.Queue(maxsize = queueSize)
+    self.thread = None
+    self.error = None
+
+  def start(self, nWaves, IaPAM):
+    """ Allocate the datasets and start the worker; called by the capture loop. """
+
+    nMACs = p.imgWidth * p.imgHeight * p.nNeurons
+    openMemmap = lambda name, shape, dtype : np.lib.format.open_memmap(f'{self.datapath}/{name}{self.suffix}.npy', mode = 'w+', dtype = dtype, shape = shape)
+
+    self.datasets = [ 'execMACs', 'orderExecMACs' ]
+    self.execMACs = openMemmap('execMACs', (nWaves, nMACs // 8), np.uint8)
+    self.orderExecMACs = openMemmap('orderExecMACs', (nWaves, nMACs), np.uint8)
+    if mc.saveConcatenated:
+      self.datasets += [ 'IMACs', 'NIMACExecs' ]
+      self.IMACs = openMemmap('IMACs', (nWaves, p.nSamples), np.float32)
+      self.NIMACExecs = openMemmap('NIMACExecs', (nWaves, p.nSamples), np.float32)
+    if mc.saveSegments:
+      self.datasets += [ 'segments', 'segmentStarts' ]
+      self.segments = openMemmap('segments', (nWaves, nMACs, self.patternIMAC.shape[0]), np.float32)
+      self.segmentStarts = openMemmap('segmentStarts', (nWaves, nMACs), np.int32)
+
+    # Packed IaPAM of each trace, to identify the inconsistent ones.
+    self.IaPAMs = np.zeros(shape = (nWaves, nMACs // 8), dtype = np.uint8)
+    self.classified = np.zeros(shape = nWaves, dtype = bool)
+    self.counts = Counter()
+    self.numClassified = 0
+    self.numPushed = 0
+
+    self.thread = threading.Thread(target = self.run, daemon = True)
+    self.thread.start()
+
+  def put(self, item):
+    """ Enqueue @item@, waiting for room while the worker runs; return False if it has failed. """
+    while self.error is None:
+      try:
+        self.queue.put(item, timeout = pollInterval)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def push(self, index, wave, toExecTable, inputs):
+    """ Enqueue the trace @wave@ captured at @index@; called by the capture loop. """
+    if not self.put((index, wave)):
+      raise self.error
+    self.numPushed = max(self.numPushed, index + 1)
+
+  def run(self):
+    try:
+      while True:
+        item = self.queue.get()
+        if item is None:
+          break
+        self.classify(*item)
+    except Exception as e:
+      self.error = e
+
+  def classify(self, index, w):
+    macs = mc.classifyWave(w, self.patternIMAC, self.patternNIMACExec, self.patternNIMACSkip, self.threshold)
+
+    if macs is None:
+      print(f"Skipping {index}.")
+      return
+
+    IaPAM, execMACs, orderExecMACs, IMACs, NIMACExecs, segments, segmentStarts = macs
+
+    # Same packing of 'u.bytify(u.reverse(execMACs))'.
+    self.execMACs[index] = np.packbits(execMACs)
+    self.orderExecMACs[index] = orderExecMACs
+    if mc.saveConcatenated:
+      self.IMACs[index] = IMACs
+      self.NIMACExecs[index] = NIMACExecs
+    if mc.saveSegments:
+      self.segments[index] = segments
+      self.segmentStarts[index] = segmentStarts
+
+    self.IaPAMs[index] = np.packbits(IaPAM)
+    self.classified[index] = True
+    self.counts[self.IaPAMs[index].tobytes()] += 1
+    self.numClassified += 1
+
+    if self.numClassified % self.saveEvery == 0:
+      self.saveConsensus()
+
+  def consensus(self):
+    """ Return the running IaPAM consensus, packed as in 'macs_classification.saveIaPAM'. """
+    if not self.counts:
+      return None
+    return np.frombuffer(self.counts.most_common(1)[0][0], dtype = np.uint8)
+
+  def saveConsensus(self):
+    IaPAM = self.consensus()
+    if IaPAM is not None:
+      np.save(f'{self.datapath}/IaPAM{self.suffix}-consensus.npy', IaPAM)
+
+  def close(self):
+    """ Wait for the pending traces, then flush the datasets. """
+
+    if self.thread is None:
+      return
+
+    if self.put(None):
+      self.thread.join()
+    self.thread = None
+
+    n = self.numPushed
+    for name in self.datasets:
+      m = getattr(self, name)
+      m.flush()
+      if n < m.shape[0]:
+        del m
+        setattr(self, name, None)
+        u.truncateNpy(f'{self.datapath}/{name}{self.suffix}.npy', n)
+
+    self.saveConsensus()
+
+    IaPAM = self.consensus()
+    if IaPAM is None:
+      inconsistencies = np.flatnonzero(~self.classified[:n])
+    else:
+      inconsistencies = np.flatnonzero(~self.classified[:n] | (self.IaPAMs[:n] != IaPAM).any(axis = 1))
+    np.save(f'{self.datapath}/inconsistencies-index{self.suffix}.npy', inconsistencies.astype(np.uint32))
+
+    print(f"> Classified {self.numClassified} traces; {inconsistencies.size} inconsistent or unclassified")
+    print(f"> Saved MACs classification in {self.datapath}")
+
+    if self.error is not None:
+      raise self.error
@@ -0,0 +1,223 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy     as np
+import online_cpa as oc
+import os
+import poi
+import profiling as prof
+import utils     as u
+
+from corrl import rankGuesses
+
+## This script implements the template attack on the weights of the
+## unprotected implementation.
+##
+## The weights of the MLP are known ('params.weights'): a trace dataset is used
+## as profiling set, the others as attack sets.
+##
+## Profiling: for each target (neuron, input), the traces are partitioned in
+## classes according to the Hamming Weight of the accumulator after the MAC of
+## the targeted input. 'Templates' accumulates, over chunks of traces, the
+## per-class means and the pooled covariance matrix on 'numPOIs' points of
+## interest, selected by their SNR (see 'poi.py').
+##
+## Attack: for each attack trace and each class, the log-likelihood of the
+## trace is computed with a single batched matrix computation; the
+## log-likelihood of each weight candidate is the one of the class of its
+## hypothetical accumulator (computed, as in 'compute_ranking.py', from the
+## true weights of the preceeding inputs), accumulated across the traces.
+##
+## The log-likelihoods and the rankings are saved each 'corrlSampling' traces,
+## in the same format of 'compute_ranking.py' (with a single "sample"), under
+##   '../data/corrls/templates/neuron-{n}/input-{k}/'
+##   '../data/rankings/templates/neuron-{n}/input-{k}/'
+## so that 'compute_ge.py' can process them ('implementation = templates').
+
+class Templates:
+  def __init__(self, numPOIs, numClasses = poi.numClasses):
+    self.counts = np.zeros(shape = numClasses, dtype = np.int64)
+    self.sums = np.zeros(shape = (numClasses, numPOIs), dtype = np.float64)
+    self.sumsOuter = np.zeros(shape = (numPOIs, numPOIs), dtype = np.float64)
+    self.means = None
+    self.precision = None
+
+  def update(self, x, classes):
+    """
+    Accumulate the profiling traces @x@ (numTraces, numPOIs) of the classes
+    @classes@ (numTraces,).
+    """
+    x = np.asarray(x, dtype = np.float64)
+    classes = np.asarray(classes, dtype = np.intp)
+    for c in np.unique(classes):
+      xc = x[classes == c]
+      self.counts[c] += xc.shape[0]
+      self.sums[c] += np.sum(xc, axis = 0)
+    self.sumsOuter += x.T @ x
+
+  def fit(self):
+    """ Compute the class means and the (inverse) pooled covariance matrix. """
+    populated = self.counts > 0
+    self.means = np.zeros(shape = self.sums.shape, dtype = np.float64)
+    self.means[populated] = self.sums[populated] / self.counts[populated, None]
+
+    # Pooled within-class scatter: sum of x x^T minus n_c mu_c mu_c^T of each class.
+    scatter = self.sumsOuter - np.einsum('c,ci,cj->ij', self.counts, self.means, self.means)
+    cov = scatter / max(np.sum(self.counts) - np.count_nonzero(populated), 1)
+    self.precision = np.linalg.pinv(cov, hermitian = True)
+    self.populated = populated
+    return self
+
+  def logLikelihoods(self, x):
+    """
+    Return the log-likelihood (up to a constant per trace) of each trace of
+    @x@ (numTraces, numPOIs) under each class; matrix (numTraces, numClasses).
+    The classes without profiling traces get the lowest log-likelihood of the trace.
+    """
+    x = np.asarray(x, dtype = np.float64)
+    # -1/2 (x - mu)^T S (x - mu) = x^T S mu - 1/2 mu^T S mu - 1/2 x^T S x
+    PM = self.precision @ self.means.T
+    ll = x @ PM - 0.5 * np.einsum('ic,ic->c', self.means.T, PM)[None, :]
+    ll[:, ~self.populated] = np.min(ll[:, self.populated], axis = 1, keepdims = True)
+    return ll
+
+  def save(self, path):
+    np.savez(path, counts = self.counts, sums = self.sums, sumsOuter = self.sumsOuter)
+
+  @classmethod
+  def load(cls, path):
+    data = np.load(path)
+    t = cls(data['sums'].shape[1], data['sums'].shape[0])
+    t.counts = data['counts']
+    t.sums = data['sums']
+    t.sumsOuter = data['sumsOuter']
+    return t.fit()
+
+def profileTemplates(x, classes, chunkSize = 5000):
+  """ Build the templates from the (memory-mapped) profiling traces @x@, in chunks. """
+  t = Templates(x.shape[1])
+  for first in range(0, x.shape[0], chunkSize):
+    t.update(x[first:first + chunkSize], classes[first:first + chunkSize])
+  return t.fit()
+
+def attack(t, x, prefix, inputs, corrlSampling, candidates = np.arange(1, 128)):
+  """
+  Score the weight candidates on the attack traces @x@ (numTraces, numPOIs).
+
+  Args:
+    - t: the templates.
+    - x: the attack traces, on the POIs of the templates.
+    - prefix: the accumulator after the preceeding MAC; array (numTraces,).
+    - inputs: the targeted input; array (numTraces,).
+    - corrlSampling: the sampling factor of the scores.
+    - candidates: the weight candidates.
+
+  Returns:
+    - A matrix of (numTraces / corrlSampling, 1, numCandidates), with the
+      log-likelihood of each candidate accumulated over the traces.
+  """
+  ll = t.logLikelihoods(x)
+  classes = u.hwArray(np.asarray(prefix, dtype = np.uint32)[:, None] + np.asarray(inputs, dtype = np.uint32)[:, None] * candidates.astype(np.uint32)[None, :])
+  scores = np.cumsum(np.take_along_axis(ll, classes.astype(np.intp), axis = 1), axis = 0)
+  numSnapshots = x.shape[0] // corrlSampling
+  return scores[corrlSampling - 1:numSnapshots * corrlSampling:corrlSampling, None, :]
+
+datapath = '../data'
+
+# The available dataset traces for the unprotected implementation
+databases_unprotected = [ '01-07-2025-15:20-21'
+                        , '01-07-2025-16:32-03'
+                        , '01-07-2025-17:47-50'
+                        , '01-07-2025-19:30-01'
+                        , '01-07-2025-20:44-19']
+
+# The profiling dataset; the others are attacked.
+profilingDatabase = databases_unprotected[0]
+
+firstWaveform = 0
+lastWaveform  = 50000
+
+firstNeuron = 0
+lastNeuron  = 2
+firstInput  = 1
+lastInput   = 8
+
+# Number of points of interest (highest SNR in the window of the target, see
+# 'online_cpa.defaultWindow').
+numPOIs = 20
+
+# Store the log-likelihoods each 'corrlSampling' waveforms
+corrlSampling = 100
+
+# Set to 'True' to record the wall/CPU time, I/O and memory of each stage (see
+# 'profiling.py').
+profile = False
+profilePath = f'{datapath}/profiles/templates'
+
+def loadDataset(db):
+  w = prof.npLoad(f'{datapath}/unprotected/waveforms-extract-{db}.npy', mmap_mode = 'r')[firstWaveform:lastWaveform]
+  i = prof.npLoad(f'{datapath}/unprotected/inputs-extract-{db}.npy')[firstWaveform:lastWaveform]
+  return w, i
+
+if __name__ == '__main__':
+  if profile:
+    prof.enable()
+
+  with prof.stage('load'):
+    wProf, iProf = loadDataset(profilingDatabase)
+
+  for neuron in range(firstNeuron, lastNeuron):
+    accumProf = u.accumulators(iProf, neuron)
+
+    for inputIndex in range(firstInput, lastInput):
+      print(f">> Input #{inputIndex} -- Neuron #{neuron}")
+      first, last = oc.defaultWindow(neuron, inputIndex)
+      classes = poi.hwClasses(accumProf[:, inputIndex])
+
+      with prof.stage('profiling') as s:
+        stats = poi.cachedStats(poi.cachePath(datapath, f'unprotected-waveforms-{profilingDatabase}', neuron, inputIndex, first, last, firstWaveform, lastWaveform), wProf[:, first:last], classes)
+        pois = first + poi.selectPOIs(stats.snr(), numPOIs)
+        t = profileTemplates(wProf[:, pois], classes)
+        s.addTraces(wProf.shape[0])
+
+      for db in databases_unprotected:
+        if db == profilingDatabase:
+          continue
+
+        with prof.stage('load'):
+          w, i = loadDataset(db)
+          x = np.array(w[:, pois])
+
+        with prof.stage('attack') as s:
+          accum = u.accumulators(i, neuron)
+          inputs = u.processingOrder(i.astype(np.uint32))[:, inputIndex]
+          scores = attack(t, x, accum[:, inputIndex - 1], inputs, corrlSampling)
+          s.addTraces(x.shape[0])
+
+        with prof.stage('ranking'):
+          rankedGuesses = rankGuesses(scores).astype(np.uint8)
+
+        with prof.stage('save'):
+          corrlsPath = f'{datapath}/corrls/templates/neuron-{neuron}/input-{inputIndex}'
+          rankingsPath = f'{datapath}/rankings/templates/neuron-{neuron}/input-{inputIndex}'
+          os.makedirs(corrlsPath, exist_ok = True)
+          os.makedirs(rankingsPath, exist_ok = True)
+          prof.npSave(f'{corrlsPath}/templates-corrls-input-{inputIndex}-neuron-{neuron}-extract-{db}.npy', scores)
+          prof.npSave(f'{rankingsPath}/templates-ranking-per-sample-input-{inputIndex}-neuron-{neuron}-extract-{db}.npy', rankedGuesses)
+
+  if profile:
+    prof.report()
+    prof.saveJSON(f'{profilePath}.json')
+    prof.saveCSV(f'{profilePath}.csv')
@@ -13,11 +13,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import chipwhisperer  as cw
 import numpy          as np
 import params         as p
 import struct
 import utils          as u
+import zlib
 from alive_progress import alive_bar
 from time import sleep
 
@@ -26,6 +26,23 @@ from time import sleep
 
 debugPrint = False
 
+# Test-vector queue of the firmware (see 'src/main.c'): each 'q' frame carries
+# up to 'queueFrameEntries' test vectors (toExecTable + input), and the
+# on-target ring buffer holds up to 'queueSize' test vectors.
+queueSize = 64
+queueFrameEntries = 4
+queueReset = 0x01
+inferFromQueue = 0x01
+
+# Inference verification of the firmware, built with VERIFY_INFERENCE=1 (see
+# 'src/main.c'): the target folds the raw sums of the neurons of each
+# inference in a CRC-32 digest, and keeps them for the last 'verifyBufferSize'
+# inferences; the sums are read in frames of up to 'verifyFrameEntries'
+# inferences.
+verifyBufferSize = queueSize
+verifyFrameEntries = 12
+verifyReadSums = 0x01
+
 def checkInference(weights, biases, ins, receivedOuts):
   inputSize = p.imgWidth * p.imgHeight
 
@@ -36,7 +53,95 @@ def checkInference(weights, biases, ins, receivedOuts):
       print(f"\tExpected: {expectedOut}")
       print(f"\tReceived: {receivedOuts[n]}")
 
-def collect(scope, target, seedInputs, seedMACPruning, enable = False):
+def referenceOutputs(IaPAM, toExecTables, inputs):
+  """
+  Compute the raw sum (bias plus executed MACs) of each neuron of each
+  inference, as the target; matrix (numTraces, nNeurons) of int32.
+  """
+  numInputs = p.imgWidth * p.imgHeight
+  execs = u.execMask(IaPAM, toExecTables).reshape(-1, p.nNeurons, numInputs)
+  weights = u.processingOrder(p.weights.astype(np.int64).reshape(p.nNeurons, numInputs))
+  ins = u.processingOrder(np.asarray(inputs, dtype = np.int64).reshape(-1, numInputs))
+  sums = np.einsum('tnk,nk,tk->tn', execs, weights, ins) + p.biases.astype(np.int64)
+  return sums.astype('<i4')
+
+def outputsDigest(outputs):
+  """ The digest of the target (CRC-32 of the little-endian raw sums) of @outputs@. """
+  return zlib.crc32(np.ascontiguousarray(outputs, dtype = '<i4').tobytes())
+
+def verifyBlock(target, IaPAM, toExecTables, inputs):
+  """
+  Verify the inferences run since the last verification, with the given test
+  vectors, against the digest of the target. If the digest differs, read the
+  raw sums of each inference to find the faulty ones.
+
+  Return: boolean array, True for the faulty inferences.
+  """
+  expected = referenceOutputs(IaPAM, toExecTables, inputs)
+  faulty = np.zeros(shape = expected.shape[0], dtype = bool)
+
+  target.send_cmd('v', 0x00, bytearray())
+  count, digest = struct.unpack('<II', target.simpleserial_read('r', 8))
+  if count == expected.shape[0] and digest == outputsDigest(expected):
+    return faulty
+
+  if count != expected.shape[0] or count > verifyBufferSize:
+    # Lost or spurious inferences: the sums cannot be matched to the test vectors.
+    print(f">> Inference verification: {count} inferences run, {expected.shape[0]} expected")
+    faulty[:] = True
+    return faulty
+
+  received = []
+  for first in range(0, count, verifyFrameEntries):
+    n = min(verifyFrameEntries, count - first)
+    target.send_cmd('v', verifyReadSums, bytearray([first, n]))
+    sums = target.simpleserial_read('r', n * p.nNeurons * 4)
+    received.append(np.frombuffer(bytes(sums), dtype = '<i4').reshape(n, p.nNeurons))
+  faulty = np.any(np.concatenate(received) != expected, axis = 1)
+  if debugPrint:
+    print(f">> Inference verification: faulty inferences {np.flatnonzero(faulty)}")
+  return faulty
+
+def uploadQueue(target, toExecTables, inputs):
+  """ Reset the on-target queue and upload the given test vectors. """
+  entries = np.concatenate((toExecTables, inputs), axis = 1)
+
+  for j in range(0, entries.shape[0], queueFrameEntries):
+    if debugPrint:
+      print(f">> Enqueue test vectors {j}-{min(j + queueFrameEntries, entries.shape[0]) - 1}")
+    msg = bytearray(entries[j:j + queueFrameEntries].tobytes())
+    target.send_cmd('q', queueReset if j == 0 else 0x00, msg)
+    target.simpleserial_wait_ack(timeout = 0)
+
+def inferDirect(scope, target, toExecTable, inputs):
+  """ Send the test vector, then run the inference with the scope armed. """
+  # Load the toExecTables on the target
+  if debugPrint:
+    print(">> Send toExecTable")
+  msg = bytearray(toExecTable)
+  target.simpleserial_write('t', msg)
+  target.simpleserial_wait_ack(timeout = 0)
+
+  # Load the inputs on the target
+  if debugPrint:
+    print(">> Send inputs")
+  msg = bytearray(inputs)
+  target.simpleserial_write('a', msg)
+  target.simpleserial_wait_ack(timeout = 0)
+
+  # Execute inference
+  if debugPrint:
+    print(">> Run inference")
+  receivedOuts = np.zeros(shape = p.nNeurons, dtype = np.uint32)
+
+  scope.arm()
+  target.simpleserial_write('i', bytearray())
+  #for n in range(0, p.nNeurons):
+  #  receivedOuts[n] = np.array(struct.unpack('<I', target.simpleserial_read('r', 4, timeout = 0))[0]).view(np.uint32)
+  #  receivedOuts[n] = np.array(struct.unpack('<I', target.simpleserial_read('r', 4, timeout = 0))[0])
+  target.simpleserial_wait_ack(timeout = 0)
+
+def collect(scope, target, seedInputs, seedMACPruning, enable = False, consumers = None, queueDepth = 0, verifyEvery = 0, gate = None, maxRecaptures = 3):
   """ Collect the side-channel waveforms. 
 
   Args:
@@ -45,14 +150,50 @@ def collect(scope, target, seedInputs, seedMACPruning, enable = False):
     - seedInputs    : the seed to the random generator for the inputs.
     - seedMACPruning: the seed for MACPruning IaPAM and toExecTables.
     - enable        : enable the MACPruning countermeasure.
+    - consumers     : objects processing the waveforms while capturing (e.g.,
+                      'stream_classification.StreamClassifier'). Each consumer
+                      provides the methods:
+                      * start(nWaves, IaPAM), called before the capture;
+                      * push(index, wave, toExecTable, inputs), called after
+                        the capture of each waveform.
+                      A consumer may stop the capture by setting its 'done'
+                      attribute (e.g., 'online_cpa.OnlineCPAMonitor').
+                      The caller is in charge of closing the consumers.
+    - queueDepth    : if greater than 0, upload the test vectors in blocks of
+                      'queueDepth' (at most 'queueSize') in the on-target
+                      queue, then run each inference from the queue: one
+                      serial transaction per waveform, plus one each
+                      'queueFrameEntries' test vectors, instead of three.
+                      If 0, send the toExecTable and the inputs before each
+                      inference.
+    - verifyEvery   : if greater than 0, verify the inferences in blocks of
+                      'verifyEvery' (at most 'verifyBufferSize') waveforms
+                      against the digest of the target (see 'verifyBlock'):
+                      one serial transaction per block, instead of reading
+                      the outputs of each inference. The firmware must be
+                      built with VERIFY_INFERENCE=1.
+    - gate          : the quality gate of the waveforms (e.g.,
+                      'quality.QualityGate'), providing the method
+                      check(timeout, wave, IaPAM, toExecTable). A waveform
+                      failing the gate is recaptured right away with the same
+                      test vector (sent again, out of the queue), up to
+                      'maxRecaptures' times.
 
-  Return:
+  Return (truncated to the number of waveforms collected, if a consumer stopped the capture):
     - waves         : the collected side-channel waveforms.
     - IaPAM         : the used IaPAM.
     - toExecTables  : the used toExecTable.
     - inputs        : the used inputs.
+    - faulty        : True for the waveforms of a faulty inference, or still
+                      failing the quality gate after 'maxRecaptures'
+                      recaptures (all False without verification and gate).
   """
 
+  assert 0 <= queueDepth <= queueSize
+  assert 0 <= verifyEvery <= verifyBufferSize
+
+  consumers = [] if consumers is None else consumers
+
   scope.adc.samples = p.nSamples
   waves = np.zeros(shape = (p.nWaves, p.nSamples), dtype = np.float32)
 
@@ -83,42 +224,84 @@ def collect(scope, target, seedInputs, seedMACPruning, enable = False):
     target.simpleserial_write('c', msg)
     target.simpleserial_wait_ack(timeout = 0)
 
+    if verifyEvery > 0:
+      # Reset the digest of the target
+      target.send_cmd('v', 0x00, bytearray())
+      target.simpleserial_read('r', 8)
+
   except Exception as e:
     print(f"Caught exception {e}.")
     raise
 
+  for c in consumers:
+    c.start(p.nWaves, IaPAM)
+
+  faulty = np.zeros(shape = p.nWaves, dtype = bool)
+  rejected = np.zeros(shape = p.nWaves, dtype = bool)
+  recaptures = np.zeros(shape = p.nWaves, dtype = np.uint8)
+
+  # The waveforms of the inferences run since the last verification, in order
+  runs = []
+
+  def verifyRuns():
+    # The last inference of each waveform is the one of the collected waveform
+    for i, f in zip(runs, verifyBlock(target, IaPAM, toExecTables[runs], inputs[runs])):
+      faulty[i] = f
+    runs.clear()
+
+  nCollected = p.nWaves
   with alive_bar(p.nWaves) as bar:
     for i in range(0, p.nWaves):
       try:
-        # Load the toExecTables on the target
-        if debugPrint:
-          print(">> Send toExecTable")
-        msg = bytearray(toExecTables[i])
-        target.simpleserial_write('t', msg)
-        target.simpleserial_wait_ack(timeout = 0)
-
-        # Load the inputs on the target
-        if debugPrint:
-          print(">> Send inputs")
-        msg = bytearray(inputs[i])
-        target.simpleserial_write('a', msg)
-        target.simpleserial_wait_ack(timeout = 0)
-
-        # Execute inference
-        if debugPrint:
-          print(">> Run inference")
-        receivedOuts = np.zeros(shape = p.nNeurons, dtype = np.uint32)
-
-        scope.arm()
-        target.simpleserial_write('i', bytearray())
-        #for n in range(0, p.nNeurons):
-        #  receivedOuts[n] = np.array(struct.unpack('<I', target.simpleserial_read('r', 4, timeout = 0))[0]).view(np.uint32)
-        #  receivedOuts[n] = np.array(struct.unpack('<I', target.simpleserial_read('r', 4, timeout = 0))[0])
-        target.simpleserial_wait_ack(timeout = 0)
-        scope.capture()
+        if queueDepth > 0:
+          # Refill the on-target queue
+          if i % queueDepth == 0:
+            uploadQueue(target, toExecTables[i:i + queueDepth], inputs[i:i + queueDepth])
+
+          # Execute inference on the next queued test vector
+          if debugPrint:
+            print(">> Run inference from queue")
+
+          scope.arm()
+          target.send_cmd('i', inferFromQueue, bytearray())
+          target.simpleserial_wait_ack(timeout = 0)
+        else:
+          inferDirect(scope, target, toExecTables[i], inputs[i])
+        runs.append(i)
+
+        timeout = scope.capture()
+
+        # Recapture the waveforms failing the quality gate, with the same test vector
+        if gate is not None:
+          passed = gate.check(timeout, scope.get_last_trace(), IaPAM, toExecTables[i])
+          while not passed and recaptures[i] < maxRecaptures:
+            if debugPrint:
+              print(f">> Recapture waveform {i}")
+            recaptures[i] += 1
+            if verifyEvery > 0 and len(runs) == verifyEvery:
+              verifyRuns()
+            inferDirect(scope, target, toExecTables[i], inputs[i])
+            runs.append(i)
+            timeout = scope.capture()
+            passed = gate.check(timeout, scope.get_last_trace(), IaPAM, toExecTables[i])
+          rejected[i] = not passed
 
         waves[i] = scope.get_last_trace()
 
+        for c in consumers:
+          c.push(i, waves[i], toExecTables[i], inputs[i])
+
+        # Verify the inferences of the block
+        if verifyEvery > 0 and (len(runs) == verifyEvery or i + 1 == p.nWaves):
+          verifyRuns()
+
+        if any([ getattr(c, 'done', False) for c in consumers ]):
+          print(f">> Capture stopped by consumer after {i + 1} waveforms")
+          nCollected = i + 1
+          if verifyEvery > 0 and runs:
+            verifyRuns()
+          break
+
         #checkInference(p.weights.astype(np.uint32), p.biases.astype(np.uint32), inputs[i], receivedOuts)
 
       except Exception as e:
@@ -126,4 +309,16 @@ def collect(scope, target, seedInputs, seedMACPruning, enable = False):
         raise
       bar()
 
-  return np.asarray(waves, dtype = np.float32), IaPAM, toExecTables, inputs
+  waves = waves[:nCollected]
+  toExecTables = toExecTables[:nCollected]
+  inputs = inputs[:nCollected]
+  faulty = faulty[:nCollected]
+  rejected = rejected[:nCollected]
+
+  if verifyEvery > 0:
+    print(f">> Inference verification: {np.count_nonzero(faulty)} faulty inferences out of {nCollected}")
+  if gate is not None:
+    print(f">> Quality gate: {np.sum(recaptures)} recaptures ({gate.summary()}), {np.count_nonzero(rejected)} rejected waveforms out of {nCollected}")
+    faulty |= rejected
+
+  return np.asarray(waves, dtype = np.float32), IaPAM, toExecTables, inputs, faulty
@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import macs_classification as mc
+import numpy               as np
+import params              as p
+import peak_cache          as pc
+import preprocess          as pp
+
+## This script sweeps the detection threshold and the minimum distance of the
+## patterns (see 'peak_cache.py') of the MAC classification, from the peaks
+## cached by 'macs_classification.py' (set 'savePeaks'): the waveforms are not
+## correlated again.
+##
+## For each dataset of 'databases', and each threshold and minimum distance of
+## 'thresholds' and 'minDistances', it reports the number of classified
+## waveforms and the share of them with the most frequent IaPAM (the
+## consistency of the classification, see 'macs_classification.extractIaPAM').
+## With 'saveThreshold' (and 'saveMinDistance'), the IaPAM, execMACs and
+## orderExecMACs of each waveform are saved with the '-sweep' suffix.
+
+databases = mc.databases_protected
+datapath = mc.datapathCirc
+
+thresholds = [0.86, 0.88, 0.90, 0.92, 0.94]
+minDistances = [0, 20]
+
+saveThreshold = None
+saveMinDistance = 0
+
+# See 'macs_classification.preprocessing'.
+preprocessing = None
+
+def reclassify(cache, numTraces, threshold, minDistance = 0):
+  """
+  Classify the MACs of the @numTraces@ cached waveforms from their peaks (see
+  'peak_cache.PeakCache.detections'), as 'macs_classification.classifyWave'.
+
+  Return: the IaPAMs, execMACs and orderExecMACs of the waveforms (0, if not
+  classified; see 'macs_classification.positionMACs'), and the classified
+  waveforms; numpy arrays of shape (numTraces, imgWidth * imgHeight * nNeurons)
+  and (numTraces,).
+  """
+
+  nMACs = p.imgWidth * p.imgHeight * p.nNeurons
+  IaPAMs = np.zeros(shape = (numTraces, nMACs), dtype = bool)
+  execMACs = np.zeros(shape = (numTraces, nMACs), dtype = bool)
+  orderExecMACs = np.zeros(shape = (numTraces, nMACs), dtype = np.uint8)
+  classified = np.zeros(shape = numTraces, dtype = bool)
+
+  for trace, detections in enumerate(cache.detections(numTraces, threshold, minDistance)):
+    # Each pattern must be detected.
+    if any(d.shape[0] == 0 for d in detections):
+      continue
+
+    macs = mc.positionMACs(*detections)
+    if macs is None:
+      continue
+
+    IaPAMs[trace], execMACs[trace], orderExecMACs[trace] = macs
+    classified[trace] = True
+
+  return IaPAMs, execMACs, orderExecMACs, classified
+
+def consistency(IaPAMs, classified):
+  """ The share of the classified waveforms with the most frequent IaPAM. """
+  if not np.any(classified):
+    return 0.0
+  _, counts = np.unique(IaPAMs[classified], axis = 0, return_counts = True)
+  return np.max(counts) / np.count_nonzero(classified)
+
+def main():
+  for db in databases:
+    suffix = db + pp.datasetSuffix(preprocessing)
+    cache = pc.PeakCache.load(f'{datapath}/peaks-extract-{suffix}.npz')
+    numTraces = np.load(f'{mc.datapathProt}/waveforms-extract-{suffix}.npy', mmap_mode = 'r').shape[0]
+
+    print(f">> {db}: {cache.peaks().shape[0]} peaks above {cache.floor}")
+    for threshold in thresholds:
+      for minDistance in minDistances:
+        IaPAMs, _, _, classified = reclassify(cache, numTraces, threshold, minDistance)
+        print(f">> threshold = {threshold}, minDistance = {minDistance}: {np.count_nonzero(classified)}/{numTraces} classified, consistency {consistency(IaPAMs, classified):.3f}")
+
+    if saveThreshold is not None:
+      IaPAMs, execMACs, orderExecMACs, _ = reclassify(cache, numTraces, saveThreshold, saveMinDistance)
+      print(f">> Saving IaPAMs, execMACs and orderExecMACs in {datapath}/*-extract-{suffix}-sweep.npy")
+      np.save(f'{datapath}/IaPAMs-extract-{suffix}-sweep.npy', IaPAMs)
+      np.save(f'{datapath}/execMACs-extract-{suffix}-sweep.npy', execMACs)
+      np.save(f'{datapath}/orderExecMACs-extract-{suffix}-sweep.npy', orderExecMACs)
+
+if __name__ == '__main__':
+  main()
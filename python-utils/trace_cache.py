@@ -0,0 +1,180 @@
+# Copyright (C) <2025> Lorenzo Casalino <lorenzo.casalino@inria.fr>, Rubén Salvador <ruben.salvador@inria.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import os
+import threading
+
+from collections import OrderedDict, namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+## This module implements a cache of datasets shared by the processes of an
+## analysis (see 'scheduler.py').
+##
+## The parent process loads each dataset (a set of named arrays, e.g.,
+## waveforms, inputs, hypotheses and executed MACs) once with 'TraceCache.load',
+## which returns a small, picklable descriptor. The workers receive the
+## descriptor with their jobs and get zero-copy NumPy views of the arrays with
+## 'attach'. Each array is either:
+## - copied in a 'multiprocessing.shared_memory' block (an 'np.ndarray',
+##   possibly memory-mapped: it is copied in chunks); or
+## - left on disk (a 'MappedArray'): the workers memory-map the file read-only,
+##   and share its pages through the page cache.
+##
+## The shared memory blocks are charged on a budget of bytes: loading a dataset
+## evicts the least recently used ones that are not in use (see 'acquire' and
+## 'release'), and waits for the in-use ones to be released if the budget is
+## still exceeded.
+##
+## The cache must be created before the worker processes: they inherit its
+## resource tracker, which then unlinks the shared memory blocks only when
+## evicted by the main process (or if it terminates abruptly).
+
+# An array left on disk: the .npy file and the index of the portion to analyse.
+MappedArray = namedtuple('MappedArray', ['path', 'index'])
+
+# Copy the memory-mapped arrays in shared memory in chunks of this number of bytes.
+copyChunkBytes = 256 * 1024 * 1024
+
+def physicalMemory():
+  return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def _toShared(x):
+  """ Copy @x@ in a new shared memory block; return the block and its descriptor. """
+  shm = shared_memory.SharedMemory(create = True, size = max(x.nbytes, 1))
+  y = np.ndarray(x.shape, dtype = x.dtype, buffer = shm.buf)
+  rows = max(copyChunkBytes // max(x[:1].nbytes, 1), 1)
+  for first in range(0, x.shape[0], rows):
+    y[first:first + rows] = x[first:first + rows]
+  del y
+  return shm, ('shm', shm.name, x.shape, x.dtype.str)
+
+class TraceCache:
+  def __init__(self, budget = None):
+    """ @budget@: the bytes of shared memory (default: half of the physical memory). """
+    self.budget = budget if budget is not None else physicalMemory() // 2
+    self.used = 0
+    # datasetId -> (descriptor, shared memory blocks, bytes)
+    self.entries = OrderedDict()
+    self.pins = {}
+    self.condition = threading.Condition()
+    resource_tracker.ensure_running()
+
+  def load(self, datasetId, arrays):
+    """
+    Return the descriptor of the dataset @datasetId@; if not cached, load the
+    arrays @arrays@ (name -> array, 'MappedArray' or callable returning one of
+    them) first.
+    """
+    with self.condition:
+      if datasetId in self.entries:
+        self.entries.move_to_end(datasetId)
+        return self.entries[datasetId][0]
+
+    arrays = { name: (a() if callable(a) else a) for name, a in arrays.items() }
+    size = sum(a.nbytes for a in arrays.values() if not isinstance(a, MappedArray))
+
+    with self.condition:
+      self._reserve(size)
+      blocks = []
+      descriptor = { 'id': datasetId, 'arrays': {} }
+      for name, a in arrays.items():
+        if isinstance(a, MappedArray):
+          descriptor['arrays'][name] = ('mmap', a.path, a.index)
+        else:
+          shm, descriptor['arrays'][name] = _toShared(a)
+          blocks.append(shm)
+      self.entries[datasetId] = (descriptor, blocks, size)
+      self.pins.setdefault(datasetId, 0)
+      self.used += size
+      return descriptor
+
+  def _reserve(self, size):
+    """ Evict the unused datasets until @size@ bytes fit in the budget. """
+    while self.used + size > self.budget:
+      victims = [ k for k in self.entries if self.pins[k] == 0 ]
+      if victims:
+        self._evict(victims[0])
+      elif self.entries:
+        # All the cached datasets are in use: wait for a release.
+        self.condition.wait()
+      else:
+        print(f">> Warning: the dataset ({size} bytes) exceeds the cache budget ({self.budget} bytes)")
+        return
+
+  def _evict(self, datasetId):
+    _, blocks, size = self.entries.pop(datasetId)
+    del self.pins[datasetId]
+    for shm in blocks:
+      shm.close()
+      shm.unlink()
+    self.used -= size
+
+  def acquire(self, datasetId):
+    """ Mark the dataset as in use (e.g., by a submitted job): it is not evicted until released. """
+    with self.condition:
+      self.pins[datasetId] += 1
+
+  def release(self, datasetId):
+    with self.condition:
+      self.pins[datasetId] -= 1
+      self.condition.notify_all()
+
+  def close(self):
+    """ Release all the shared memory blocks. """
+    with self.condition:
+      for datasetId in list(self.entries):
+        self._evict(datasetId)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+# Datasets attached by the process: datasetId -> (shared memory blocks, views)
+_attached = OrderedDict()
+
+# Number of datasets kept attached by each process.
+attachedDatasets = 2
+
+def attach(descriptor):
+  """ Return the arrays (name -> read-only view) of the dataset of @descriptor@. """
+  datasetId = descriptor['id']
+  if datasetId in _attached:
+    _attached.move_to_end(datasetId)
+    return _attached[datasetId][1]
+
+  while len(_attached) >= attachedDatasets:
+    _, (blocks, views) = _attached.popitem(last = False)
+    # The views must be released before closing their blocks.
+    del views
+    for shm in blocks:
+      shm.close()
+
+  blocks = []
+  views = {}
+  for name, array in descriptor['arrays'].items():
+    if array[0] == 'shm':
+      _, shmName, shape, dtype = array
+      shm = shared_memory.SharedMemory(name = shmName)
+      blocks.append(shm)
+      views[name] = np.ndarray(shape, dtype = np.dtype(dtype), buffer = shm.buf)
+    else:
+      _, path, index = array
+      views[name] = np.load(path, mmap_mode = 'r')[index]
+    views[name].flags.writeable = False
+  _attached[datasetId] = (blocks, views)
+  return views
@@ -41,3 +41,89 @@ def binarise(byteList):
 def hw(x):
   """ Retrive the Hamming Weight of the given scalar input @x@ """
   return bin(x).count('1')
+
+# Hamming Weight of each byte value.
+hwTable = np.asarray([ hw(x) for x in range(256) ], dtype = np.uint8)
+
+def hwArray(x):
+  """ Retrieve the Hamming Weight of each element of the given (up to 32-bit) integer array @x@ """
+  x = np.ascontiguousarray(x, dtype = np.uint32)
+  return hwTable[x.view(np.uint8)].reshape(x.shape + (4,)).sum(axis = -1, dtype = np.uint8)
+
+def adcCodes(x, bits = 10):
+  """
+  Retrieve the ADC codes of the waveforms @x@, saved by ChipWhisperer as
+  fractions of the ADC range (code / 2^bits, in [-0.5, 0.5)).
+  """
+  return np.rint(np.asarray(x, dtype = np.float32) * (1 << bits)).astype(np.int16)
+
+def processingOrder(x):
+  """
+  Reorder the last axis of @x@ as processed by the MLP: each set of 8
+  inputs/weights/MACs is processed in reverse order.
+  """
+  x = np.asarray(x)
+  return x.reshape(x.shape[:-1] + (-1, 8))[..., ::-1].reshape(x.shape)
+
+def execMask(IaPAM, toExecTables):
+  """
+  Retrieve the executed MACs, in processing order, from the @IaPAM@ and the
+  @toExecTables@ loaded on the target.
+
+  Args:
+    - IaPAM: numpy array of shape (imgWidth * imgHeight // 8,).
+    - toExecTables: numpy array of shape (..., nNeurons * imgWidth * imgHeight // 8).
+
+  Return: boolean numpy array of shape (..., nNeurons * imgWidth * imgHeight).
+  """
+  # The i-th bit of each byte selects the (7 - i)-th processed MAC of the set.
+  tables = np.tile(np.asarray(IaPAM, dtype = np.uint8), p.nNeurons) | np.asarray(toExecTables, dtype = np.uint8)
+  return np.unpackbits(tables, axis = -1).astype(bool)
+
+def accumulators(inputs, neuron, execs = None):
+  """
+  Retrieve the accumulator of @neuron@ after each MAC, in processing order,
+  computed with the true weights (as the 'hyps-accum' datasets of
+  'build_hyps.py').
+
+  Args:
+    - inputs: numpy array of shape (..., imgWidth * imgHeight), in input order.
+    - neuron: the neuron index.
+    - execs: the executed MACs of @neuron@, in processing order (see
+      'execMask'); if None, all the MACs are executed.
+
+  Return: uint32 numpy array of shape (..., imgWidth * imgHeight).
+  """
+  numInputs = p.imgWidth * p.imgHeight
+  weights = processingOrder(p.weights[neuron * numInputs:(neuron + 1) * numInputs].astype(np.uint32))
+  macs = processingOrder(np.asarray(inputs, dtype = np.uint32)) * weights
+  if execs is not None:
+    macs = macs * execs
+  return np.cumsum(macs, axis = -1, dtype = np.uint32)
+
+def truncateNpy(path, n):
+  """
+  Truncate, in place, the .npy file @path@ to its first @n@ rows (e.g., a
+  memory-mapped dataset allocated for more waveforms than collected).
+  """
+  with open(path, 'r+b') as fp:
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+      shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(fp)
+      lenSize = 2
+    else:
+      shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(fp)
+      lenSize = 4
+    offset = fp.tell()
+    assert not fortranOrder and n <= shape[0]
+
+    shape = (n,) + shape[1:]
+    header = repr({ 'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape })
+    # Keep the header length unchanged, so that the data does not move.
+    prefix = np.lib.format.MAGIC_LEN + lenSize
+    header = header.ljust(offset - prefix - 1) + '\n'
+
+    fp.seek(np.lib.format.MAGIC_LEN)
+    fp.write(len(header).to_bytes(lenSize, 'little'))
+    fp.write(header.encode('latin1'))
+    fp.truncate(offset + n * int(np.prod(shape[1:], dtype = np.int64)) * dtype.itemsize)
@@ -56,6 +56,11 @@
 extern uint8_t IaPAM[IMG_SIZE / 8];
 extern uint8_t toExecTable[(IMG_SIZE / 8) * NUM_NEURONS];
 
+#if VERIFY_INFERENCE
+/* Raw sum of each neuron, verified by the host (see 'main.c'). */
+extern int32_t neuronSums[NUM_NEURONS];
+#endif
+
 tinyengine_status convolve_1x1_s8_oddch(const q7_t *input, const uint16_t input_x,
 		const uint16_t input_y, const uint16_t input_ch, const q7_t *kernel,
 		const int32_t *bias, const int32_t *output_shift,
@@ -194,6 +199,9 @@ tinyengine_status convolve_1x1_s8_oddch(const q7_t *input, const uint16_t input_
       //simpleserial_put('r', 4, (uint8_t *)&sum);
       //uint8_t ack = 0x00;
       //simpleserial_put('e', 1, &ack);
+#if VERIFY_INFERENCE
+      neuronSums[i_ch_out] = sum;
+#endif
 
 			sum = arm_nn_requantize(sum, output_mult[i_ch_out],
 					output_shift[i_ch_out]);
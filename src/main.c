@@ -46,11 +46,82 @@
  */
 #define INPUT_SIZE IMG_SIZE
 
+#define TO_EXEC_TABLE_SIZE ((IMG_SIZE / 8) * NUM_NEURONS)
+
+/* Test-vector queue:
+ * the host uploads several test vectors (toExecTable + input) per 'q'
+ * command; the 'i' command with scmd = INFER_FROM_QUEUE loads the next queued
+ * test vector before running the inference.
+ * Each queue entry is the toExecTable followed by the input.
+ */
+#ifndef QUEUE_SIZE
+#define QUEUE_SIZE 64
+#endif
+
+#define QUEUE_ENTRY_SIZE (TO_EXEC_TABLE_SIZE + INPUT_SIZE)
+
+/* 'q' sub-commands */
+#define QUEUE_RESET 0x01
+
+/* 'i' sub-commands */
+#define INFER_FROM_QUEUE 0x01
+
+/* Error codes returned by the queue commands */
+#define ERR_QUEUE_LEN   0x10
+#define ERR_QUEUE_FULL  0x11
+#define ERR_QUEUE_EMPTY 0x12
+
+/* Inference verification (VERIFY_INFERENCE, see the makefile):
+ * the kernel stores the raw sum (bias plus executed MACs) of each neuron in
+ * 'neuronSums'; after each inference, out of the trigger window, 'infer' folds
+ * the sums (little endian) in a running CRC-32 digest, and copies them in a
+ * buffer of the last VERIFY_BUFFER_SIZE inferences.
+ * The 'v' command returns the number of folded inferences and the digest, then
+ * resets them; with scmd = VERIFY_READ_SUMS, it returns the buffered sums of
+ * the inferences folded in the last returned digest instead (data: first
+ * inference, number of inferences), up to VERIFY_FRAME_ENTRIES per frame.
+ */
+#ifndef VERIFY_INFERENCE
+#define VERIFY_INFERENCE 0
+#endif
+
+#define VERIFY_BUFFER_SIZE QUEUE_SIZE
+#define VERIFY_FRAME_ENTRIES 12
+
+/* 'v' sub-commands */
+#define VERIFY_READ_SUMS 0x01
+
+/* Error codes returned by the verification commands */
+#define ERR_VERIFY_DISABLED 0x20
+#define ERR_VERIFY_RANGE    0x21
+
 uint8_t IaPAM[IMG_SIZE / 8] = { 0 };
 
-uint8_t toExecTable[(IMG_SIZE / 8) * NUM_NEURONS] = { 0 };
+uint8_t toExecTable[TO_EXEC_TABLE_SIZE] = { 0 };
 uint8_t ack = 0x00;
 
+uint8_t queue[QUEUE_SIZE][QUEUE_ENTRY_SIZE];
+uint8_t queueHead = 0;
+uint8_t queueCount = 0;
+
+#if VERIFY_INFERENCE
+int32_t neuronSums[NUM_NEURONS];
+int32_t sumsBuffer[VERIFY_BUFFER_SIZE][NUM_NEURONS];
+uint32_t digestCRC = 0xFFFFFFFF;
+uint32_t digestCount = 0;
+uint32_t lastDigestCount = 0;
+
+/* Reflected CRC-32 (polynomial 0xEDB88320), as zlib.crc32 on the host. */
+void foldDigest(const uint8_t *data, uint32_t len) {
+  for (uint32_t i = 0; i < len; i++) {
+    digestCRC ^= data[i];
+    for (uint8_t b = 0; b < 8; b++) {
+      digestCRC = (digestCRC >> 1) ^ (0xEDB88320 & -(digestCRC & 0x01));
+    }
+  }
+}
+#endif
+
 uint8_t hello(uint8_t cmd, uint8_t scmd, uint8_t len, uint8_t *data) {
   char msg[] = ">>> CWLITEARM: ready to capture!";
   uint8_t msgLen = strlen(msg);
@@ -91,12 +162,84 @@ uint8_t loadToExecTable(uint8_t cmd, uint8_t scmd, uint8_t len, uint8_t *data) {
   return 0x00;
 }
 
+uint8_t enqueue(uint8_t cmd, uint8_t scmd, uint8_t len, uint8_t *data) {
+  uint8_t numEntries = len / QUEUE_ENTRY_SIZE;
+
+  if (scmd & QUEUE_RESET) {
+    queueHead = 0;
+    queueCount = 0;
+  }
+
+  if (len % QUEUE_ENTRY_SIZE) {
+    return ERR_QUEUE_LEN;
+  }
+
+  if (queueCount + numEntries > QUEUE_SIZE) {
+    return ERR_QUEUE_FULL;
+  }
+
+  for (uint8_t i = 0; i < numEntries; i++) {
+    uint8_t tail = (queueHead + queueCount) % QUEUE_SIZE;
+    memcpy(queue[tail], data + i * QUEUE_ENTRY_SIZE, QUEUE_ENTRY_SIZE);
+    queueCount++;
+  }
+
+  return 0x00;
+}
+
 uint8_t infer(uint8_t cmd, uint8_t scmd, uint8_t len, uint8_t *data) {
   float labels[10] = { 0 };
 
+  if (scmd == INFER_FROM_QUEUE) {
+    if (queueCount == 0) {
+      return ERR_QUEUE_EMPTY;
+    }
+
+    uint8_t *entry = queue[queueHead];
+    loadToExecTable(cmd, scmd, TO_EXEC_TABLE_SIZE, entry);
+    loadInput(cmd, scmd, INPUT_SIZE, entry + TO_EXEC_TABLE_SIZE);
+
+    queueHead = (queueHead + 1) % QUEUE_SIZE;
+    queueCount--;
+  }
+
   invoke((float *)&labels);
 
+#if VERIFY_INFERENCE
+  memcpy(sumsBuffer[digestCount % VERIFY_BUFFER_SIZE], neuronSums, sizeof(neuronSums));
+  foldDigest((uint8_t *)neuronSums, sizeof(neuronSums));
+  digestCount++;
+#endif
+
+  return 0x00;
+}
+
+uint8_t verify(uint8_t cmd, uint8_t scmd, uint8_t len, uint8_t *data) {
+#if VERIFY_INFERENCE
+  if (scmd == VERIFY_READ_SUMS) {
+    uint32_t available = lastDigestCount < VERIFY_BUFFER_SIZE ? lastDigestCount : VERIFY_BUFFER_SIZE;
+
+    if (len != 2 || data[1] > VERIFY_FRAME_ENTRIES || data[0] + data[1] > available) {
+      return ERR_VERIFY_RANGE;
+    }
+
+    uint8_t first = data[0];
+    uint8_t count = data[1];
+
+    simpleserial_put('r', count * sizeof(neuronSums), (uint8_t *)sumsBuffer[first]);
+    return 0x00;
+  }
+
+  uint32_t digest[2] = { digestCount, digestCRC ^ 0xFFFFFFFF };
+  simpleserial_put('r', sizeof(digest), (uint8_t *)digest);
+
+  lastDigestCount = digestCount;
+  digestCount = 0;
+  digestCRC = 0xFFFFFFFF;
   return 0x00;
+#else
+  return ERR_VERIFY_DISABLED;
+#endif
 }
 
 int main(void) {
@@ -109,9 +252,12 @@ int main(void) {
 
   simpleserial_addcmd('a', IMG_SIZE, loadInput);
   simpleserial_addcmd('c', IMG_SIZE / 8, loadIaPAM);
-  simpleserial_addcmd('t', (IMG_SIZE / 8) * NUM_NEURONS, loadToExecTable);
+  simpleserial_addcmd('t', TO_EXEC_TABLE_SIZE, loadToExecTable);
   simpleserial_addcmd('i', 0, infer);
+  /* Up to 4 test vectors (4 * 52 bytes) per frame: see the warning above. */
+  simpleserial_addcmd('q', 4 * QUEUE_ENTRY_SIZE, enqueue);
   simpleserial_addcmd('h', 0, hello);
+  simpleserial_addcmd('v', 2, verify);
 
   signed char *input = getInput();
 